@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+""" Synthetic log generator for the MultiQC benchmarks. Writes a directory
+tree of made-up but valid logs for FastQC, Picard, Samtools, Qualimap,
+SSDS and Custom Content, so that file discovery, module parsing and report
+rendering can be timed at any size. The same arguments and seed always
+give the same files.
+
+Usage: python benchmarks/generate.py <output directory> [--samples 100] [--hist-length 200] [--extra-files 0]
+"""
+
+from __future__ import print_function
+import click
+import io
+import json
+import os
+import random
+import zipfile
+
+formats = ['fastqc', 'picard', 'samtools', 'qualimap', 'ssds', 'custom_content']
+
+
+def write_file(fn, lines):
+    if not os.path.isdir(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    with io.open(fn, 'w', encoding='utf-8') as f:
+        f.write(u'\n'.join(lines) + u'\n')
+
+
+def fastqc_data(s_name, hist_length):
+    """ fastqc_data.txt, with hist_length bases """
+    l = [
+        '##FastQC\t0.11.7',
+        '>>Basic Statistics\tpass',
+        '#Measure\tValue',
+        'Filename\t{}.fastq.gz'.format(s_name),
+        'File type\tConventional base calls',
+        'Encoding\tSanger / Illumina 1.9',
+        'Total Sequences\t{}'.format(random.randint(100000, 10000000)),
+        'Sequences flagged as poor quality\t0',
+        'Sequence length\t{}'.format(hist_length),
+        '%GC\t{}'.format(random.randint(35, 55)),
+        '>>END_MODULE',
+        '>>Per base sequence quality\tpass',
+        '#Base\tMean\tMedian\tLower Quartile\tUpper Quartile\t10th Percentile\t90th Percentile'
+    ]
+    for b in range(1, hist_length + 1):
+        m = 30 + random.random() * 8
+        l.append('{}\t{:.2f}\t{}\t{}\t{}\t{}\t{}'.format(b, m, int(m), int(m-3), int(m+2), int(m-6), int(m+3)))
+    l.extend(['>>END_MODULE', '>>Per sequence quality scores\tpass', '#Quality\tCount'])
+    for q in range(2, 41):
+        l.append('{}\t{:.1f}'.format(q, random.random() * 1e5))
+    l.extend(['>>END_MODULE', '>>Per base sequence content\tpass', '#Base\tG\tA\tT\tC'])
+    for b in range(1, hist_length + 1):
+        g, a, t = [22 + random.random() * 6 for i in range(3)]
+        l.append('{}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}'.format(b, g, a, t, 100 - g - a - t))
+    l.extend(['>>END_MODULE', '>>Per sequence GC content\tpass', '#GC Content\tCount'])
+    for gc in range(0, 101):
+        l.append('{}\t{:.1f}'.format(gc, random.random() * 1e4))
+    l.extend(['>>END_MODULE', '>>Per base N content\tpass', '#Base\tN-Count'])
+    for b in range(1, hist_length + 1):
+        l.append('{}\t{:.3f}'.format(b, random.random()))
+    l.extend(['>>END_MODULE', '>>Sequence Length Distribution\tpass', '#Length\tCount'])
+    l.append('{}\t{:.1f}'.format(hist_length, random.random() * 1e6))
+    l.extend(['>>END_MODULE', '>>Sequence Duplication Levels\tpass'])
+    l.append('#Total Deduplicated Percentage\t{:.2f}'.format(random.random() * 100))
+    l.append('#Duplication Level\tPercentage of deduplicated\tPercentage of total')
+    for d in ['1','2','3','4','5','6','7','8','9','>10','>50','>100','>500','>1k','>5k','>10k+']:
+        l.append('{}\t{:.2f}\t{:.2f}'.format(d, random.random() * 10, random.random() * 10))
+    l.extend(['>>END_MODULE', '>>Overrepresented sequences\tpass', '>>END_MODULE'])
+    l.extend(['>>Adapter Content\tpass', '#Position\tIllumina Universal Adapter\tNextera Transposase Sequence'])
+    for b in range(1, hist_length + 1):
+        l.append('{}\t{:.3f}\t{:.3f}'.format(b, random.random(), random.random()))
+    l.append('>>END_MODULE')
+    return l
+
+
+def fastqc(out_dir, s_name, idx, hist_length):
+    """ FastQC output, alternating between zip files and unzipped directories """
+    name = '{}_R1_fastqc'.format(s_name)
+    lines = fastqc_data('{}_R1'.format(s_name), hist_length)
+    if idx % 2:
+        with zipfile.ZipFile(os.path.join(out_dir, 'fastqc', name + '.zip'), 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr(name + '/', '')
+            z.writestr(name + '/fastqc_data.txt', '\n'.join(lines) + '\n')
+            z.writestr(name + '/summary.txt', 'PASS\tBasic Statistics\t{}_R1.fastq.gz\n'.format(s_name))
+    else:
+        write_file(os.path.join(out_dir, 'fastqc', name, 'fastqc_data.txt'), lines)
+
+
+def picard(out_dir, s_name, idx, hist_length):
+    """ MarkDuplicates metrics and InsertSizeMetrics with a hist_length histogram """
+    pairs = random.randint(100000, 10000000)
+    dups = int(pairs * random.random() * 0.5)
+    write_file(os.path.join(out_dir, 'picard', '{}.markdups.metrics'.format(s_name)), [
+        '## htsjdk.samtools.metrics.StringHeader',
+        '# picard.sam.markduplicates.MarkDuplicates INPUT=[{0}.bam] OUTPUT={0}.dedup.bam METRICS_FILE={0}.markdups.metrics'.format(s_name),
+        '',
+        '## METRICS CLASS\tpicard.sam.DuplicationMetrics',
+        '\t'.join(['LIBRARY', 'UNPAIRED_READS_EXAMINED', 'READ_PAIRS_EXAMINED', 'SECONDARY_OR_SUPPLEMENTARY_RDS',
+                   'UNMAPPED_READS', 'UNPAIRED_READ_DUPLICATES', 'READ_PAIR_DUPLICATES', 'READ_PAIR_OPTICAL_DUPLICATES',
+                   'PERCENT_DUPLICATION', 'ESTIMATED_LIBRARY_SIZE']),
+        '\t'.join(str(v) for v in [s_name, 1000, pairs, 0, random.randint(0, 10000), 100, dups, dups // 10,
+                                   float(dups) / pairs, pairs * 2]),
+        ''
+    ])
+    counts = [int(1e5 * random.random() * (1 - abs(i - hist_length / 2.0) / hist_length)) for i in range(1, hist_length + 1)]
+    mean = sum((i + 1) * c for i, c in enumerate(counts)) / float(max(sum(counts), 1))
+    l = [
+        '## htsjdk.samtools.metrics.StringHeader',
+        '# picard.analysis.CollectInsertSizeMetrics HISTOGRAM_FILE={0}.pdf INPUT={0}.bam OUTPUT={0}.insert_size_metrics'.format(s_name),
+        '',
+        '## METRICS CLASS\tpicard.analysis.InsertSizeMetrics',
+        '\t'.join(['MEDIAN_INSERT_SIZE', 'MEAN_INSERT_SIZE', 'STANDARD_DEVIATION', 'READ_PAIRS', 'PAIR_ORIENTATION']),
+        '\t'.join(str(v) for v in [hist_length // 2, mean, hist_length / 4.0, sum(counts), 'FR']),
+        '',
+        '## HISTOGRAM\tjava.lang.Integer',
+        'insert_size\tAll_Reads.fr_count'
+    ]
+    l.extend('{}\t{}'.format(i + 1, c) for i, c in enumerate(counts))
+    l.append('')
+    write_file(os.path.join(out_dir, 'picard', '{}.insert_size_metrics'.format(s_name)), l)
+
+
+def samtools(out_dir, s_name, idx, hist_length):
+    """ samtools stats, flagstat and idxstats """
+    total = random.randint(100000, 10000000)
+    mapped = int(total * (0.8 + random.random() * 0.2))
+    write_file(os.path.join(out_dir, 'samtools', '{}.stats'.format(s_name)), [
+        '# This file was produced by samtools stats',
+        'SN\traw total sequences:\t{}'.format(total),
+        'SN\treads mapped:\t{}'.format(mapped),
+        'SN\treads unmapped:\t{}'.format(total - mapped),
+        'SN\treads properly paired:\t{}'.format(int(mapped * 0.9)),
+        'SN\treads duplicated:\t{}'.format(int(mapped * 0.1)),
+        'SN\tbases mapped (cigar):\t{}'.format(mapped * 100),
+        'SN\taverage length:\t100',
+        'SN\tinsert size average:\t{:.1f}'.format(200 + random.random() * 100),
+        'SN\terror rate:\t{:.4e}'.format(random.random() * 0.01),
+        'SN\tmaximum length:\t100',
+        'SN\tnon-primary alignments:\t{}'.format(random.randint(0, 1000)),
+        'SN\treads MQ0:\t{}'.format(random.randint(0, 1000))
+    ])
+    write_file(os.path.join(out_dir, 'samtools', '{}.flagstat'.format(s_name)), [
+        '{} + 0 in total (QC-passed reads + QC-failed reads)'.format(total),
+        '0 + 0 secondary',
+        '0 + 0 supplementary',
+        '{} + 0 duplicates'.format(int(mapped * 0.1)),
+        '{} + 0 mapped ({:.2f}% : N/A)'.format(mapped, 100.0 * mapped / total),
+        '{} + 0 paired in sequencing'.format(total),
+        '{} + 0 read1'.format(total // 2),
+        '{} + 0 read2'.format(total - total // 2),
+        '{} + 0 properly paired ({:.2f}% : N/A)'.format(int(mapped * 0.9), 90.0 * mapped / total),
+        '{} + 0 with itself and mate mapped'.format(int(mapped * 0.95)),
+        '{} + 0 singletons ({:.2f}% : N/A)'.format(int(mapped * 0.05), 5.0 * mapped / total),
+        '0 + 0 with mate mapped to a different chr',
+        '0 + 0 with mate mapped to a different chr (mapQ>=5)'
+    ])
+    l = ['chr{}\t{}\t{}\t{}'.format(c, 1000000 * (25 - c), random.randint(0, 100000), random.randint(0, 1000)) for c in range(1, 23)]
+    l.append('*\t0\t0\t{}'.format(total - mapped))
+    write_file(os.path.join(out_dir, 'samtools', '{}.idxstats'.format(s_name)), l)
+
+
+def qualimap(out_dir, s_name, idx, hist_length):
+    """ Qualimap BamQC genome results and raw data histograms """
+    qdir = os.path.join(out_dir, 'qualimap', s_name)
+    total = random.randint(100000, 10000000)
+    mapped = int(total * (0.8 + random.random() * 0.2))
+    write_file(os.path.join(qdir, 'genome_results.txt'), [
+        'BamQC report',
+        '-----------------------------------',
+        '>>>>>>> Input',
+        '     bam file = {}.bam'.format(s_name),
+        '>>>>>>> Reference',
+        '     number of bases = 3,000,000,000 bp',
+        '>>>>>>> Globals',
+        '     number of reads = {:,}'.format(total),
+        '     number of mapped reads = {:,}'.format(mapped),
+        '     number of mapped bases = {:,} bp'.format(mapped * 100),
+        '     number of sequenced bases = {:,} bp'.format(total * 100),
+        '>>>>>>> Insert size',
+        '     mean insert size = {:.4f}'.format(200 + random.random() * 100),
+        '     median insert size = {}'.format(random.randint(200, 300)),
+        '>>>>>>> Mapping quality',
+        '     mean mapping quality = {:.4f}'.format(30 + random.random() * 30),
+        '>>>>>>> Mismatches and indels',
+        '     general error rate = {:.4f}'.format(random.random() * 0.01)
+    ])
+    raw_dir = os.path.join(qdir, 'raw_data_qualimapReport')
+    l = ['#Coverage\tNumber of genomic locations']
+    l.extend('{:.1f}\t{}'.format(i, int(1e6 * random.random() / (1 + i * 0.1))) for i in range(hist_length))
+    write_file(os.path.join(raw_dir, 'coverage_histogram.txt'), l)
+    l = ['#Insert size\tOccurrences']
+    l.extend('{:.1f}\t{}'.format(i, int(1e6 * random.random())) for i in range(hist_length))
+    write_file(os.path.join(raw_dir, 'insert_size_histogram.txt'), l)
+    l = ['#GC content\tSample']
+    l.extend('{:.1f}\t{:.6f}'.format(i, random.random() * 0.02) for i in range(101))
+    write_file(os.path.join(raw_dir, 'mapped_reads_gc-content_distribution.txt'), l)
+
+
+def ssds(out_dir, s_name, idx, hist_length):
+    """ SSDS *.SSDSreport.tab with hist_length rows per histogram """
+    types = ['ssDNA_type1', 'ssDNA_type2', 'dsDNA', 'unclassified']
+    l = []
+    for k, v in [('total_fragments', 1e6), ('adapter', 1e4), ('ssDNA_type1_fragments', 3e5), ('ssDNA_type2_fragments', 1e5),
+                 ('dsDNA_fragments', 2e5), ('unclassified_fragments', 5e4), ('unique_ssDNA_type1_fragments', 2e5)]:
+        l.append('totinfo\t{}\t{}'.format(k, int(v * random.random() + 1)))
+    for t in ['ssType1', 'ssType2', 'dsDNA', 'unclassified']:
+        for a in ['hs_A', 'hs_B']:
+            l.append('FRIP_{}\t{}\t{}'.format(t, a, random.random() * 10))
+    for p in ['Fragments', 'ITR', 'uH', 'Offset']:
+        for t in types:
+            for i in range(1, hist_length + 1):
+                l.append('{}_{}\t{}\t{}'.format(p, t, i, random.randint(0, 1000)))
+    write_file(os.path.join(out_dir, 'ssds', '{}.SSDSreport.tab'.format(s_name)), l)
+
+
+def custom_content(out_dir, s_name, idx, hist_length):
+    """ A bar graph TSV and a line graph JSON file for each sample, merged by their IDs """
+    write_file(os.path.join(out_dir, 'custom_content', '{}_bar_mqc.tsv'.format(s_name)), [
+        "# id: 'benchmark_bargraph'",
+        "# section_name: 'Benchmark bar graph'",
+        "# plot_type: 'bargraph'",
+        'Sample\tCategory A\tCategory B\tCategory C',
+        '{}\t{}\t{}\t{}'.format(s_name, random.randint(0, 1000), random.randint(0, 1000), random.randint(0, 1000))
+    ])
+    data = {
+        'id': 'benchmark_linegraph',
+        'section_name': 'Benchmark line graph',
+        'plot_type': 'linegraph',
+        'data': {s_name: dict((str(i), random.random() * 100) for i in range(1, hist_length + 1))}
+    }
+    write_file(os.path.join(out_dir, 'custom_content', '{}_line_mqc.json'.format(s_name)), [json.dumps(data)])
+
+
+def extra_files(out_dir, num_files):
+    """ Files that no module should pick up, to give discovery something to skip """
+    for i in range(num_files):
+        write_file(os.path.join(out_dir, 'other', 'dir{:03d}'.format(i // 100), 'file{:06d}.txt'.format(i)),
+            ['Not a log file {}'.format(i)] * 10)
+
+
+def generate(out_dir, samples=100, hist_length=200, extra=0, use_formats=None, seed=1):
+    """ Write a tree of synthetic logs to out_dir. Returns the number of files written. """
+    random.seed(seed)
+    if use_formats is None:
+        use_formats = formats
+    if not os.path.isdir(os.path.join(out_dir, 'fastqc')):
+        os.makedirs(os.path.join(out_dir, 'fastqc'))
+    generators = dict((f, globals()[f]) for f in formats)
+    for idx in range(samples):
+        s_name = 'sample{:05d}'.format(idx)
+        for f in use_formats:
+            generators[f](out_dir, s_name, idx, hist_length)
+    extra_files(out_dir, extra)
+    return sum(len(fns) for _, _, fns in os.walk(out_dir))
+
+
+@click.command()
+@click.argument('out_dir', type=click.Path())
+@click.option('--samples', type=int, default=100, help="Number of samples. Default: 100")
+@click.option('--hist-length', type=int, default=200, help="Number of rows in each histogram. Default: 200")
+@click.option('--extra-files', type=int, default=0, help="Number of unrelated files to add. Default: 0")
+@click.option('--format', 'use_formats', type=click.Choice(formats), multiple=True, help="Only make logs for these tools. Default: all")
+@click.option('--seed', type=int, default=1, help="Random seed. Default: 1")
+def generate_cmd(out_dir, samples, hist_length, extra_files, use_formats, seed):
+    """ Write synthetic MultiQC input logs to OUT_DIR """
+    num_files = generate(out_dir, samples, hist_length, extra_files, list(use_formats) or None, seed)
+    print("Wrote {} files to {}".format(num_files, out_dir))
+
+
+if __name__ == '__main__':
+    generate_cmd()
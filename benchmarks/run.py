@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+""" MultiQC benchmark suite. Generates synthetic log trees of increasing
+size (see generate.py) and runs MultiQC on each with --profile, timing file
+discovery, each module, the General Statistics table and report rendering.
+Prints the median times for each size with a scaling exponent, and saves
+the results as JSON or TSV so that they can be tracked over time.
+
+Usage: python benchmarks/run.py [--samples 10,100,1000] [--hist-length 200] [--repeats 3]
+                                [--output results.json] [--compare previous.json]
+
+Startup time is measured separately, by startup.py.
+"""
+
+from __future__ import print_function
+from collections import OrderedDict
+import click
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+script_fn = os.path.join(repo_dir, 'scripts', 'multiqc')
+
+# Profile phases reported as scenarios, with the names used in the results
+phase_scenarios = OrderedDict([
+    ('get_filelist', 'discovery'),
+    ('module: fastqc', 'module: fastqc'),
+    ('module: picard', 'module: picard'),
+    ('module: samtools', 'module: samtools'),
+    ('module: qualimap', 'module: qualimap'),
+    ('module: ssds', 'module: ssds'),
+    ('module: custom_content', 'module: custom_content'),
+    ('general stats', 'general stats'),
+    ('compress plot data', 'compress plot data'),
+    ('template render', 'render')
+])
+
+
+def run_multiqc(in_dir, out_dir, extra_args):
+    """ Run MultiQC with --profile and return its wall time, CPU time and profile """
+    if os.path.isfile(script_fn):
+        cmd = [sys.executable, script_fn]
+    else:
+        cmd = ['multiqc']
+    cmd += [in_dir, '--profile', '--force', '--outdir', out_dir, '--cl_config', 'no_version_check: true'] + extra_args
+    start = time.time()
+    start_cpu = os.times()
+    subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    wall_time = time.time() - start
+    end_cpu = os.times()
+    cpu_time = (end_cpu[2] + end_cpu[3]) - (start_cpu[2] + start_cpu[3])
+    with io.open(os.path.join(out_dir, 'multiqc_data', 'multiqc_profile.json'), encoding='utf-8') as f:
+        return wall_time, cpu_time, json.load(f)
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+
+def scaling_exponent(sizes, times):
+    """ Slope of log(time) against log(size) between the smallest and largest
+    sizes: ~1 is linear, ~2 is quadratic. None if it can't be worked out. """
+    if len(sizes) < 2 or sizes[0] == sizes[-1] or min(times[0], times[-1]) < 0.001:
+        return None
+    return math.log(times[-1] / times[0]) / math.log(float(sizes[-1]) / sizes[0])
+
+
+def summarise(results):
+    """ Median wall time, CPU time and peak memory for each scenario and size """
+    grouped = OrderedDict()
+    for r in results:
+        grouped.setdefault((r['scenario'], r['samples']), []).append(r)
+    summary = list()
+    for (scenario, samples), rs in grouped.items():
+        mem = [r['peak_memory_mb'] for r in rs if r['peak_memory_mb'] is not None]
+        summary.append(OrderedDict([
+            ('scenario', scenario),
+            ('samples', samples),
+            ('hist_length', rs[0]['hist_length']),
+            ('files', rs[0]['files']),
+            ('repeats', len(rs)),
+            ('wall_time', median([r['wall_time'] for r in rs])),
+            ('wall_time_min', min([r['wall_time'] for r in rs])),
+            ('cpu_time', median([r['cpu_time'] for r in rs])),
+            ('peak_memory_mb', max(mem) if len(mem) > 0 else None)
+        ]))
+    return summary
+
+
+def print_table(summary, sizes, previous=None):
+    """ Print median wall times with one column per size, and compare against previous results """
+    times = OrderedDict()
+    for s in summary:
+        times.setdefault(s['scenario'], dict())[s['samples']] = s['wall_time']
+    prev_times = dict()
+    for s in (previous or {}).get('summary', []):
+        prev_times[(s['scenario'], s['samples'])] = s['wall_time']
+    header = '{:<24}'.format('Scenario') + ''.join('{:>12}'.format('{} samples'.format(n)) for n in sizes) + '{:>10}'.format('Scaling')
+    print(header)
+    print('-' * len(header))
+    for scenario, t in times.items():
+        row = '{:<24}'.format(scenario)
+        for n in sizes:
+            row += '{:>12}'.format('{:.3f}s'.format(t[n]) if n in t else '-')
+        exp = scaling_exponent([n for n in sizes if n in t], [t[n] for n in sizes if n in t])
+        row += '{:>10}'.format('n^{:.2f}'.format(exp) if exp is not None else '-')
+        print(row)
+        if previous is not None:
+            row = '{:<24}'.format('  vs previous')
+            for n in sizes:
+                p = prev_times.get((scenario, n))
+                row += '{:>12}'.format('{:.2f}x'.format(t[n] / p) if n in t and p else '-')
+            print(row)
+
+
+def regressions(summary, previous, max_ratio, min_seconds=0.05):
+    """ Scenarios that are more than max_ratio times slower than in the previous results """
+    prev_times = dict()
+    for s in previous.get('summary', []):
+        prev_times[(s['scenario'], s['samples'])] = s['wall_time']
+    slow = list()
+    for s in summary:
+        p = prev_times.get((s['scenario'], s['samples']))
+        if p and s['wall_time'] > min_seconds and s['wall_time'] / p > max_ratio:
+            slow.append('{} with {} samples: {:.3f}s, was {:.3f}s'.format(s['scenario'], s['samples'], s['wall_time'], p))
+    return slow
+
+
+def write_results(output, results, summary, meta):
+    """ Save the results as JSON, or as TSV if the filename ends with .tsv """
+    with io.open(output, 'w', encoding='utf-8') as f:
+        if output.endswith('.tsv'):
+            keys = list(summary[0].keys())
+            print(u'\t'.join(keys), file=f)
+            for s in summary:
+                print(u'\t'.join('' if s[k] is None else str(s[k]) for k in keys), file=f)
+        else:
+            data = OrderedDict([('meta', meta), ('summary', summary), ('results', results)])
+            print(json.dumps(data, indent=4, ensure_ascii=False), file=f)
+
+
+@click.command()
+@click.option('--samples', default='10,100,1000', help="Comma-separated numbers of samples to generate. Default: 10,100,1000")
+@click.option('--hist-length', type=int, default=200, help="Number of rows in each histogram. Default: 200")
+@click.option('--extra-files', type=int, default=0, help="Number of unrelated files to add to each tree. Default: 0")
+@click.option('--format', 'use_formats', type=click.Choice(generate.formats), multiple=True, help="Only make logs for these tools. Default: all")
+@click.option('--repeats', type=int, default=3, help="Number of MultiQC runs for each size. Default: 3")
+@click.option('--multiqc-args', default='', help="Extra command line arguments for MultiQC, eg. '--module-jobs 4'")
+@click.option('-o', '--output', type=click.Path(), help="Save the results to this JSON or TSV file")
+@click.option('--compare', type=click.Path(exists=True), help="JSON results from an earlier run to compare against")
+@click.option('--max-ratio', type=float, help="With --compare, fail if any scenario is this many times slower")
+@click.option('--keep', type=click.Path(), help="Keep the generated logs and reports in this directory")
+def benchmark(samples, hist_length, extra_files, use_formats, repeats, multiqc_args, output, compare, max_ratio, keep):
+    """ Time MultiQC on synthetic data of increasing size """
+    sizes = sorted(int(n) for n in samples.split(','))
+    extra_args = shlex.split(multiqc_args)
+    from multiqc.utils import config
+    meta = OrderedDict([
+        ('multiqc_version', config.short_version),
+        ('git_hash', config.git_hash),
+        ('python_version', platform.python_version()),
+        ('platform', platform.platform()),
+        ('hostname', platform.node()),
+        ('date', datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+        ('samples', sizes),
+        ('hist_length', hist_length),
+        ('extra_files', extra_files),
+        ('formats', list(use_formats) or generate.formats),
+        ('repeats', repeats),
+        ('multiqc_args', extra_args)
+    ])
+
+    work_dir = keep if keep is not None else tempfile.mkdtemp(prefix='multiqc_benchmark_')
+    results = list()
+    try:
+        for n in sizes:
+            in_dir = os.path.join(work_dir, 'logs_{}'.format(n))
+            out_dir = os.path.join(work_dir, 'report_{}'.format(n))
+            if os.path.exists(in_dir):
+                shutil.rmtree(in_dir)
+            num_files = generate.generate(in_dir, n, hist_length, extra_files, list(use_formats) or None)
+            print("Generated {} files for {} samples".format(num_files, n), file=sys.stderr)
+            for i in range(repeats):
+                wall_time, cpu_time, profile = run_multiqc(in_dir, out_dir, extra_args)
+                phases = dict((p['phase'], p) for p in profile['phases'])
+                peak_mem = [p['peak_memory_mb'] for p in profile['phases'] if p['peak_memory_mb'] is not None]
+                rows = [('total', {'wall_time': wall_time, 'cpu_time': cpu_time, 'peak_memory_mb': max(peak_mem) if peak_mem else None})]
+                rows += [(name, phases[p]) for p, name in phase_scenarios.items() if p in phases]
+                for name, p in rows:
+                    results.append(OrderedDict([
+                        ('scenario', name),
+                        ('samples', n),
+                        ('hist_length', hist_length),
+                        ('files', num_files),
+                        ('repeat', i + 1),
+                        ('wall_time', p['wall_time']),
+                        ('cpu_time', p['cpu_time']),
+                        ('peak_memory_mb', p['peak_memory_mb'])
+                    ]))
+    except subprocess.CalledProcessError as e:
+        print(e.output.decode('utf-8', 'replace'), file=sys.stderr)
+        print("FAIL: MultiQC exited with code {}".format(e.returncode), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if keep is None:
+            shutil.rmtree(work_dir)
+
+    summary = summarise(results)
+    previous = None
+    if compare is not None:
+        with io.open(compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_table(summary, sizes, previous)
+    if output is not None:
+        write_results(output, results, summary, meta)
+        print("Results saved to {}".format(output), file=sys.stderr)
+    if previous is not None and max_ratio is not None:
+        slow = regressions(summary, previous, max_ratio)
+        if len(slow) > 0:
+            print("FAIL: slower than the previous results:\n  " + "\n  ".join(slow))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+""" MultiQC startup benchmark. Times how long MultiQC takes to start, by
+running `multiqc --version` and importing the core modules in new Python
+processes. Also checks that slow libraries aren't loaded at startup.
+Exits with an error if a check fails or startup is slower than --max-seconds.
+
+Usage: python benchmarks/startup.py [--runs 10] [--max-seconds 0.5]
+"""
+
+from __future__ import print_function
+import click
+import os
+import subprocess
+import sys
+import time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+script_fn = os.path.join(repo_dir, 'scripts', 'multiqc')
+
+# Imported when MultiQC starts, before any modules are run
+startup_imports = [
+    'multiqc.utils.config',
+    'multiqc.utils.report',
+    'multiqc.utils.plugin_hooks',
+    'multiqc.plots.linegraph',
+    'multiqc.plots.bargraph'
+]
+# These should only be loaded once they are needed
+lazy_imports = ['matplotlib', 'pkg_resources', 'requests']
+
+import_check = """
+import sys
+import {}
+print(' '.join(m for m in {!r} if m in sys.modules))
+""".format(', '.join(startup_imports), lazy_imports)
+
+
+def time_command(cmd, runs):
+    """ Run a command several times and return the time taken by each run """
+    times = list()
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        times.append(time.time() - start)
+    return times
+
+
+@click.command()
+@click.option('--runs', type=int, default=10, help="Number of times to run each command. Default: 10")
+@click.option('--max-seconds', type=float, help="Fail if the median time to run `multiqc --version` is longer than this")
+def startup_benchmark(runs, max_seconds):
+    """ Time MultiQC startup """
+    if os.path.isfile(script_fn):
+        version_cmd = [sys.executable, script_fn, '--version']
+    else:
+        version_cmd = ['multiqc', '--version']
+    import_cmd = [sys.executable, '-c', import_check]
+
+    # Run once first, so that the startup caches are made
+    subprocess.check_output(version_cmd, stderr=subprocess.STDOUT)
+    subprocess.check_output(import_cmd)
+    loaded = subprocess.check_output(import_cmd, universal_newlines=True).split()
+
+    failed = False
+    for name, cmd in [('multiqc --version', version_cmd), ('import core modules', import_cmd)]:
+        times = sorted(time_command(cmd, runs))
+        median = times[len(times) // 2]
+        print("{:<22} median {:.3f}s   min {:.3f}s   max {:.3f}s".format(name, median, times[0], times[-1]))
+        if name == 'multiqc --version' and max_seconds is not None and median > max_seconds:
+            print("FAIL: median startup time is longer than {:.3f}s".format(max_seconds))
+            failed = True
+    if len(loaded) > 0:
+        print("FAIL: libraries loaded at startup: {}".format(', '.join(loaded)))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    startup_benchmark()
@@ -4,19 +4,65 @@
 
 from __future__ import print_function
 from collections import OrderedDict
+from contextlib import contextmanager
 import io
 import fnmatch
 import logging
 import markdown
+import mmap
 import os
 import re
 import textwrap
+import time
 
-from multiqc.utils import report, config, util_functions
+from multiqc.utils import report, config, util_functions, cache, profiling, shard
 logger = logging.getLogger(__name__)
 
+class LogFileLines(object):
+    """
+    Lines of an open log file, returned by find_log_files(filelines=True).
+    Lines are read and decoded one at a time, without their line endings.
+    Each loop over the object starts again from the beginning of the file,
+    if the file can seek.
+    """
+
+    def __init__(self, fh, fn):
+        self.fh = fh
+        self.fn = fn
+
+    def __iter__(self):
+        if self.fh.seekable():
+            self.fh.seek(0)
+        for i, line in enumerate(self.fh):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                logger.debug("Replacing invalid UTF-8 characters in line {} of {}".format(i+1, self.fn))
+                line = line.decode('utf-8', 'replace')
+            # splitlines() also handles \r and other line breaks, like the text mode file contents
+            for l in line.splitlines():
+                yield l
+
+    @contextmanager
+    def stream(self):
+        """ The whole file as a text stream, for parsers such as yaml and json
+        that read the file themselves. The file is left open afterwards. """
+        if self.fh.seekable():
+            self.fh.seek(0)
+        text = io.TextIOWrapper(self.fh, encoding='utf-8')
+        try:
+            yield text
+        finally:
+            text.detach()
+
+
 class BaseMultiqcModule(object):
 
+    # Attributes that hold the parsed data, for modules that find and parse
+    # their logs in parse_log_files() before making any report sections.
+    # The parsed data of these modules can be saved and combined with --shard and --reduce.
+    state_attrs = list()
+
     def __init__(self, name='base', anchor='base', target=None, href=None, info=None, comment=None, extra=None,
                  autoformat=True, autoformat_type='markdown'):
 
@@ -57,11 +103,22 @@ class BaseMultiqcModule(object):
 
         self.sections = list()
 
-    def find_log_files(self, sp_key, filecontents=True, filehandles=False):
+    def find_log_files(self, sp_key, filecontents=True, filehandles=False, filelines=False, filemmap=False, cache_parsed=False):
         """
         Return matches log files of interest.
         :param sp_key: Search pattern key specified in config
         :param filehandles: Set to true to return a file handle instead of slurped file contents
+        :param filelines: Set to true to return the lines of the file, without line endings, instead of
+                          slurped file contents. Lines are read and decoded lazily as they are iterated
+                          over, and invalid UTF-8 is replaced line by line instead of skipping the file.
+                          Gives the same lines as f['f'].splitlines() without loading the whole file.
+                          f['f'].stream() gives the whole file as a text stream instead.
+        :param filemmap: Set to true to return a read-only memory map of the raw file bytes instead of
+                         slurped file contents. Useful for searching large files with bytes regexes.
+        :param cache_parsed: Set to true if the module saves its parsed result for each file
+                             in f['parsed']. With config.parse_cache enabled, files unchanged
+                             since a previous run come back with f['parsed'] already set and
+                             are not opened (f['f'] is None). Otherwise f['parsed'] is None.
         :return: Yields a dict with filename (fn), root directory (root), cleaned sample name
                  generated from the filename (s_name) and either the file contents or file handle
                  for the current matched file (f).
@@ -89,6 +146,12 @@ class BaseMultiqcModule(object):
             logger.warn("Did not understand find_log_files() search key")
             return
 
+        # Set up the parsed data cache if the module supports it
+        parse_cache = None
+        if cache_parsed and config.parse_cache:
+            parse_cache = cache.get_parse_cache()
+            cache_module, cache_version = self._parse_cache_key()
+
         for f in report.files[sp_key]:
             # Make a note of the filename so that we can report it if something crashes
             report.last_found_file = os.path.join(f['root'], f['fn'])
@@ -110,8 +173,42 @@ class BaseMultiqcModule(object):
                     logger.debug("{} - Selecting '{}' as it matched the path_filters for '{}'".format(sp_key, f['fn'], self.name))
 
             # Make a sample name from the filename
+            parse_start = time.time()
             f['s_name'] = self.clean_s_name(f['fn'], f['root'])
-            if filehandles or filecontents:
+
+            # Use the previously parsed results if the file hasn't changed
+            if cache_parsed:
+                f['parsed'] = None
+                if parse_cache is not None:
+                    f['parsed'] = parse_cache.get(cache_module, sp_key, f, cache_version)
+                    if f['parsed'] is not None:
+                        f['f'] = None
+                        yield f
+                        profiling.add_file(self.name, sp_key, f, parse_start)
+                        continue
+
+            if filelines or filemmap:
+                try:
+                    with io.open (os.path.join(f['root'],f['fn']), "rb") as fh:
+                        if filelines:
+                            f['f'] = LogFileLines(fh, f['fn'])
+                            yield f
+                        else:
+                            try:
+                                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                            except ValueError:
+                                mm = None # Can't map an empty file
+                            f['f'] = mm if mm is not None else b''
+                            try:
+                                yield f
+                            finally:
+                                if mm is not None:
+                                    mm.close()
+                except (IOError, OSError, ValueError):
+                    if config.report_readerrors:
+                        logger.debug("Couldn't open filehandle when returning file: {}".format(f['fn']))
+                        f['f'] = None
+            elif filehandles or filecontents:
                 try:
                     with io.open (os.path.join(f['root'],f['fn']), "r", encoding='utf-8') as fh:
                         if filehandles:
@@ -126,6 +223,42 @@ class BaseMultiqcModule(object):
                         f['f'] = None
             else:
                 yield f
+            profiling.add_file(self.name, sp_key, f, parse_start)
+
+            # Save the parsed results for next time
+            if parse_cache is not None and f.get('parsed') is not None:
+                parse_cache.add(cache_module, sp_key, f, cache_version, f['parsed'])
+
+        if parse_cache is not None:
+            parse_cache.commit()
+
+    def _parse_cache_key(self):
+        return self.__class__.__module__, '{} {}'.format(config.version, getattr(self, 'parse_cache_version', ''))
+
+    def save_parsed(self, sp_key, files):
+        """ Save f['parsed'] for each file to the parsed data cache. For modules that
+        collect the files from find_log_files(cache_parsed=True) and parse them after
+        the loop, as the results can't be saved as each file is returned then. """
+        if not config.parse_cache:
+            return
+        parse_cache = cache.get_parse_cache()
+        cache_module, cache_version = self._parse_cache_key()
+        for f in files:
+            if f.get('parsed') is not None:
+                parse_cache.add(cache_module, sp_key, f, cache_version, f['parsed'])
+        parse_cache.commit()
+
+    def parse_state(self):
+        """ Fill in the parsed data attributes listed in state_attrs by calling the
+        module's parse_log_files(). With --shard, the parsed data is then saved and the
+        module stops here. With --reduce, the parsed data from the shards is loaded instead. """
+        if config.reduce:
+            shard.load_module_state(self)
+            return
+        self.parse_log_files()
+        if config.shard is not None:
+            shard.save_module_state(self)
+            raise shard.ShardSaved
 
     def add_section(self, name=None, anchor=None, description='', comment='', helptext='', plot='', content='', autoformat=True, autoformat_type='markdown'):
         """ Add a section to the module report output """
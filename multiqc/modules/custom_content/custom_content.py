@@ -65,7 +65,7 @@ def custom_module_classes():
     bm = BaseMultiqcModule()
     for k in search_patterns:
         num_sp_found_files = 0
-        for f in bm.find_log_files(k):
+        for f in bm.find_log_files(k, filelines=True):
             num_sp_found_files += 1
             # Handle any exception without messing up for remaining custom content files
             try:
@@ -80,7 +80,8 @@ def custom_module_classes():
                         def dict_constructor(loader, node):
                             return OrderedDict(loader.construct_pairs(node))
                         yaml.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, dict_constructor)
-                        parsed_data = yaml.load(f['f'])
+                        with f['f'].stream() as fh:
+                            parsed_data = yaml.load(fh)
                     except Exception as e:
                         log.warning("Error parsing YAML file '{}' (probably invalid YAML)".format(f['fn']))
                         log.warning("YAML error: {}".format(e))
@@ -88,7 +89,8 @@ def custom_module_classes():
                 elif f_extension == '.json':
                     try:
                         # Use OrderedDict for objects so that column order is honoured
-                        parsed_data = json.loads(f['f'], object_pairs_hook=OrderedDict)
+                        with f['f'].stream() as fh:
+                            parsed_data = json.load(fh, object_pairs_hook=OrderedDict)
                     except Exception as e:
                         log.warning("Error parsing JSON file '{}' (probably invalid JSON)".format(f['fn']))
                         log.warning("JSON error: {}".format(e))
@@ -293,7 +295,7 @@ class MultiqcModule(BaseMultiqcModule):
 def _find_file_header(f):
     # Collect commented out header lines
     hlines = []
-    for l in f['f'].splitlines():
+    for l in f['f']:
         if l.startswith('#'):
             hlines.append(l[1:])
     hconfig = None
@@ -322,7 +324,7 @@ def _guess_file_format(f):
     commas = []
     spaces = []
     j = 0
-    for l in f['f'].splitlines():
+    for l in f['f']:
         if not l.startswith('#'):
             j += 1
             tabs.append(len(l.split("\t")))
@@ -362,19 +364,20 @@ def _parse_txt(f, conf):
         sep = ","
     if conf['file_format'] == 'tsv':
         sep = "\t"
-    lines = f['f'].splitlines()
     d = []
 
     # Check for special case - HTML
     if conf.get('plot_type') == 'html':
-        for l in lines:
+        for l in f['f']:
             if l and not l.startswith('#'):
                 d.append(l)
         return ("\n".join(d), conf)
 
     # Not HTML, need to parse data
     ncols = None
-    for l in lines:
+    num_lines = 0
+    for l in f['f']:
+        num_lines += 1
         if l and not l.startswith('#'):
             sections = l.split(sep)
             d.append(sections)
@@ -410,7 +413,7 @@ def _parse_txt(f, conf):
         return (data, conf)
 
     # Heatmap: Number of headers == number of lines
-    if conf.get('plot_type') is None and first_row_str == len(lines) and all_numeric:
+    if conf.get('plot_type') is None and first_row_str == num_lines and all_numeric:
         conf['plot_type'] = 'heatmap'
     if conf.get('plot_type') == 'heatmap':
         conf['xcats'] = d[0][1:]
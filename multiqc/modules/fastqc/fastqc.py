@@ -15,19 +15,59 @@ from collections import OrderedDict
 import io
 import json
 import logging
+import multiprocessing
 import os
 import re
 import zipfile
 
 from multiqc import config
 from multiqc.plots import linegraph, bargraph
-from multiqc.modules.base_module import BaseMultiqcModule
+from multiqc.modules.base_module import BaseMultiqcModule, LogFileLines
 
 # Initialise the logger
 log = logging.getLogger(__name__)
 
+def read_zip_report(path, parse):
+    """ Stream the lines of fastqc_data.txt from a FastQC zip file into
+    parse(), without reading any other part of the zip file. Returns a
+    status and the parsed data, or the reason that it couldn't be read. """
+    try:
+        fqc_zip = zipfile.ZipFile(path)
+    except Exception as e:
+        return 'bad_zip', str(e)
+    try:
+        # FastQC zip files should have just one directory inside, containing report
+        names = fqc_zip.namelist()
+        d_name = names[0].split('/')[0] if len(names) > 0 else ''
+        try:
+            fh = fqc_zip.open('{}/fastqc_data.txt'.format(d_name))
+        except KeyError:
+            return 'no_data', None
+        with fh:
+            return 'ok', parse(LogFileLines(fh, path))
+    finally:
+        fqc_zip.close()
+
+def available_cpus():
+    """ Number of CPUs this process is allowed to run on """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count() # Not Linux, or Python 2
+
+# With zip_jobs: 0, fewer zip files than this are read without a pool
+zip_pool_min_files = 20
+
+# Parse function for the zip file workers, set before they are forked
+zip_worker_parse = None
+def zip_worker(path):
+    return read_zip_report(path, zip_worker_parse)
+
 class MultiqcModule(BaseMultiqcModule):
 
+    # Parsed data, saved by --shard
+    state_attrs = ['fastqc_data', 'dup_keys']
+
     def __init__(self):
 
         # Initialise the parent object
@@ -37,35 +77,8 @@ class MultiqcModule(BaseMultiqcModule):
         " written by Simon Andrews at the Babraham Institute in Cambridge.")
 
         self.fastqc_data = dict()
-
-        # Find and parse unzipped FastQC reports
-        for f in self.find_log_files('fastqc/data'):
-            s_name = self.clean_s_name(os.path.basename(f['root']), os.path.dirname(f['root']))
-            self.parse_fastqc_report(f['f'], s_name, f)
-
-        # Find and parse zipped FastQC reports
-        for f in self.find_log_files('fastqc/zip', filecontents=False):
-            s_name = f['fn']
-            if s_name.endswith('_fastqc.zip'):
-                s_name = s_name[:-11]
-            # Skip if we already have this report - parsing zip files is slow..
-            if s_name in self.fastqc_data.keys():
-                log.debug("Skipping '{}' as already parsed '{}'".format(f['fn'], s_name))
-                continue
-            try:
-                fqc_zip = zipfile.ZipFile(os.path.join(f['root'], f['fn']))
-            except Exception as e:
-                log.warn("Couldn't read '{}' - Bad zip file".format(f['fn']))
-                log.debug("Bad zip file error:\n{}".format(e))
-                continue
-            # FastQC zip files should have just one directory inside, containing report
-            d_name = fqc_zip.namelist()[0]
-            try:
-                with fqc_zip.open(os.path.join(d_name, 'fastqc_data.txt')) as fh:
-                    r_data = fh.read().decode('utf8')
-                    self.parse_fastqc_report(r_data, s_name, f)
-            except KeyError:
-                log.warning("Error - can't find fastqc_raw_data.txt in {}".format(f))
+        self.dup_keys = list()
+        self.parse_state()
 
         # Filter to strip out ignored sample names
         self.fastqc_data = self.ignore_samples(self.fastqc_data)
@@ -114,39 +127,126 @@ class MultiqcModule(BaseMultiqcModule):
         self.overrepresented_sequences()
         self.adapter_content_plot()
 
+    def parse_log_files(self):
+        """ Find and parse the FastQC reports into self.fastqc_data """
+
+        # Find and parse unzipped FastQC reports
+        for f in self.find_log_files('fastqc/data', filelines=True, cache_parsed=True):
+            s_name = self.clean_s_name(os.path.basename(f['root']), os.path.dirname(f['root']))
+            if f['parsed'] is None:
+                f['parsed'] = self.parse_fastqc_data(f['f'])
+            self.add_fastqc_report(f['parsed'], s_name, f)
+
+        # Find zipped FastQC reports. Reading zip files is slow, so zips for samples
+        # that we already have from the unzipped reports are skipped before opening any.
+        # The rest are read together, then added in order as if read one at a time.
+        zip_files = list()
+        zip_paths = set()
+        for f in self.find_log_files('fastqc/zip', filecontents=False, cache_parsed=True):
+            s_name = f['fn']
+            if s_name.endswith('_fastqc.zip'):
+                s_name = s_name[:-11]
+            if s_name in self.fastqc_data.keys():
+                log.debug("Skipping '{}' as already parsed '{}'".format(f['fn'], s_name))
+                continue
+            if os.path.join(f['root'], f['fn']) in zip_paths:
+                continue
+            zip_paths.add(os.path.join(f['root'], f['fn']))
+            zip_files.append((s_name, f))
+
+        # Read fastqc_data.txt from the zip files that we don't have cached results for
+        to_read = [f for s_name, f in zip_files if f['parsed'] is None]
+        for f, (status, result) in zip(to_read, self.read_zip_reports([os.path.join(f['root'], f['fn']) for f in to_read])):
+            if status == 'ok':
+                f['parsed'] = result
+            elif status == 'bad_zip':
+                log.warn("Couldn't read '{}' - Bad zip file".format(f['fn']))
+                log.debug("Bad zip file error:\n{}".format(result))
+            else:
+                log.warning("Error - can't find fastqc_raw_data.txt in {}".format(f))
+        self.save_parsed('fastqc/zip', to_read)
+
+        # A zip is skipped if an earlier one gave a sample with its name, otherwise
+        # later reports overwrite earlier ones with the same sample name
+        for s_name, f in zip_files:
+            if s_name in self.fastqc_data.keys():
+                log.debug("Skipping '{}' as already parsed '{}'".format(f['fn'], s_name))
+                continue
+            if f['parsed'] is not None:
+                self.add_fastqc_report(f['parsed'], s_name, f)
+
+    def read_zip_reports(self, paths):
+        """ Read and parse the FastQC zip files at paths. They are read in the main
+        process unless fastqc_config: zip_jobs is set to more than 1, or to 0 for one
+        worker process per available CPU. Yields the result of read_zip_report()
+        for each path, in order. """
+        njobs = getattr(config, 'fastqc_config', {}).get('zip_jobs')
+        if njobs is None:
+            njobs = 1
+        elif njobs == 0:
+            njobs = available_cpus() if len(paths) >= zip_pool_min_files else 1
+        njobs = min(njobs, len(paths))
+        # Worker processes can't start their own pool, eg. with --module-jobs
+        if njobs > 1 and multiprocessing.current_process().name == 'MainProcess':
+            try:
+                ctx = multiprocessing.get_context('fork')
+            except AttributeError:
+                ctx = multiprocessing # Python 2, always forks
+            except ValueError:
+                ctx = None
+            if ctx is not None:
+                global zip_worker_parse
+                zip_worker_parse = self.parse_fastqc_data
+                log.debug("Reading {} zip files with {} processes".format(len(paths), njobs))
+                pool = ctx.Pool(njobs)
+                try:
+                    for result in pool.imap(zip_worker, paths, max(1, min(100, len(paths) // (njobs * 4)))):
+                        yield result
+                finally:
+                    pool.terminate()
+                    pool.join()
+                return
+        for path in paths:
+            yield read_zip_report(path, self.parse_fastqc_data)
+
     def parse_fastqc_report(self, file_contents, s_name=None, f=None):
         """ Takes contents from a fastq_data.txt file and parses out required
         statistics and data. Returns a dict with keys 'stats' and 'data'.
         Data is for plotting graphs, stats are for top table. """
+        self.add_fastqc_report(self.parse_fastqc_data(file_contents.splitlines()), s_name, f)
 
-        # Make the sample name from the input filename if we find it
-        fn_search = re.search(r"Filename\s+(.+)", file_contents)
-        if fn_search:
-            s_name = self.clean_s_name(fn_search.group(1) , f['root'])
+    def parse_fastqc_data(self, lines):
+        """ Parse the lines of a fastq_data.txt file, one section at a time as
+        they are read. Does not depend on the sample name, so the result can
+        be cached between runs.
+        Returns a dict with the 'Filename' field from the report, the parsed
+        'data' and the order of the sequence duplication keys ('dup_keys'). """
 
-        if s_name in self.fastqc_data.keys():
-            log.debug("Duplicate sample name found! Overwriting: {}".format(s_name))
-        self.add_data_source(f, s_name)
-        self.fastqc_data[s_name] = { 'statuses': dict() }
+        parsed = { 'filename': None, 'data': { 'statuses': dict() }, 'dup_keys': [] }
+        data = parsed['data']
 
         # Parse the report
         section = None
         s_headers = None
-        self.dup_keys = []
-        for l in file_contents.splitlines():
+        for l in lines:
+            # Get the input filename if we find it
+            if parsed['filename'] is None:
+                fn_search = re.search(r"Filename\s+(.+)", l)
+                if fn_search:
+                    parsed['filename'] = fn_search.group(1)
             if l == '>>END_MODULE':
                 section = None
                 s_headers = None
             elif l.startswith('>>'):
                 (section, status) = l[2:].split("\t", 1)
                 section = section.lower().replace(' ', '_')
-                self.fastqc_data[s_name]['statuses'][section] = status
+                data['statuses'][section] = status
             elif section is not None:
                 if l.startswith('#'):
                     s_headers = l[1:].split("\t")
                     # Special case: Total Deduplicated Percentage header line
                     if s_headers[0] == 'Total Deduplicated Percentage':
-                        self.fastqc_data[s_name]['basic_statistics'].append({
+                        data['basic_statistics'].append({
                             'measure': 'total_deduplicated_percentage',
                             'value': float(s_headers[1])
                         })
@@ -155,7 +255,7 @@ class MultiqcModule(BaseMultiqcModule):
                         if s_headers[1] == 'Relative count':
                             s_headers[1] = 'Percentage of total'
                         s_headers = [s.lower().replace(' ', '_') for s in s_headers]
-                        self.fastqc_data[s_name][section] = list()
+                        data[section] = list()
 
                 elif s_headers is not None:
                     s = l.split("\t")
@@ -167,25 +267,40 @@ class MultiqcModule(BaseMultiqcModule):
                         except ValueError:
                             pass
                         row[s_headers[i]] = v
-                    self.fastqc_data[s_name][section].append(row)
+                    data[section].append(row)
                     # Special case - need to remember order of duplication keys
                     if section == 'sequence_duplication_levels':
                         try:
-                            self.dup_keys.append(float(s[0]))
+                            parsed['dup_keys'].append(float(s[0]))
                         except ValueError:
-                            self.dup_keys.append(s[0])
+                            parsed['dup_keys'].append(s[0])
 
         # Tidy up the Basic Stats
-        self.fastqc_data[s_name]['basic_statistics'] = {d['measure']: d['value'] for d in self.fastqc_data[s_name]['basic_statistics']}
+        data['basic_statistics'] = {d['measure']: d['value'] for d in data['basic_statistics']}
 
         # Calculate the average sequence length (Basic Statistics gives a range)
         length_bp = 0
         total_count = 0
-        for d in self.fastqc_data[s_name].get('sequence_length_distribution', {}):
+        for d in data.get('sequence_length_distribution', {}):
             length_bp += d['count'] * self.avg_bp_from_range(d['length'])
             total_count += d['count']
         if total_count > 0:
-            self.fastqc_data[s_name]['basic_statistics']['avg_sequence_length'] = length_bp / total_count
+            data['basic_statistics']['avg_sequence_length'] = length_bp / total_count
+
+        return parsed
+
+    def add_fastqc_report(self, parsed, s_name=None, f=None):
+        """ Add the results from parse_fastqc_data() to the module data """
+
+        # Make the sample name from the input filename if we find it
+        if parsed['filename'] is not None:
+            s_name = self.clean_s_name(parsed['filename'], f['root'])
+
+        if s_name in self.fastqc_data.keys():
+            log.debug("Duplicate sample name found! Overwriting: {}".format(s_name))
+        self.add_data_source(f, s_name)
+        self.fastqc_data[s_name] = parsed['data']
+        self.dup_keys = list(parsed['dup_keys'])
 
     def fastqc_general_stats(self):
         """ Add some single-number stats to the basic statistics
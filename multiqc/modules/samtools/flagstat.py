@@ -19,7 +19,7 @@ class FlagstatReportMixin():
         """ Find Samtools flagstat logs and parse their data """
 
         self.samtools_flagstat = dict()
-        for f in self.find_log_files('samtools/flagstat'):
+        for f in self.find_log_files('samtools/flagstat', filemmap=True):
             parsed_data = parse_single_report(f['f'])
             if len(parsed_data) > 0:
                 if f['s_name'] in self.samtools_flagstat:
@@ -111,19 +111,20 @@ flagstat_regexes = {
 
 def parse_single_report(file_obj):
     """
-    Take a filename, parse the data assuming it's a flagstat file
+    Take the file contents as bytes (or a memory map of the file),
+    parse the data assuming it's a flagstat file
     Returns a dictionary {'lineName_pass' : value, 'lineName_fail' : value}
     """
     parsed_data = {}
 
     re_groups = ['passed', 'failed', 'passed_pct', 'failed_pct']
     for k, r in flagstat_regexes.items():
-        r_search = re.search(r, file_obj, re.MULTILINE)
+        r_search = re.search(r.encode('utf-8'), file_obj, re.MULTILINE)
         if r_search:
             for i,j in enumerate(re_groups):
                 try:
                     key = "{}_{}".format(k, j)
-                    val = r_search.group(i+1).strip('% ')
+                    val = r_search.group(i+1).decode('utf-8', 'replace').strip('% ')
                     parsed_data[key] = float(val) if ('.' in val) else int(val)
                 except IndexError:
                     pass # Not all regexes have percentages
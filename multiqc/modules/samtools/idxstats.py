@@ -17,7 +17,7 @@ class IdxstatsReportMixin():
         """ Find Samtools idxstats logs and parse their data """
 
         self.samtools_idxstats = dict()
-        for f in self.find_log_files('samtools/idxstats'):
+        for f in self.find_log_files('samtools/idxstats', filelines=True):
             parsed_data = parse_single_report(f['f'])
             if len(parsed_data) > 0:
                 if f['s_name'] in self.samtools_idxstats:
@@ -152,10 +152,10 @@ class IdxstatsReportMixin():
 # http://www.htslib.org/doc/samtools.html
 
 def parse_single_report(f):
-    """ Parse a samtools idxstats idxstats """
+    """ Parse the lines of a samtools idxstats idxstats """
 
     parsed_data = OrderedDict()
-    for l in f.splitlines():
+    for l in f:
         s = l.split("\t")
         try:
             parsed_data[s[0]] = int(s[2])
@@ -19,9 +19,9 @@ class StatsReportMixin():
         """ Find Samtools stats logs and parse their data """
 
         self.samtools_stats = dict()
-        for f in self.find_log_files('samtools/stats'):
+        for f in self.find_log_files('samtools/stats', filelines=True):
             parsed_data = dict()
-            for line in f['f'].splitlines():
+            for line in f['f']:
                 if not line.startswith("SN"):
                     continue
                 sections = line.split("\t")
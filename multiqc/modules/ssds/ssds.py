@@ -6,6 +6,7 @@ from __future__ import print_function
 from collections import OrderedDict
 
 import logging
+import numpy as np
 import re
 import sys
 
@@ -73,7 +74,7 @@ class MultiqcModule(BaseMultiqcModule):
         # Loop through all files in folder for SSDS logs
         #for f in sorted(self.find_log_files(config.sp['ssds']['ssstats'])):
         #for f in sorted(self.find_log_files('ssds')):
-        for f in self.find_log_files('ssds'):
+        for f in self.find_log_files('ssds', filelines=True):
 
             # Chop off the file extension (save space on screen)
             reportName = f['s_name']
@@ -84,39 +85,21 @@ class MultiqcModule(BaseMultiqcModule):
             log.info(reportName)
             log.info('Whoop Whoop !!')
 
-            # Loop through the file by line
-            for line in f['f'].splitlines():
+            # Histogram lines are collected and parsed all at once
+            hist_lines = list()
 
-                #  Split line into columns
-                sections = line.split("\t")
+            # Loop through the file by line
+            for line in f['f']:
 
                 # Lines starting with totinfo are general information
-                # This excludes those lines for histogram data (ITR/uH Len ...etc).
+                # Everything else is histogram data (ITR/uH Len ...etc).
                 if not line.startswith("totinfo") and not line.startswith("FRIP"):
-
-                    ## Build histograms
-                    #  3 column format : type       length   count
-                    #  i.e.              ITR_dsDNA  1        100
-                    myType =   sections[0]
-                    nlen =     sections[1]
-                    nCount =   sections[2]
-
-                    # Create a dictionary for this type unless one already exists
-                    if not (myType in self.histograms):
-                        self.histograms[myType] = dict()
-
-                    # Create a dictionary for this file and type unless one already exists
-                    if not (f['fn'] in self.histograms[myType]):
-                        self.histograms[myType][f['fn']] = dict()
-
-                    # Add this value : count pair to the histogram
-                    self.histograms[myType][f['fn']][int(nlen)] = int(nCount)
-
-                    # Debug message
-                    # sys.stderr.write('OK ... ' + myType + ' : ' + nlen + ' : ' + nCount + '\n')
-
+                    hist_lines.append(line)
                     continue
 
+                #  Split line into columns
+                sections = line.split("\t")
+
                 if line.startswith("FRIP"):
                     col1    = sections[0].split("_")
                     reptype = col1[0]
@@ -160,6 +143,9 @@ class MultiqcModule(BaseMultiqcModule):
                 value = float(sections[2].strip())
                 parsed_data[field] = value
 
+            # Build histograms
+            self.parse_histograms(f['fn'], hist_lines)
+
             # If we parsed something
             if len(parsed_data) > 0:
 
@@ -407,33 +393,15 @@ class MultiqcModule(BaseMultiqcModule):
                 if len(self.histograms[hType]) > 0:
 
                     ## Make a percentage normalised version of the data
-                    data_percent = {}
-                    # Debug messages:
-                    # sys.stderr.write("Value : " + hType + '\n')
-                    # sys.stderr.write("Value : %s" %  self.histograms[hType]['data'].items() + '\n')
-
-                    # Loop through key, value pairs for this histogram
-                    for s_name, data in self.histograms[hType].items():
-
-                        # initialize total to 0 (not sure why I do that)
-                        total = 0
-
-                        # Create percentage dictionary
-                        data_percent[s_name] = OrderedDict()
-
-                        # Debug messages:
-                        # sys.stderr.write(s_name + '\n')
-                        # sys.stderr.write("Value : %s" %  data  + '\n')
-
-                        # Get total for this histogram
-                        total = float( sum( data.values() ) )
-
-                        # Calculate percentages for this histogram
-                        for k, v in data.items():
-                            if v > 0:
-                                data_percent[s_name][k] = (v/total)*100
-                            else:
-                                data_percent[s_name][k] = 0
+                    ## Long histograms are binned so that the plots don't get too big
+                    bin_edges = self.histogram_bin_edges(hType)
+                    if bin_edges is None:
+                        data_percent = self.histogram_percentages(hType)
+                        data_counts = self.histograms[hType]
+                        description = ''
+                    else:
+                        data_percent, data_counts = self.binned_histograms(hType, bin_edges)
+                        description = '<p>Lengths are grouped into {} bins. Each point is the mean per bp of a bin, plotted at its shortest length.</p>'.format(len(bin_edges) - 1)
 
                     # Configure histogram plot
                     histConfig = {
@@ -452,10 +420,105 @@ class MultiqcModule(BaseMultiqcModule):
                     # Add histogram to multi-QC page
                     # - percentage histogram is first (default)
                     # - switch order to reverse
-                    self.add_section( plot = linegraph.plot([data_percent, self.histograms[hType]], histConfig),
+                    self.add_section( plot = linegraph.plot([data_percent, data_counts], histConfig),
                                       name = 'SSDS ' + hType,
                                       anchor = 'ssds-stats' + hType,
-                                      content = '<p>This module parses the output from <code>SSDS stats</code>.</p>')
+                                      content = '<p>This module parses the output from <code>SSDS stats</code>.</p>' + description)
 
         # Return the number of logs that were found
         return len(self.ssds_stats)
+
+    def histogram_bin_edges(self, hType):
+        """ Bin edges for a histogram type, or None if it has few enough lengths to plot as it is.
+        The number of bins is set with `histogram_max_points` under `ssds` in the MultiQC config
+        (default 0, which turns binning off). Set `histogram_log_bins: true` to make bins get
+        wider towards long lengths, for histograms with long tails. """
+        ssds_config = getattr(config, 'ssds', {})
+        max_points = ssds_config.get('histogram_max_points', 0)
+        if not max_points:
+            return None
+        lengths = set()
+        for data in self.histograms[hType].values():
+            lengths.update(data.keys())
+        if len(lengths) <= max_points:
+            return None
+
+        # Integer edges from the shortest length to one past the longest
+        xmin = min(lengths)
+        xmax = max(lengths)
+        if ssds_config.get('histogram_log_bins', False):
+            edges = xmin - 1 + np.geomspace(1, xmax - xmin + 2, max_points + 1)
+        else:
+            edges = np.linspace(xmin, xmax + 1, max_points + 1)
+        edges = np.floor(edges).astype(np.int64)
+        edges[0] = xmin
+        edges[-1] = xmax + 1
+        return np.unique(edges)
+
+    def binned_histograms(self, hType, edges):
+        """ Percentage and count histograms for each sample, grouped into bins.
+        Values are the mean per bp in each bin, so both datasets keep the same
+        shape and units as the unbinned plots. Bins without any lengths for
+        a sample are left out for that sample. """
+        widths = np.diff(edges)
+        data_percent = dict()
+        data_counts = dict()
+        for s_name, data in self.histograms[hType].items():
+            lens = np.fromiter(data.keys(), dtype=np.int64, count=len(data))
+            counts = np.fromiter(data.values(), dtype=np.float64, count=len(data))
+            bins = np.searchsorted(edges, lens, side='right') - 1
+            bin_counts = np.bincount(bins, weights=counts, minlength=len(widths)) / widths
+            total = counts.sum()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bin_percents = np.where(total > 0, (bin_counts / total) * 100, 0)
+            used = np.unique(bins)
+            data_counts[s_name] = OrderedDict(zip(edges[used].tolist(), bin_counts[used].tolist()))
+            data_percent[s_name] = OrderedDict(zip(edges[used].tolist(), bin_percents[used].tolist()))
+        return data_percent, data_counts
+
+    def parse_histograms(self, fn, lines):
+        """ Parse the histogram lines from one report into self.histograms.
+        3 column format : type       length   count
+        i.e.              ITR_dsDNA  1        100
+        All lines are converted with NumPy in one go, instead of splitting
+        and converting each line separately. """
+        if len(lines) == 0:
+            return
+
+        # Bad lengths or counts raise the same errors as int(), extra columns are ignored.
+        # The type column is as wide as the longest line so that no names are cut short.
+        hist = np.loadtxt(lines, delimiter='\t', comments=None, usecols=(0, 1, 2), ndmin=1,
+            dtype=[('type', 'U{}'.format(max(len(line) for line in lines))), ('len', 'i8'), ('count', 'i8')])
+
+        # Add the lines for each type to the histogram for that type, in the order
+        # they are in the file. Later lines for the same length overwrite earlier ones.
+        types, type_idx = np.unique(hist['type'], return_inverse=True)
+        for i, myType in enumerate(types.tolist()):
+            rows = type_idx == i
+            if not (myType in self.histograms):
+                self.histograms[myType] = dict()
+            if not (fn in self.histograms[myType]):
+                self.histograms[myType][fn] = OrderedDict()
+            self.histograms[myType][fn].update(zip(hist['len'][rows].tolist(), hist['count'][rows].tolist()))
+
+    def histogram_percentages(self, hType):
+        """ Percentage normalised version of a histogram, for each sample.
+        All samples are divided by their totals in a single array operation. """
+        samples = list(self.histograms[hType].keys())
+        counts = [ np.fromiter(self.histograms[hType][s].values(), dtype=np.int64, count=len(self.histograms[hType][s])) for s in samples ]
+        sizes = [ len(c) for c in counts ]
+        totals = np.array([ c.sum() for c in counts ], dtype=np.float64)
+        all_counts = np.concatenate(counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percents = (all_counts / np.repeat(totals, sizes)) * 100
+
+        data_percent = dict()
+        offset = 0
+        for s_name, size in zip(samples, sizes):
+            keys = list(self.histograms[hType][s_name].keys())
+            data_percent[s_name] = OrderedDict(zip(keys, percents[offset:offset+size].tolist()))
+            # Zero and negative counts are reported as 0, not 0.0
+            for i in np.flatnonzero(all_counts[offset:offset+size] <= 0):
+                data_percent[s_name][keys[i]] = 0
+            offset += size
+        return data_percent
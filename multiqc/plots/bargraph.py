@@ -5,6 +5,7 @@
 from __future__ import print_function
 import base64
 from collections import OrderedDict
+import copy
 import inspect
 import io
 import logging
@@ -12,23 +13,10 @@ import math
 import os
 import random
 import re
-import sys
 
-from multiqc.utils import config, report, util_functions
+from multiqc.utils import cache, config, report, util_functions, plot_jobs
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = 'abcdefghijklmnopqrstuvwxyz'
 
 # Load the template so that we can access its configuration
@@ -273,6 +261,9 @@ def matplotlib_bargraph (plotdata, plotsamples, pconfig=None):
     if pconfig is None:
         pconfig = {}
 
+    # Load MatPlotLib now, so that we fall back to HighCharts if it's broken
+    util_functions.get_pyplot()
+
     # Plot group ID
     if pconfig.get('id') is None:
         pconfig['id'] = 'mqc_mplplot_'+''.join(random.sample(letters, 10))
@@ -296,10 +287,6 @@ def matplotlib_bargraph (plotdata, plotsamples, pconfig=None):
           '(see the <a href="http://multiqc.info/docs/#flat--interactive-plots" target="_blank">docs</a>).</small></p>'
     html += '<div class="mqc_mplplot_plotgroup" id="{}">'.format(pconfig['id'])
 
-    # Same defaults as HighCharts for consistency
-    default_colors = ['#7cb5ec', '#434348', '#90ed7d', '#f7a35c', '#8085e9',
-                      '#f15c80', '#e4d354', '#2b908f', '#f45b5b', '#91e8e1']
-
     # Counts / Percentages Switch
     if pconfig.get('cpswitch') is not False and not config.simple_output:
         if pconfig.get('cpswitch_c_active', True) is True:
@@ -344,154 +331,217 @@ def matplotlib_bargraph (plotdata, plotsamples, pconfig=None):
                 fdata[s_name][d['name']] = dval
         util_functions.write_data_file(fdata, pids[pidx])
 
-        # Plot percentage as well as counts
-        plot_pcts = [False]
-        if pconfig.get('cpswitch') is not False:
-            plot_pcts = [False, True]
-
         # Switch out NaN for 0s so that MatPlotLib doesn't ignore stuff
         for idx, d in enumerate(pdata):
             pdata[idx]['data'] = [x if not math.isnan(x) else 0 for x in d['data'] ]
 
-        for plot_pct in plot_pcts:
+        # Draw the plots, in a worker process if --plot-jobs is set
+        html += plot_jobs.runner.draw(draw_bargraph, pdata, plotsamples, pidx, pids, pconfig)
 
-            # Plot ID
-            pid = pids[pidx]
-            hide_plot = False
-            if plot_pct is True:
-                pid = '{}_pc'.format(pid)
-                if pconfig.get('cpswitch_c_active', True) is True:
-                    hide_plot = True
-            else:
-                if pconfig.get('cpswitch_c_active', True) is not True:
-                    hide_plot = True
 
-            # Set up figure
-            plt_height = len(plotsamples[pidx]) / 2.3
-            plt_height = max(6, plt_height) # At least 6" tall
-            plt_height = min(30, plt_height) # Cap at 30" tall
-            bar_width = 0.8
+    # Close wrapping div
+    html += '</div>'
 
-            fig = plt.figure(figsize=(14, plt_height), frameon=False)
-            axes = fig.add_subplot(111)
-            y_ind = range(len(plotsamples[pidx]))
+    report.num_mpl_plots += 1
 
-            # Count totals for each sample
-            if plot_pct is True:
-                s_totals = [0 for _ in pdata[0]['data']]
-                for series_idx, d in enumerate(pdata):
-                    for sample_idx, v in enumerate(d['data']):
-                        s_totals[sample_idx] += v
-
-            # Plot bars
-            dlabels = []
-            for idx, d in enumerate(pdata):
-                # Plot percentages
-                values = d['data']
-                if len(values) < len(y_ind):
-                    values.extend([0] * (len(y_ind) - len(values)))
-                if plot_pct is True:
-                    for (key,var) in enumerate(values):
-                        s_total = s_totals[key]
-                        if s_total == 0:
-                            values[key] = 0
-                        else:
-                            values[key] = (float(var+0.0)/float(s_total))*100
-
-                # Get offset for stacked bars
-                if idx == 0:
-                    prevdata = [0] * len(plotsamples[pidx])
-                else:
-                    for i, p in enumerate(prevdata):
-                        prevdata[i] += pdata[idx-1]['data'][i]
-                # Default colour index
-                cidx = idx
-                while cidx >= len(default_colors):
-                    cidx -= len(default_colors)
-                # Save the name of this series
-                dlabels.append(d['name'])
-                # Add the series of bars to the plot
-                axes.barh(
-                    y_ind,
-                    values,
-                    bar_width,
-                    left = prevdata,
-                    color = d.get('color', default_colors[cidx]),
-                    align = 'center',
-                    linewidth = pconfig.get('borderWidth', 0)
-                )
-
-            # Tidy up axes
-            axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
-            axes.set_xlabel(pconfig.get('ylab', '')) # I know, I should fix the fact that the config is switched
-            axes.set_ylabel(pconfig.get('xlab', ''))
-            axes.set_yticks(y_ind) # Specify where to put the labels
-            axes.set_yticklabels(plotsamples[pidx]) # Set y axis sample name labels
-            axes.set_ylim((-0.5, len(y_ind)-0.5)) # Reduce padding around plot area
-            if plot_pct is True:
-                axes.set_xlim((0, 100))
-                # Add percent symbols
-                vals = axes.get_xticks()
-                axes.set_xticklabels(['{:.0f}%'.format(x) for x in vals])
-            else:
-                default_xlimits = axes.get_xlim()
-                axes.set_xlim((pconfig.get('ymin', default_xlimits[0]),pconfig.get('ymax', default_xlimits[1])))
-            if 'title' in pconfig:
-                top_gap = 1 + (0.5 / plt_height)
-                plt.text(0.5, top_gap, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
-            axes.grid(True, zorder=0, which='both', axis='x', linestyle='-', color='#dedede', linewidth=1)
-            axes.set_axisbelow(True)
-            axes.spines['right'].set_visible(False)
-            axes.spines['top'].set_visible(False)
-            axes.spines['bottom'].set_visible(False)
-            axes.spines['left'].set_visible(False)
-            plt.gca().invert_yaxis() # y axis is reverse sorted otherwise
-
-            # Hide some labels if we have a lot of samples
-            show_nth = max(1, math.ceil(len(pdata[0]['data'])/150))
-            for idx, label in enumerate(axes.get_yticklabels()):
-                if idx % show_nth != 0:
-                    label.set_visible(False)
-
-            # Legend
-            bottom_gap = -1 * (1 - ((plt_height - 1.5) / plt_height))
-            lgd = axes.legend(dlabels, loc='lower center', bbox_to_anchor=(0, bottom_gap, 1, .102), ncol=5, mode='expand', fontsize=8, frameon=False)
-
-            # Should this plot be hidden on report load?
-            hidediv = ''
-            if pidx > 0 or hide_plot:
-                hidediv = ' style="display:none;"'
-
-            # Save the plot to the data directory if export is requested
-            if config.export_plots:
-                for fformat in config.export_plot_formats:
-                    # Make the directory if it doesn't already exist
-                    plot_dir = os.path.join(config.plots_dir, fformat)
-                    if not os.path.exists(plot_dir):
-                        os.makedirs(plot_dir)
-                    # Save the plot
-                    plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
-                    fig.savefig(plot_fn, format=fformat, bbox_extra_artists=(lgd,), bbox_inches='tight')
-
-            # Output the figure to a base64 encoded string
-            if getattr(get_template_mod(), 'base64_plots', True) is True:
-                img_buffer = io.BytesIO()
-                fig.savefig(img_buffer, format='png', bbox_inches='tight')
-                b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
-                img_buffer.close()
-                html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(pid, hidediv, b64_img)
+    return html
 
-            # Link to the saved image
-            else:
-                plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(pid))
-                html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
 
-            plt.close(fig)
+def draw_bargraph (pdata, plotsamples, pidx, pids, pconfig):
+    """
+    Draw one dataset of a bargraph with MatPlotLib and return the HTML for the
+    images. Saves the plots to the plots directory if export is requested. Should
+    be called by matplotlib_bargraph, which writes the data file and the plot buttons.
+    """
+    html = ''
+
+    # Plot percentage as well as counts
+    plot_pcts = [False]
+    if pconfig.get('cpswitch') is not False:
+        plot_pcts = [False, True]
+
+    # Exported image formats, plus the PNG embedded in the report
+    fformats = list(config.export_plot_formats) if config.export_plots else list()
+    base64_plots = getattr(get_template_mod(), 'base64_plots', True) is True
+    img_names = fformats + (['base64'] if base64_plots else [])
+
+    # Use images from the flat plot cache if we have them
+    images = None
+    if config.plot_cache:
+        plot_cache = cache.get_plot_cache()
+        cache_key = plot_cache.plot_key('bargraph', pdata, plotsamples[pidx], pidx, pconfig)
+        images = plot_cache.get(cache_key, ['{}{}'.format(n, '_pc' if p else '') for p in plot_pcts for n in img_names])
+    if images is None:
+        images = bargraph_images(pdata, plotsamples, pidx, pconfig, plot_pcts, img_names)
+        if config.plot_cache:
+            plot_cache.add(cache_key, images)
+
+    for plot_pct in plot_pcts:
+
+        # Plot ID
+        pid = pids[pidx]
+        img_sfx = ''
+        hide_plot = False
+        if plot_pct is True:
+            pid = '{}_pc'.format(pid)
+            img_sfx = '_pc'
+            if pconfig.get('cpswitch_c_active', True) is True:
+                hide_plot = True
+        else:
+            if pconfig.get('cpswitch_c_active', True) is not True:
+                hide_plot = True
+
+        # Should this plot be hidden on report load?
+        hidediv = ''
+        if pidx > 0 or hide_plot:
+            hidediv = ' style="display:none;"'
+
+        # Save the plot to the data directory if export is requested
+        for fformat in fformats:
+            # Make the directory if it doesn't already exist
+            plot_dir = os.path.join(config.plots_dir, fformat)
+            if not os.path.exists(plot_dir):
+                os.makedirs(plot_dir)
+            # Save the plot
+            plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
+            with io.open (plot_fn, 'wb') as f:
+                f.write(images[fformat + img_sfx])
+
+        # Output the figure to a base64 encoded string
+        if base64_plots:
+            b64_img = base64.b64encode(images['base64' + img_sfx]).decode('utf8')
+            html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(pid, hidediv, b64_img)
+
+        # Link to the saved image
+        else:
+            plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(pid))
+            html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
 
+    return html
 
-    # Close wrapping div
-    html += '</div>'
 
-    report.num_mpl_plots += 1
+def bargraph_images (pdata, plotsamples, pidx, pconfig, plot_pcts, img_names):
+    """
+    Draw one dataset of a bargraph with MatPlotLib and return a dict with the
+    image for each of img_names, with '_pc' added to the names for percentage
+    plots. These are image formats, apart from 'base64' which is the PNG
+    embedded in the report.
+    """
+    images = dict()
+    if len(img_names) == 0:
+        return images
+    plt = util_functions.get_pyplot()
 
-    return html
+    # Work on a copy, as the values are replaced with percentages below
+    pdata = copy.deepcopy(pdata)
+
+    # Same defaults as HighCharts for consistency
+    default_colors = ['#7cb5ec', '#434348', '#90ed7d', '#f7a35c', '#8085e9',
+                      '#f15c80', '#e4d354', '#2b908f', '#f45b5b', '#91e8e1']
+
+    for plot_pct in plot_pcts:
+
+        # Set up figure
+        plt_height = len(plotsamples[pidx]) / 2.3
+        plt_height = max(6, plt_height) # At least 6" tall
+        plt_height = min(30, plt_height) # Cap at 30" tall
+        bar_width = 0.8
+
+        fig = plt.figure(figsize=(14, plt_height), frameon=False)
+        axes = fig.add_subplot(111)
+        y_ind = range(len(plotsamples[pidx]))
+
+        # Count totals for each sample
+        if plot_pct is True:
+            s_totals = [0 for _ in pdata[0]['data']]
+            for series_idx, d in enumerate(pdata):
+                for sample_idx, v in enumerate(d['data']):
+                    s_totals[sample_idx] += v
+
+        # Plot bars
+        dlabels = []
+        for idx, d in enumerate(pdata):
+            # Plot percentages
+            values = d['data']
+            if len(values) < len(y_ind):
+                values.extend([0] * (len(y_ind) - len(values)))
+            if plot_pct is True:
+                for (key,var) in enumerate(values):
+                    s_total = s_totals[key]
+                    if s_total == 0:
+                        values[key] = 0
+                    else:
+                        values[key] = (float(var+0.0)/float(s_total))*100
+
+            # Get offset for stacked bars
+            if idx == 0:
+                prevdata = [0] * len(plotsamples[pidx])
+            else:
+                for i, p in enumerate(prevdata):
+                    prevdata[i] += pdata[idx-1]['data'][i]
+            # Default colour index
+            cidx = idx
+            while cidx >= len(default_colors):
+                cidx -= len(default_colors)
+            # Save the name of this series
+            dlabels.append(d['name'])
+            # Add the series of bars to the plot
+            axes.barh(
+                y_ind,
+                values,
+                bar_width,
+                left = prevdata,
+                color = d.get('color', default_colors[cidx]),
+                align = 'center',
+                linewidth = pconfig.get('borderWidth', 0)
+            )
+
+        # Tidy up axes
+        axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
+        axes.set_xlabel(pconfig.get('ylab', '')) # I know, I should fix the fact that the config is switched
+        axes.set_ylabel(pconfig.get('xlab', ''))
+        axes.set_yticks(y_ind) # Specify where to put the labels
+        axes.set_yticklabels(plotsamples[pidx]) # Set y axis sample name labels
+        axes.set_ylim((-0.5, len(y_ind)-0.5)) # Reduce padding around plot area
+        if plot_pct is True:
+            axes.set_xlim((0, 100))
+            # Add percent symbols
+            vals = axes.get_xticks()
+            axes.set_xticklabels(['{:.0f}%'.format(x) for x in vals])
+        else:
+            default_xlimits = axes.get_xlim()
+            axes.set_xlim((pconfig.get('ymin', default_xlimits[0]),pconfig.get('ymax', default_xlimits[1])))
+        if 'title' in pconfig:
+            top_gap = 1 + (0.5 / plt_height)
+            plt.text(0.5, top_gap, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
+        axes.grid(True, zorder=0, which='both', axis='x', linestyle='-', color='#dedede', linewidth=1)
+        axes.set_axisbelow(True)
+        axes.spines['right'].set_visible(False)
+        axes.spines['top'].set_visible(False)
+        axes.spines['bottom'].set_visible(False)
+        axes.spines['left'].set_visible(False)
+        plt.gca().invert_yaxis() # y axis is reverse sorted otherwise
+
+        # Hide some labels if we have a lot of samples
+        show_nth = max(1, math.ceil(len(pdata[0]['data'])/150))
+        for idx, label in enumerate(axes.get_yticklabels()):
+            if idx % show_nth != 0:
+                label.set_visible(False)
+
+        # Legend
+        bottom_gap = -1 * (1 - ((plt_height - 1.5) / plt_height))
+        lgd = axes.legend(dlabels, loc='lower center', bbox_to_anchor=(0, bottom_gap, 1, .102), ncol=5, mode='expand', fontsize=8, frameon=False)
+
+        # Save the figure in each format
+        for name in img_names:
+            img_buffer = io.BytesIO()
+            if name == 'base64':
+                fig.savefig(img_buffer, format='png', bbox_inches='tight')
+            else:
+                fig.savefig(img_buffer, format=name, bbox_extra_artists=(lgd,), bbox_inches='tight')
+            images['{}{}'.format(name, '_pc' if plot_pct else '')] = img_buffer.getvalue()
+            img_buffer.close()
+
+        plt.close(fig)
+
+    return images
@@ -9,23 +9,10 @@ import io
 import logging
 import os
 import random
-import sys
 
-from multiqc.utils import config, report, util_functions
+from multiqc.utils import cache, config, report, util_functions, plot_jobs
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = 'abcdefghijklmnopqrstuvwxyz'
 
 # Load the template so that we can access its configuration
@@ -222,6 +209,9 @@ def matplotlib_linegraph (plotdata, pconfig=None):
     if pconfig is None:
         pconfig = {}
 
+    # Load MatPlotLib now, so that we fall back to HighCharts if it's broken
+    util_functions.get_pyplot()
+
     # Plot group ID
     if pconfig.get('id') is None:
         pconfig['id'] = 'mqc_mplplot_'+''.join(random.sample(letters, 10))
@@ -245,10 +235,6 @@ def matplotlib_linegraph (plotdata, pconfig=None):
           '(see the <a href="http://multiqc.info/docs/#flat--interactive-plots" target="_blank">docs</a>).</small></p>'
     html += '<div class="mqc_mplplot_plotgroup" id="{}">'.format(pconfig['id'])
 
-    # Same defaults as HighCharts for consistency
-    default_colors = ['#7cb5ec', '#434348', '#90ed7d', '#f7a35c', '#8085e9',
-                      '#f15c80', '#e4d354', '#2b908f', '#f45b5b', '#91e8e1']
-
     # Buttons to cycle through different datasets
     if len(plotdata) > 1 and not config.simple_output:
         html += '<div class="btn-group mpl_switch_group mqc_mplplot_bargraph_switchds">\n'
@@ -301,152 +287,204 @@ def matplotlib_linegraph (plotdata, pconfig=None):
         else:
             util_functions.write_data_file(fdata, pid)
 
-        # Set up figure
-        fig = plt.figure(figsize=(14, 6), frameon=False)
-        axes = fig.add_subplot(111)
+        # Draw the plot, in a worker process if --plot-jobs is set
+        html += plot_jobs.runner.draw(draw_linegraph, pdata, pidx, pid, pconfig)
 
-        # Go through data series
-        for idx, d in enumerate(pdata):
 
-            # Default colour index
-            cidx = idx
-            while cidx >= len(default_colors):
-                cidx -= len(default_colors)
+    # Close wrapping div
+    html += '</div>'
 
-            # Line style
-            linestyle = 'solid'
-            if d.get('dashStyle', None) == 'Dash':
-                linestyle = 'dashed'
+    report.num_mpl_plots += 1
 
-            # Reformat data (again)
-            try:
-                axes.plot([x[0] for x in d['data']], [x[1] for x in d['data']], label=d['name'], color=d.get('color', default_colors[cidx]), linestyle=linestyle, linewidth=1, marker=None)
-            except TypeError:
-                # Categorical data on x axis
-                axes.plot(d['data'], label=d['name'], color=d.get('color', default_colors[cidx]), linewidth=1, marker=None)
+    return html
 
-        # Tidy up axes
-        axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
-        axes.set_xlabel(pconfig.get('xlab', ''))
-        axes.set_ylabel(pconfig.get('ylab', ''))
 
-        # Dataset specific y label
-        try:
-            axes.set_ylabel(pconfig['data_labels'][pidx]['ylab'])
-        except:
-            pass
+def draw_linegraph (pdata, pidx, pid, pconfig):
+    """
+    Draw one dataset of a line graph with MatPlotLib and return the HTML for the
+    image. Saves the plot to the plots directory if export is requested. Should be
+    called by matplotlib_linegraph, which writes the data file and the plot buttons.
+    """
+    html = ''
+
+    # Exported image formats, plus the PNG embedded in the report
+    fformats = list(config.export_plot_formats) if config.export_plots else list()
+    base64_plots = getattr(get_template_mod(), 'base64_plots', True) is True
+    img_names = fformats + (['base64'] if base64_plots else [])
+
+    # Use images from the flat plot cache if we have them
+    images = None
+    if config.plot_cache:
+        plot_cache = cache.get_plot_cache()
+        cache_key = plot_cache.plot_key('linegraph', pdata, pidx, pconfig)
+        images = plot_cache.get(cache_key, img_names)
+    if images is None:
+        images = linegraph_images(pdata, pidx, pconfig, img_names)
+        if config.plot_cache:
+            plot_cache.add(cache_key, images)
+
+    # Should this plot be hidden on report load?
+    hidediv = ''
+    if pidx > 0:
+        hidediv = ' style="display:none;"'
+
+    # Save the plot to the data directory if export is requests
+    for fformat in fformats:
+        # Make the directory if it doesn't already exist
+        plot_dir = os.path.join(config.plots_dir, fformat)
+        if not os.path.exists(plot_dir):
+            os.makedirs(plot_dir)
+        # Save the plot
+        plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
+        with io.open (plot_fn, 'wb') as f:
+            f.write(images[fformat])
+
+    # Output the figure to a base64 encoded string
+    if base64_plots:
+        b64_img = base64.b64encode(images['base64']).decode('utf8')
+        html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(pid, hidediv, b64_img)
+
+    # Save to a file and link <img>
+    else:
+        plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(pid))
+        html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
 
-        # Axis limits
-        default_ylimits = axes.get_ylim()
-        ymin = default_ylimits[0]
-        if 'ymin' in pconfig:
-            ymin = pconfig['ymin']
-        elif 'yCeiling' in pconfig:
-            ymin = min(pconfig['yCeiling'], default_ylimits[0])
-        ymax = default_ylimits[1]
-        if 'ymax' in pconfig:
-            ymax = pconfig['ymax']
-        elif 'yFloor' in pconfig:
-            ymax = max(pconfig['yCeiling'], default_ylimits[1])
-        if (ymax - ymin) < pconfig.get('yMinRange', 0):
-            ymax = ymin + pconfig['yMinRange']
-        axes.set_ylim((ymin, ymax))
-
-        # Dataset specific ymax
-        try:
-            axes.set_ylim((ymin, pconfig['data_labels'][pidx]['ymax']))
-        except:
-            pass
+    return html
 
-        default_xlimits = axes.get_xlim()
-        xmin = default_xlimits[0]
-        if 'xmin' in pconfig:
-            xmin = pconfig['xmin']
-        elif 'xCeiling' in pconfig:
-            xmin = min(pconfig['xCeiling'], default_xlimits[0])
-        xmax = default_xlimits[1]
-        if 'xmax' in pconfig:
-            xmax = pconfig['xmax']
-        elif 'xFloor' in pconfig:
-            xmax = max(pconfig['xCeiling'], default_xlimits[1])
-        if (xmax - xmin) < pconfig.get('xMinRange', 0):
-            xmax = xmin + pconfig['xMinRange']
-        axes.set_xlim((xmin, xmax))
-
-        # Plot title
-        if 'title' in pconfig:
-            plt.text(0.5, 1.05, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
-        axes.grid(True, zorder=10, which='both', axis='y', linestyle='-', color='#dedede', linewidth=1)
-
-        # X axis categories, if specified
-        if 'categories' in pconfig:
-            axes.set_xticks([i for i,v in enumerate(pconfig['categories'])])
-            axes.set_xticklabels(pconfig['categories'])
-
-        # Axis lines
-        xlim = axes.get_xlim()
-        axes.plot([xlim[0], xlim[1]], [0, 0], linestyle='-', color='#dedede', linewidth=2)
-        axes.set_axisbelow(True)
-        axes.spines['right'].set_visible(False)
-        axes.spines['top'].set_visible(False)
-        axes.spines['bottom'].set_visible(False)
-        axes.spines['left'].set_visible(False)
-
-        # Background colours, if specified
-        if 'yPlotBands' in pconfig:
-            xlim = axes.get_xlim()
-            for pb in pconfig['yPlotBands']:
-                axes.barh(pb['from'], xlim[1], height = pb['to']-pb['from'], left=xlim[0], color=pb['color'], linewidth=0, zorder=0)
-        if 'xPlotBands' in pconfig:
-            ylim = axes.get_ylim()
-            for pb in pconfig['xPlotBands']:
-                axes.bar(pb['from'], ylim[1], width = pb['to']-pb['from'], bottom=ylim[0], color=pb['color'], linewidth=0, zorder=0)
-
-        # Tight layout - makes sure that legend fits in and stuff
-        if len(pdata) <= 15:
-            axes.legend(loc='lower center', bbox_to_anchor=(0, -0.22, 1, .102), ncol=5, mode='expand', fontsize=8, frameon=False)
-            plt.tight_layout(rect=[0,0.08,1,0.92])
-        else:
-            plt.tight_layout(rect=[0,0,1,0.92])
-
-        # Should this plot be hidden on report load?
-        hidediv = ''
-        if pidx > 0:
-            hidediv = ' style="display:none;"'
-
-        # Save the plot to the data directory if export is requests
-        if config.export_plots:
-            for fformat in config.export_plot_formats:
-                # Make the directory if it doesn't already exist
-                plot_dir = os.path.join(config.plots_dir, fformat)
-                if not os.path.exists(plot_dir):
-                    os.makedirs(plot_dir)
-                # Save the plot
-                plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
-                fig.savefig(plot_fn, format=fformat, bbox_inches='tight')
-
-        # Output the figure to a base64 encoded string
-        if getattr(get_template_mod(), 'base64_plots', True) is True:
-            img_buffer = io.BytesIO()
-            fig.savefig(img_buffer, format='png', bbox_inches='tight')
-            b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
-            img_buffer.close()
-            html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(pid, hidediv, b64_img)
-
-        # Save to a file and link <img>
-        else:
-            plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(pid))
-            html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
 
-        plt.close(fig)
+def linegraph_images (pdata, pidx, pconfig, img_names):
+    """
+    Draw one dataset of a line graph with MatPlotLib and return a dict with
+    the image for each of img_names. These are image formats, apart from
+    'base64' which is the PNG embedded in the report.
+    """
+    images = dict()
+    if len(img_names) == 0:
+        return images
+    plt = util_functions.get_pyplot()
 
+    # Same defaults as HighCharts for consistency
+    default_colors = ['#7cb5ec', '#434348', '#90ed7d', '#f7a35c', '#8085e9',
+                      '#f15c80', '#e4d354', '#2b908f', '#f45b5b', '#91e8e1']
 
-    # Close wrapping div
-    html += '</div>'
+    # Set up figure
+    fig = plt.figure(figsize=(14, 6), frameon=False)
+    axes = fig.add_subplot(111)
 
-    report.num_mpl_plots += 1
+    # Go through data series
+    for idx, d in enumerate(pdata):
 
-    return html
+        # Default colour index
+        cidx = idx
+        while cidx >= len(default_colors):
+            cidx -= len(default_colors)
+
+        # Line style
+        linestyle = 'solid'
+        if d.get('dashStyle', None) == 'Dash':
+            linestyle = 'dashed'
+
+        # Reformat data (again)
+        try:
+            axes.plot([x[0] for x in d['data']], [x[1] for x in d['data']], label=d['name'], color=d.get('color', default_colors[cidx]), linestyle=linestyle, linewidth=1, marker=None)
+        except TypeError:
+            # Categorical data on x axis
+            axes.plot(d['data'], label=d['name'], color=d.get('color', default_colors[cidx]), linewidth=1, marker=None)
+
+    # Tidy up axes
+    axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
+    axes.set_xlabel(pconfig.get('xlab', ''))
+    axes.set_ylabel(pconfig.get('ylab', ''))
+
+    # Dataset specific y label
+    try:
+        axes.set_ylabel(pconfig['data_labels'][pidx]['ylab'])
+    except:
+        pass
+
+    # Axis limits
+    default_ylimits = axes.get_ylim()
+    ymin = default_ylimits[0]
+    if 'ymin' in pconfig:
+        ymin = pconfig['ymin']
+    elif 'yCeiling' in pconfig:
+        ymin = min(pconfig['yCeiling'], default_ylimits[0])
+    ymax = default_ylimits[1]
+    if 'ymax' in pconfig:
+        ymax = pconfig['ymax']
+    elif 'yFloor' in pconfig:
+        ymax = max(pconfig['yCeiling'], default_ylimits[1])
+    if (ymax - ymin) < pconfig.get('yMinRange', 0):
+        ymax = ymin + pconfig['yMinRange']
+    axes.set_ylim((ymin, ymax))
+
+    # Dataset specific ymax
+    try:
+        axes.set_ylim((ymin, pconfig['data_labels'][pidx]['ymax']))
+    except:
+        pass
+
+    default_xlimits = axes.get_xlim()
+    xmin = default_xlimits[0]
+    if 'xmin' in pconfig:
+        xmin = pconfig['xmin']
+    elif 'xCeiling' in pconfig:
+        xmin = min(pconfig['xCeiling'], default_xlimits[0])
+    xmax = default_xlimits[1]
+    if 'xmax' in pconfig:
+        xmax = pconfig['xmax']
+    elif 'xFloor' in pconfig:
+        xmax = max(pconfig['xCeiling'], default_xlimits[1])
+    if (xmax - xmin) < pconfig.get('xMinRange', 0):
+        xmax = xmin + pconfig['xMinRange']
+    axes.set_xlim((xmin, xmax))
+
+    # Plot title
+    if 'title' in pconfig:
+        plt.text(0.5, 1.05, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
+    axes.grid(True, zorder=10, which='both', axis='y', linestyle='-', color='#dedede', linewidth=1)
+
+    # X axis categories, if specified
+    if 'categories' in pconfig:
+        axes.set_xticks([i for i,v in enumerate(pconfig['categories'])])
+        axes.set_xticklabels(pconfig['categories'])
+
+    # Axis lines
+    xlim = axes.get_xlim()
+    axes.plot([xlim[0], xlim[1]], [0, 0], linestyle='-', color='#dedede', linewidth=2)
+    axes.set_axisbelow(True)
+    axes.spines['right'].set_visible(False)
+    axes.spines['top'].set_visible(False)
+    axes.spines['bottom'].set_visible(False)
+    axes.spines['left'].set_visible(False)
+
+    # Background colours, if specified
+    if 'yPlotBands' in pconfig:
+        xlim = axes.get_xlim()
+        for pb in pconfig['yPlotBands']:
+            axes.barh(pb['from'], xlim[1], height = pb['to']-pb['from'], left=xlim[0], color=pb['color'], linewidth=0, zorder=0)
+    if 'xPlotBands' in pconfig:
+        ylim = axes.get_ylim()
+        for pb in pconfig['xPlotBands']:
+            axes.bar(pb['from'], ylim[1], width = pb['to']-pb['from'], bottom=ylim[0], color=pb['color'], linewidth=0, zorder=0)
+
+    # Tight layout - makes sure that legend fits in and stuff
+    if len(pdata) <= 15:
+        axes.legend(loc='lower center', bbox_to_anchor=(0, -0.22, 1, .102), ncol=5, mode='expand', fontsize=8, frameon=False)
+        plt.tight_layout(rect=[0,0.08,1,0.92])
+    else:
+        plt.tight_layout(rect=[0,0,1,0.92])
+
+    # Save the figure in each format
+    for name in img_names:
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png' if name == 'base64' else name, bbox_inches='tight')
+        images[name] = img_buffer.getvalue()
+        img_buffer.close()
+
+    plt.close(fig)
+
+    return images
 
 
 def smooth_line_data(data, numpoints, sumcounts=True):
@@ -4,6 +4,7 @@
 
 from collections import defaultdict, OrderedDict
 import logging
+import numpy as np
 import random
 
 from multiqc.utils import config, report, util_functions, mqc_colour
@@ -122,99 +123,48 @@ def make_table (dt):
         else:
             c_scale = mqc_colour.mqc_colour_scale(header['scale'], header['dmin'], header['dmax'])
 
-        # Add the data table cells
-        for (s_name, samp) in dt.data[idx].items():
-            if k in samp:
-                val = samp[k]
-                kname = '{}_{}'.format(header['namespace'], rid)
-                dt.raw_vals[s_name][kname] = val
-
-                if 'modify' in header and callable(header['modify']):
-                    val = header['modify'](val)
-
-                try:
-                    dmin = header['dmin']
-                    dmax = header['dmax']
-                    percentage = ((float(val) - dmin) / (dmax - dmin)) * 100
-                    percentage = min(percentage, 100)
-                    percentage = max(percentage, 0)
-                except (ZeroDivisionError,ValueError):
-                    percentage = 0
-
-                try:
-                    valstring = str(header['format'].format(val))
-                except ValueError:
-                    try:
-                        valstring = str(header['format'].format(float(val)))
-                    except ValueError:
-                        valstring = str(val)
-                except:
-                    valstring = str(val)
-
-                # This is horrible, but Python locale settings are worse
-                if config.thousandsSep_format is None:
-                    config.thousandsSep_format = '<span class="mqc_thousandSep"></span>'
-                if config.decimalPoint_format is None:
-                    config.decimalPoint_format = '.'
-                valstring = valstring.replace('.', 'DECIMAL').replace(',', 'THOUSAND')
-                valstring = valstring.replace('DECIMAL', config.decimalPoint_format).replace('THOUSAND', config.thousandsSep_format)
-
-                # Percentage suffixes etc
-                valstring += header.get('suffix', '')
-
-                # Conditional formatting
-                cmatches = { cfck: False for cfc in config.table_cond_formatting_colours for cfck in cfc }
-                # Find general rules followed by column-specific rules
-                for cfk in ['all_columns', rid]:
-                    if cfk in config.table_cond_formatting_rules:
-                        # Loop through match types
-                        for ftype in cmatches.keys():
-                            # Loop through array of comparison types
-                            for cmp in config.table_cond_formatting_rules[cfk].get(ftype, []):
-                                try:
-                                    # Each comparison should be a dict with single key: val
-                                    if 's_eq' in cmp and str(cmp['s_eq']).lower() == str(val).lower():
-                                        cmatches[ftype] = True
-                                    if 's_contains' in cmp and str(cmp['s_contains']).lower() in str(val).lower():
-                                        cmatches[ftype] = True
-                                    if 's_ne' in cmp and str(cmp['s_ne']).lower() != str(val).lower():
-                                        cmatches[ftype] = True
-                                    if 'eq' in cmp and float(cmp['eq']) == float(val):
-                                        cmatches[ftype] = True
-                                    if 'ne' in cmp and float(cmp['ne']) != float(val):
-                                        cmatches[ftype] = True
-                                    if 'gt' in cmp and float(cmp['gt']) < float(val):
-                                        cmatches[ftype] = True
-                                    if 'lt' in cmp and float(cmp['lt']) > float(val):
-                                        cmatches[ftype] = True
-                                except:
-                                    logger.warn("Not able to apply table conditional formatting to '{}' ({})".format(val, cmp))
-                # Apply HTML in order of config keys
-                bgcol = None
-                for cfc in config.table_cond_formatting_colours:
-                    for cfck in cfc: # should always be one, but you never know
-                        if cmatches[cfck]:
-                            bgcol = cfc[cfck]
+        # Add the data table cells, one column at a time
+        s_names, vals = table_object.column_values(dt.data[idx], k)
+        kname = '{}_{}'.format(header['namespace'], rid)
+        for s_name, val in zip(s_names, vals):
+            dt.raw_vals[s_name][kname] = val
+
+        if 'modify' in header and callable(header['modify']):
+            modified = table_object.apply_modify(header['modify'], vals)
+            if modified is None:
+                modified = [header['modify'](val) for val in vals]
+            vals = modified
+        vals = list(vals)
+
+        percentages = cell_percentages(vals, header['dmin'], header['dmax'])
+        valstrings = replace_separators(format_values(vals, header['format']))
+
+        # Percentage suffixes etc
+        suffix = header.get('suffix', '')
+        valstrings = [valstring + suffix for valstring in valstrings]
+
+        # Conditional formatting
+        bgcols = cond_formatting_colours(vals, cond_formatting_rules(rid))
+        if bgcols is not None:
+            for i, bgcol in enumerate(bgcols):
                 if bgcol is not None:
-                    valstring = '<span class="badge" style="background-color:{}">{}</span>'.format(bgcol, valstring)
-
-                # Build HTML
-                if not header['scale']:
-                    if s_name not in t_rows:
-                        t_rows[s_name] = dict()
-                    t_rows[s_name][rid] = '<td class="{rid} {h}">{v}</td>'.format(rid=rid, h=hide, v=valstring)
-                else:
-                    if c_scale is not None:
-                        col = ' background-color:{};'.format(c_scale.get_colour(val))
-                    else:
-                        col = ''
-                    bar_html = '<span class="bar" style="width:{}%;{}"></span>'.format(percentage, col)
-                    val_html = '<span class="val">{}</span>'.format(valstring)
-                    wrapper_html = '<div class="wrapper">{}{}</div>'.format(bar_html, val_html)
-
-                    if s_name not in t_rows:
-                        t_rows[s_name] = dict()
-                    t_rows[s_name][rid] = '<td class="data-coloured {rid} {h}">{c}</td>'.format(rid=rid, h=hide, c=wrapper_html)
+                    valstrings[i] = '<span class="badge" style="background-color:{}">{}</span>'.format(bgcol, valstrings[i])
+
+        # Build HTML
+        if not header['scale']:
+            cell_tpl = '<td class="{rid} {h}">{{}}</td>'.format(rid=rid, h=hide)
+            cells = [cell_tpl.format(valstring) for valstring in valstrings]
+        else:
+            if c_scale is not None:
+                cols = [' background-color:{};'.format(col) for col in c_scale.get_colour_list(vals)]
+            else:
+                cols = [''] * len(vals)
+            cell_tpl = '<td class="data-coloured {rid} {h}"><div class="wrapper"><span class="bar" style="width:{{}}%;{{}}"></span><span class="val">{{}}</span></div></td>'.format(rid=rid, h=hide)
+            cells = [cell_tpl.format(percentage, col, valstring) for percentage, col, valstring in zip(percentages, cols, valstrings)]
+        for s_name, cell in zip(s_names, cells):
+            if s_name not in t_rows:
+                t_rows[s_name] = dict()
+            t_rows[s_name][rid] = cell
 
         # Remove header if we don't have any filled cells for it
         if sum([len(rows) for rows in t_rows.values()]) == 0:
@@ -338,3 +288,154 @@ def make_table (dt):
         report.saved_raw_data[fn] = dt.raw_vals
 
     return html
+
+
+def cell_percentages(vals, dmin, dmax):
+    """ Width of the bar for each value in a column, as a percentage of
+    the range dmin to dmax. Values that aren't numbers get 0. """
+    floats, converted = table_object.float_array(table_object.object_array(vals))
+    drange = dmax - dmin
+    if drange == 0:
+        return [0] * len(vals)
+    with np.errstate(all='ignore'):
+        percentages = ((floats - dmin) / drange) * 100
+    return [(100 if p > 100 else 0 if p < 0 else p) if c else 0 for p, c in zip(percentages.tolist(), converted)]
+
+def format_value(val, fmt):
+    """ Format a single value with the column format string """
+    try:
+        valstring = str(fmt.format(val))
+    except ValueError:
+        try:
+            valstring = str(fmt.format(float(val)))
+        except ValueError:
+            valstring = str(val)
+    except:
+        valstring = str(val)
+    return valstring
+
+def format_values(vals, fmt):
+    """ Format a column of values. Values are only formatted one at a
+    time with the fallbacks in format_value if the column has any that
+    the format string doesn't work with. """
+    try:
+        return [str(fmt.format(val)) for val in vals]
+    except:
+        return [format_value(val, fmt) for val in vals]
+
+def replace_separators(valstrings):
+    """ Swap in the configured decimal point and thousands separator.
+    Done on the whole column at once, joined with null characters. """
+    # This is horrible, but Python locale settings are worse
+    if config.thousandsSep_format is None:
+        config.thousandsSep_format = '<span class="mqc_thousandSep"></span>'
+    if config.decimalPoint_format is None:
+        config.decimalPoint_format = '.'
+    def replace(valstring):
+        valstring = valstring.replace('.', 'DECIMAL').replace(',', 'THOUSAND')
+        return valstring.replace('DECIMAL', config.decimalPoint_format).replace('THOUSAND', config.thousandsSep_format)
+    if len(valstrings) == 0:
+        return []
+    joined = '\0'.join(valstrings)
+    if joined.count('\0') != len(valstrings) - 1 or '\0' in config.decimalPoint_format + config.thousandsSep_format:
+        return [replace(valstring) for valstring in valstrings]
+    return replace(joined).split('\0')
+
+def cond_formatting_rules(rid):
+    """ Conditional formatting rules for a column, as a list of
+    (match type, comparison) in the order that they are checked.
+    General rules come before column-specific rules. """
+    cmatches = { cfck: False for cfc in config.table_cond_formatting_colours for cfck in cfc }
+    rules = list()
+    for cfk in ['all_columns', rid]:
+        if cfk in config.table_cond_formatting_rules:
+            # Loop through match types
+            for ftype in cmatches.keys():
+                # Loop through array of comparison types
+                for cmp in config.table_cond_formatting_rules[cfk].get(ftype, []):
+                    rules.append((ftype, cmp))
+    return rules
+
+def cell_cond_formatting(val, rules):
+    """ Check the conditional formatting rules for a single value.
+    Returns the background colour or None. """
+    cmatches = { cfck: False for cfc in config.table_cond_formatting_colours for cfck in cfc }
+    for ftype, cmp in rules:
+        try:
+            # Each comparison should be a dict with single key: val
+            if 's_eq' in cmp and str(cmp['s_eq']).lower() == str(val).lower():
+                cmatches[ftype] = True
+            if 's_contains' in cmp and str(cmp['s_contains']).lower() in str(val).lower():
+                cmatches[ftype] = True
+            if 's_ne' in cmp and str(cmp['s_ne']).lower() != str(val).lower():
+                cmatches[ftype] = True
+            if 'eq' in cmp and float(cmp['eq']) == float(val):
+                cmatches[ftype] = True
+            if 'ne' in cmp and float(cmp['ne']) != float(val):
+                cmatches[ftype] = True
+            if 'gt' in cmp and float(cmp['gt']) < float(val):
+                cmatches[ftype] = True
+            if 'lt' in cmp and float(cmp['lt']) > float(val):
+                cmatches[ftype] = True
+        except:
+            logger.warn("Not able to apply table conditional formatting to '{}' ({})".format(val, cmp))
+    # Apply HTML in order of config keys
+    bgcol = None
+    for cfc in config.table_cond_formatting_colours:
+        for cfck in cfc: # should always be one, but you never know
+            if cmatches[cfck]:
+                bgcol = cfc[cfck]
+    return bgcol
+
+def cond_formatting_colours(vals, rules):
+    """ Check the conditional formatting rules for a column of values.
+    Returns a list of background colours (or None for no colour), or
+    None if no rules apply. Each comparison is done on the whole column
+    at once. Values that can't be compared as numbers with a numeric
+    rule are checked one at a time so that they log a warning. """
+    if len(rules) == 0:
+        return None
+    n = len(vals)
+    try:
+        cmatches = { cfck: np.zeros(n, dtype=bool) for cfc in config.table_cond_formatting_colours for cfck in cfc }
+        strvals = [str(val).lower() for val in vals]
+        s_eq = defaultdict(set)
+        for ftype, cmp in rules:
+            if not isinstance(cmp, dict):
+                raise TypeError
+            if 's_eq' in cmp:
+                s_eq[ftype].add(str(cmp['s_eq']).lower())
+        for ftype, targets in s_eq.items():
+            cmatches[ftype] |= np.array([v in targets for v in strvals], dtype=bool)
+        floats = None
+        checked = np.ones(n, dtype=bool)
+        for ftype, cmp in rules:
+            if 's_contains' in cmp:
+                target = str(cmp['s_contains']).lower()
+                cmatches[ftype] |= np.array([target in v for v in strvals], dtype=bool)
+            if 's_ne' in cmp:
+                target = str(cmp['s_ne']).lower()
+                cmatches[ftype] |= np.array([target != v for v in strvals], dtype=bool)
+            if any(c in cmp for c in ['eq', 'ne', 'gt', 'lt']):
+                if floats is None:
+                    floats, checked = table_object.float_array(table_object.object_array(vals))
+                if 'eq' in cmp:
+                    cmatches[ftype] |= float(cmp['eq']) == floats
+                if 'ne' in cmp:
+                    cmatches[ftype] |= float(cmp['ne']) != floats
+                if 'gt' in cmp:
+                    cmatches[ftype] |= float(cmp['gt']) < floats
+                if 'lt' in cmp:
+                    cmatches[ftype] |= float(cmp['lt']) > floats
+    except Exception:
+        return [cell_cond_formatting(val, rules) for val in vals]
+
+    # Apply HTML in order of config keys
+    bgcols = [None] * n
+    for cfc in config.table_cond_formatting_colours:
+        for cfck in cfc: # should always be one, but you never know
+            for i in np.flatnonzero(cmatches[cfck]):
+                bgcols[i] = cfc[cfck]
+    for i in np.flatnonzero(~checked):
+        bgcols[i] = cell_cond_formatting(vals[i], rules)
+    return bgcols
@@ -4,12 +4,95 @@
 
 from collections import defaultdict, OrderedDict
 import logging
+import numpy as np
 import re
 
 from multiqc.utils import config, report
 
 logger = logging.getLogger(__name__)
 
+def object_array(values):
+    """ Make a one dimensional NumPy array of Python objects from a list """
+    arr = np.array(values, dtype=object)
+    if arr.shape != (len(values),):
+        # Values are sequences themselves - don't let NumPy unpack them
+        arr = np.empty(len(values), dtype=object)
+        for i, v in enumerate(values):
+            arr[i] = v
+    return arr
+
+def float_array(values):
+    """ Call float() on every value in an object array. Returns the floats
+    and a boolean mask of the values that could be converted. ValueErrors
+    are caught as missing values, any other exception is raised. """
+    try:
+        return values.astype(np.float64), np.ones(len(values), dtype=bool)
+    except (TypeError, ValueError):
+        pass
+    floats = np.zeros(len(values), dtype=np.float64)
+    converted = np.ones(len(values), dtype=bool)
+    for i, v in enumerate(values):
+        try:
+            floats[i] = float(v)
+        except ValueError:
+            converted[i] = False
+    return floats, converted
+
+def apply_modify(modify, values):
+    """ Call a column's modify function on an object array of values in one go.
+    Arithmetic on object arrays uses the Python operators of each value, so
+    the results are the same as calling modify on each value. Returns None if
+    the function doesn't work on arrays, then it has to be called one value
+    at a time. """
+    if len(values) == 0:
+        return values
+    try:
+        with np.errstate(all='ignore'):
+            result = modify(values)
+        if not isinstance(result, np.ndarray) or result.dtype != object or result.shape != values.shape:
+            return None
+        # Spot check a few values against calling the function directly
+        for i in set([0, len(values) // 2, len(values) - 1]):
+            expected = modify(values[i])
+            if type(result[i]) is not type(expected):
+                return None
+            if not (result[i] == expected or (result[i] != result[i] and expected != expected)):
+                return None
+    except Exception:
+        return None
+    return result
+
+
+def column_values (d, k):
+    """ Get one column of a table section dict. Returns a list of the sample
+    names that have a value for this key and an object array of the values.
+    Columns are built one at a time when needed, so that only the data dicts
+    are kept for the whole table. """
+    s_names = [s_name for s_name, samp in d.items() if k in samp]
+    return s_names, object_array([d[s_name][k] for s_name in s_names])
+
+def column_floats (values, modify=None):
+    """ Numeric values of a column, after modify if given. Values that
+    can't be converted to floats are left out, as are NaNs. """
+    floats, converted = float_array(values)
+    floats = floats[converted]
+    if callable(modify):
+        pyfloats = floats.astype(object)
+        modified = apply_modify(modify, pyfloats)
+        if modified is not None:
+            floats, converted = float_array(modified)
+            floats = floats[converted]
+        else:
+            vals = list()
+            for val in pyfloats:
+                try:
+                    vals.append(float(modify(val)))
+                except ValueError:
+                    pass
+            floats = np.array(vals, dtype=np.float64)
+    return floats[~np.isnan(floats)]
+
+
 class datatable (object):
     """ Data table class. Prepares and holds data and configuration
     for either a table or a beeswarm plot. """
@@ -56,23 +139,17 @@ class datatable (object):
             for k in list(headers[idx].keys()):
                 headers[idx][str(k)] = headers[idx].pop(k)
             # Ensure that all sample names are strings as well
-            cdata = OrderedDict()
-            for k,v in data[idx].items():
-                cdata[str(k)] = v
-            data[idx] = cdata
-            for s_name in data[idx].keys():
-                for k in list(data[idx][s_name].keys()):
-                    data[idx][s_name][str(k)] = data[idx][s_name].pop(k)
+            if not all(type(s_name) is str and all(type(k) is str for k in samp) for s_name, samp in d.items()):
+                cdata = OrderedDict()
+                for k,v in data[idx].items():
+                    cdata[str(k)] = v
+                data[idx] = cdata
+                for s_name in data[idx].keys():
+                    for k in list(data[idx][s_name].keys()):
+                        data[idx][s_name][str(k)] = data[idx][s_name].pop(k)
 
             # Check that we have some data in each column
-            empties = list()
-            for k in keys:
-                n = 0
-                for samp in d.values():
-                    if k in samp:
-                        n += 1
-                if n == 0:
-                    empties.append(k)
+            empties = [k for k in keys if not any(k in samp for samp in data[idx].values())]
             for k in empties:
                 keys = [j for j in keys if j != k]
                 del headers[idx][k]
@@ -153,19 +230,13 @@ class datatable (object):
 
                 # Figure out the min / max if not supplied
                 if setdmax or setdmin:
-                    for s_name, samp in data[idx].items():
-                        try:
-                            val = float(samp[k])
-                            if callable(headers[idx][k]['modify']):
-                                val = float(headers[idx][k]['modify'](val))
-                            if setdmax:
-                                headers[idx][k]['dmax'] = max(headers[idx][k]['dmax'], val)
-                            if setdmin:
-                                headers[idx][k]['dmin'] = min(headers[idx][k]['dmin'], val)
-                        except ValueError:
-                            val = samp[k] # couldn't convert to float - keep as a string
-                        except KeyError:
-                            pass # missing data - skip
+                    # Values that can't be converted to floats are skipped
+                    vals = column_floats(column_values(data[idx], k)[1], headers[idx][k]['modify'])
+                    if len(vals) > 0:
+                        if setdmax:
+                            headers[idx][k]['dmax'] = max(headers[idx][k]['dmax'], vals.max().item())
+                        if setdmin:
+                            headers[idx][k]['dmin'] = min(headers[idx][k]['dmin'], vals.min().item())
                     # Limit auto-generated scales with floor, ceiling and minRange.
                     if headers[idx][k]['ceiling'] is not None and headers[idx][k]['max'] is None:
                         headers[idx][k]['dmax'] = min(headers[idx][k]['dmax'], float(headers[idx][k]['ceiling']))
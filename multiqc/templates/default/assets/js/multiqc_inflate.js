@@ -0,0 +1,216 @@
+////////////////////////////////////////////////
+// MultiQC Inflate
+// Decompresses zlib / deflate data (RFC 1950 / 1951),
+// used for plot data compressed with the zlib codec.
+////////////////////////////////////////////////
+
+var mqc_inflate = (function () {
+  'use strict';
+
+  // Huffman tree, stored as the number of codes of each length
+  // and the symbols in code order
+  function Tree() {
+    this.counts = new Uint16Array(16);
+    this.symbols = new Uint16Array(288);
+  }
+
+  var length_base = [3,4,5,6,7,8,9,10,11,13,15,17,19,23,27,31,35,43,51,59,67,83,99,115,131,163,195,227,258];
+  var length_extra = [0,0,0,0,0,0,0,0,1,1,1,1,2,2,2,2,3,3,3,3,4,4,4,4,5,5,5,5,0];
+  var dist_base = [1,2,3,4,5,7,9,13,17,25,33,49,65,97,129,193,257,385,513,769,1025,1537,2049,3073,4097,6145,8193,12289,16385,24577];
+  var dist_extra = [0,0,0,0,1,1,2,2,3,3,4,4,5,5,6,6,7,7,8,8,9,9,10,10,11,11,12,12,13,13];
+  var clen_order = [16,17,18,0,8,7,9,6,10,5,11,4,12,3,13,2,14,1,15];
+
+  function build_tree(t, lengths, off, num) {
+    var offs = new Uint16Array(16);
+    var i, sum = 0;
+    for (i = 0; i < 16; i++) { t.counts[i] = 0; }
+    for (i = 0; i < num; i++) { t.counts[lengths[off + i]]++; }
+    t.counts[0] = 0;
+    for (i = 0; i < 16; i++) {
+      offs[i] = sum;
+      sum += t.counts[i];
+    }
+    for (i = 0; i < num; i++) {
+      if (lengths[off + i]) { t.symbols[offs[lengths[off + i]]++] = i; }
+    }
+  }
+
+  // Fixed trees from the deflate spec
+  var fixed_lt = new Tree();
+  var fixed_dt = new Tree();
+  (function () {
+    var lengths = new Uint8Array(288);
+    var i;
+    for (i = 0; i < 144; i++) { lengths[i] = 8; }
+    for (i = 144; i < 256; i++) { lengths[i] = 9; }
+    for (i = 256; i < 280; i++) { lengths[i] = 7; }
+    for (i = 280; i < 288; i++) { lengths[i] = 8; }
+    build_tree(fixed_lt, lengths, 0, 288);
+    for (i = 0; i < 30; i++) { lengths[i] = 5; }
+    build_tree(fixed_dt, lengths, 0, 30);
+  })();
+
+  function Inflater(src) {
+    this.src = src;
+    this.pos = 0;
+    this.bitbuf = 0;
+    this.bitcnt = 0;
+    this.out = new Uint8Array(Math.max(1024, src.length * 4));
+    this.outlen = 0;
+  }
+
+  // Read num bits, least significant bit first
+  Inflater.prototype.bits = function (num) {
+    while (this.bitcnt < num) {
+      if (this.pos >= this.src.length) { throw new Error('Unexpected end of compressed data'); }
+      this.bitbuf |= this.src[this.pos++] << this.bitcnt;
+      this.bitcnt += 8;
+    }
+    var val = this.bitbuf & ((1 << num) - 1);
+    this.bitbuf >>>= num;
+    this.bitcnt -= num;
+    return val;
+  };
+
+  Inflater.prototype.decode_symbol = function (t) {
+    var sum = 0, cur = 0, len = 0;
+    do {
+      cur = 2 * cur + this.bits(1);
+      len++;
+      sum += t.counts[len];
+      cur -= t.counts[len];
+    } while (cur >= 0);
+    return t.symbols[sum + cur];
+  };
+
+  Inflater.prototype.ensure = function (extra) {
+    if (this.outlen + extra > this.out.length) {
+      var bigger = new Uint8Array(Math.max(this.out.length * 2, this.outlen + extra));
+      bigger.set(this.out.subarray(0, this.outlen));
+      this.out = bigger;
+    }
+  };
+
+  Inflater.prototype.dynamic_trees = function (lt, dt) {
+    var lengths = new Uint8Array(288 + 32);
+    var code_tree = new Tree();
+    var hlit = this.bits(5) + 257;
+    var hdist = this.bits(5) + 1;
+    var hclen = this.bits(4) + 4;
+    var i, num, sym, prev, rep;
+    for (i = 0; i < 19; i++) { lengths[i] = 0; }
+    for (i = 0; i < hclen; i++) { lengths[clen_order[i]] = this.bits(3); }
+    build_tree(code_tree, lengths, 0, 19);
+    for (num = 0; num < hlit + hdist; ) {
+      sym = this.decode_symbol(code_tree);
+      if (sym < 16) {
+        lengths[num++] = sym;
+        continue;
+      }
+      if (sym == 16) {
+        if (num == 0) { throw new Error('Invalid code lengths'); }
+        prev = lengths[num - 1];
+        rep = this.bits(2) + 3;
+      } else if (sym == 17) {
+        prev = 0;
+        rep = this.bits(3) + 3;
+      } else {
+        prev = 0;
+        rep = this.bits(7) + 11;
+      }
+      while (rep--) { lengths[num++] = prev; }
+    }
+    build_tree(lt, lengths, 0, hlit);
+    build_tree(dt, lengths, hlit, hdist);
+  };
+
+  Inflater.prototype.block_data = function (lt, dt) {
+    var sym, len, dist, i, start;
+    while (true) {
+      sym = this.decode_symbol(lt);
+      if (sym < 256) {
+        this.ensure(1);
+        this.out[this.outlen++] = sym;
+      } else if (sym == 256) {
+        return;
+      } else {
+        sym -= 257;
+        len = length_base[sym] + this.bits(length_extra[sym]);
+        sym = this.decode_symbol(dt);
+        dist = dist_base[sym] + this.bits(dist_extra[sym]);
+        if (dist > this.outlen) { throw new Error('Invalid distance'); }
+        this.ensure(len);
+        start = this.outlen - dist;
+        for (i = 0; i < len; i++) {
+          this.out[this.outlen++] = this.out[start + i];
+        }
+      }
+    }
+  };
+
+  Inflater.prototype.stored_block = function () {
+    // Skip to the next byte boundary and put back any whole buffered bytes
+    this.pos -= this.bitcnt >> 3;
+    this.bitbuf = 0;
+    this.bitcnt = 0;
+    var src = this.src;
+    var len = src[this.pos] | (src[this.pos + 1] << 8);
+    var nlen = src[this.pos + 2] | (src[this.pos + 3] << 8);
+    if (len != (~nlen & 0xffff)) { throw new Error('Invalid stored block'); }
+    this.pos += 4;
+    if (this.pos + len > src.length) { throw new Error('Unexpected end of compressed data'); }
+    this.ensure(len);
+    this.out.set(src.subarray(this.pos, this.pos + len), this.outlen);
+    this.outlen += len;
+    this.pos += len;
+  };
+
+  Inflater.prototype.run = function () {
+    var last, type, lt, dt;
+    do {
+      last = this.bits(1);
+      type = this.bits(2);
+      if (type == 0) {
+        this.stored_block();
+      } else if (type == 1) {
+        this.block_data(fixed_lt, fixed_dt);
+      } else if (type == 2) {
+        lt = new Tree();
+        dt = new Tree();
+        this.dynamic_trees(lt, dt);
+        this.block_data(lt, dt);
+      } else {
+        throw new Error('Invalid block type');
+      }
+    } while (!last);
+    return this.out.subarray(0, this.outlen);
+  };
+
+  // Inflate a Uint8Array. zlib data (with a 2 byte header) and raw deflate data both work.
+  function inflate(src) {
+    var start = 0;
+    if (src.length > 2 && (src[0] & 0x0f) == 8 && ((src[0] << 8) | src[1]) % 31 == 0) {
+      start = 2;
+    }
+    return new Inflater(src.subarray(start)).run();
+  }
+
+  // Inflate base64 encoded data and return it as a string
+  inflate.base64_to_string = function (b64) {
+    var bin = atob(b64);
+    var bytes = new Uint8Array(bin.length);
+    for (var i = 0; i < bin.length; i++) { bytes[i] = bin.charCodeAt(i); }
+    var out = inflate(bytes);
+    if (typeof TextDecoder !== 'undefined') {
+      return new TextDecoder('utf-8').decode(out);
+    }
+    // JSON from MultiQC is plain ASCII, so each byte is one character
+    var chunks = [];
+    for (var j = 0; j < out.length; j += 32768) {
+      chunks.push(String.fromCharCode.apply(null, out.subarray(j, j + 32768)));
+    }
+    return chunks.join('');
+  };
+
+  return inflate;
+})();
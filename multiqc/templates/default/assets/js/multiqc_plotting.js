@@ -17,14 +17,45 @@ window.mqc_hide_f_texts = [];
 window.mqc_hide_regex_mode = false;
 window.HCDefaults = undefined;
 
+// Decompress plot data, using the codec that the report was written with
+function mqc_decompress_plotdata(data){
+  if(typeof mqc_plotdata_codec !== 'undefined' && mqc_plotdata_codec == 'zlib'){
+    return JSON.parse(mqc_inflate.base64_to_string(data));
+  }
+  return JSON.parse(LZString.decompressFromBase64(data));
+}
+
+// Plot data is compressed separately for each plot. Return an object with a
+// property for each plot that decompresses the data the first time it is used.
+function mqc_lazy_plotdata(compressed){
+  // Reports with all plot data in one string
+  if(typeof compressed === 'string'){
+    return mqc_decompress_plotdata(compressed);
+  }
+  var plots = {};
+  $.each(compressed, function(target, data){
+    var set_value = function(value){
+      Object.defineProperty(plots, target, { value: value, writable: true, enumerable: true, configurable: true });
+      return value;
+    };
+    Object.defineProperty(plots, target, {
+      get: function(){ return set_value(mqc_decompress_plotdata(data)); },
+      set: set_value,
+      enumerable: true,
+      configurable: true
+    });
+  });
+  return plots;
+}
+
 // Execute when page load has finished loading
 $(function () {
 
   // Show loading warning
   $('.mqc_loading_warning').show();
 
-  // Decompress the JSON plot data
-  mqc_plots = JSON.parse(LZString.decompressFromBase64(mqc_compressed_plotdata));
+  // Set up the JSON plot data, decompressed as each plot is drawn
+  mqc_plots = mqc_lazy_plotdata(mqc_compressed_plotdata);
 
   // HighCharts Defaults
   window.HCDefaults = $.extend(true, {}, Highcharts.getOptions(), {});
@@ -62,20 +93,38 @@ $(function () {
   });
 
   // Render plots on page load
-  $('.hc-plot.not_rendered:visible:not(.gt_max_num_ds)').each(function(){
-    var target = $(this).attr('id');
-    // Only one point per dataset, so multiply limit by arbitrary number.
-    var max_num = num_datasets_plot_limit * 50;
-    // Deferring each plot call prevents browser from locking up
-    setTimeout(function(){
-        plot_graph(target, undefined, max_num);
-        if($('.hc-plot.not_rendered:visible:not(.gt_max_num_ds)').length == 0){
-          $('.mqc_loading_warning').hide();
+  // Only one point per dataset, so multiply limit by arbitrary number.
+  var max_num = num_datasets_plot_limit * 50;
+  if('IntersectionObserver' in window){
+    // Render each plot when it scrolls into view
+    var plot_observer = new IntersectionObserver(function(entries){
+      $.each(entries, function(i, entry){
+        if(entry.isIntersecting){
+          plot_observer.unobserve(entry.target);
+          if($(entry.target).hasClass('not_rendered')){
+            plot_graph($(entry.target).attr('id'), undefined, max_num);
+          }
         }
-    }, 50);
-  });
-  if($('.hc-plot.not_rendered:visible:not(.gt_max_num_ds)').length == 0){
+      });
+    }, { rootMargin: '500px 0px' });
+    $('.hc-plot.not_rendered:visible:not(.gt_max_num_ds)').each(function(){
+      plot_observer.observe(this);
+    });
     $('.mqc_loading_warning').hide();
+  } else {
+    $('.hc-plot.not_rendered:visible:not(.gt_max_num_ds)').each(function(){
+      var target = $(this).attr('id');
+      // Deferring each plot call prevents browser from locking up
+      setTimeout(function(){
+          plot_graph(target, undefined, max_num);
+          if($('.hc-plot.not_rendered:visible:not(.gt_max_num_ds)').length == 0){
+            $('.mqc_loading_warning').hide();
+          }
+      }, 50);
+    });
+    if($('.hc-plot.not_rendered:visible:not(.gt_max_num_ds)').length == 0){
+      $('.mqc_loading_warning').hide();
+    }
   }
 
   // Render a plot when clicked
@@ -220,6 +220,10 @@ $(function () {
         var f_height = parseInt($('#mqc_exp_height').val()) / f_scale;
         $('#mqc_export_selectplots input:checked').each(function(){
           var fname = $(this).val();
+          // Plots are drawn as they scroll into view, draw any that haven't been yet
+          if($('#'+fname).hasClass('not_rendered') && !$('#'+fname).hasClass('gt_max_num_ds')){
+            plot_graph(fname);
+          }
           var hc = $('#'+fname).highcharts();
           var cfg = {
             type: ft,
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+""" MultiQC on-disk caches. Used to skip repeating work on files
+and plots that have not changed since a previous MultiQC run. """
+
+from __future__ import print_function
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+from multiqc.utils import config, config_cache
+logger = config.logger
+
+def get_cache_dir():
+    """ Return the directory used for MultiQC caches, creating it if needed.
+    Uses config.cache_dir if set, otherwise $MULTIQC_CACHE_DIR or ~/.cache/multiqc """
+    cache_dir = config.cache_dir
+    if cache_dir is None:
+        cache_dir = config_cache.default_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
+class SearchCache(object):
+    """
+    Remembers the search result of each file for every search pattern key
+    that was checked, keyed on the file path, size and modification time.
+    Results are kept for the keys of every module, so running a different
+    set of modules (-m / -e) only searches files again where a key that is
+    needed wasn't checked before. Stored in an SQLite database along with a
+    hash of the search patterns, so that any change to the patterns
+    invalidates the whole cache. Files under the searched paths that no
+    longer exist are removed when the cache is saved.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.entries = dict()
+        self.new_entries = list()
+        self.seen = set()
+        self.sp_hash = self.patterns_hash()
+        try:
+            self.db_fn = os.path.join(get_cache_dir(), 'search_cache.sqlite')
+            self.db = sqlite3.connect(self.db_fn, timeout=60)
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS files (root TEXT, fn TEXT, size INTEGER, mtime REAL, keys TEXT, PRIMARY KEY (root, fn))')
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'sp_hash'").fetchone()
+            if row is None or row[0] != self.sp_hash:
+                logger.debug("Search patterns have changed, clearing the search cache")
+                self.db.execute('DELETE FROM files')
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sp_hash', ?)", (self.sp_hash,))
+                self.db.commit()
+            else:
+                for root, fn, size, mtime, results in self.db.execute('SELECT root, fn, size, mtime, keys FROM files'):
+                    self.entries[(root, fn)] = (size, mtime, json.loads(results))
+            logger.debug("Loaded {} files from the search cache: {}".format(len(self.entries), self.db_fn))
+        except (IOError, OSError, sqlite3.Error) as e:
+            logger.warning("Could not use the search cache, searching all files: {}".format(e))
+            self.close()
+
+    @staticmethod
+    def patterns_hash():
+        """ Hash everything that can change the search result of a file """
+        h = hashlib.sha1()
+        h.update(json.dumps([
+            'key results',
+            config.sp,
+            config.fn_ignore_files,
+            config.log_filesize_limit,
+            config.version
+        ], sort_keys=True, default=repr).encode('utf-8'))
+        return h.hexdigest()
+
+    def add(self, f, mtime, results):
+        """ Remember the search result for a file """
+        self.seen.add((f['root'], f['fn']))
+        if self.db is None or mtime is None or 'filesize' not in f:
+            return
+        cached = self.entries.get((f['root'], f['fn']))
+        if cached is None or cached[0] != f['filesize'] or cached[1] != mtime or cached[2] != results:
+            self.new_entries.append((f['root'], f['fn'], f['filesize'], mtime, json.dumps(results)))
+
+    def save(self):
+        """ Write new and updated entries to the cache database, and remove
+        files under the searched paths that no longer exist """
+        if self.db is None:
+            return
+        removed = [k for k in self.entries if k not in self.seen and searched_path(*k) and not os.path.isfile(os.path.join(*k))]
+        try:
+            self.db.executemany('INSERT OR REPLACE INTO files (root, fn, size, mtime, keys) VALUES (?, ?, ?, ?, ?)', self.new_entries)
+            self.db.executemany('DELETE FROM files WHERE root = ? AND fn = ?', removed)
+            self.db.commit()
+            logger.debug("Saved {} new files to the search cache, removed {}".format(len(self.new_entries), len(removed)))
+        except sqlite3.Error as e:
+            logger.warning("Could not save the search cache: {}".format(e))
+        self.new_entries = list()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+class MemorySearchCache(object):
+    """
+    Search results kept in memory between the runs of multiqc --watch,
+    with the same interface as SearchCache. Only the files found by the
+    latest search are kept, along with the paths that were searched.
+    """
+
+    def __init__(self):
+        self.entries = dict()
+        self.new_entries = dict()
+        self.sp_hash = None
+        self.paths = list()
+
+    def start(self):
+        """ Forget the search results if the search patterns have changed """
+        sp_hash = SearchCache.patterns_hash()
+        if sp_hash != self.sp_hash:
+            self.entries = dict()
+            self.sp_hash = sp_hash
+        self.new_entries = dict()
+
+    def add(self, f, mtime, results):
+        if mtime is not None and 'filesize' in f:
+            self.new_entries[(f['root'], f['fn'])] = (f['filesize'], mtime, results)
+
+    def save(self):
+        self.entries = self.new_entries
+        self.new_entries = dict()
+        self.paths = list(config.analysis_dir)
+
+    def close(self):
+        pass
+
+memory_search_cache = None
+def get_memory_search_cache():
+    """ Return the MemorySearchCache, creating it on first use """
+    global memory_search_cache
+    if memory_search_cache is None:
+        memory_search_cache = MemorySearchCache()
+    memory_search_cache.start()
+    return memory_search_cache
+
+
+def searched_path(root, fn):
+    """ Whether a file is in one of the analysis paths being searched """
+    for path in config.analysis_dir:
+        if os.path.join(root, fn) == path or root == path or root.startswith(os.path.join(path, '')):
+            return True
+    return False
+
+
+class ParseCache(object):
+    """
+    Stores the parsed results of individual log files, so that modules which
+    opt in with find_log_files(cache_parsed=True) don't need to re-read and
+    re-parse files that haven't changed since a previous run.
+    Entries are keyed on the module, search pattern key and file path, and
+    are only used if the file size, modification time and version match.
+    """
+
+    def __init__(self):
+        self.db = None
+        try:
+            self.db_fn = os.path.join(get_cache_dir(), 'parse_cache.sqlite')
+            self.db = sqlite3.connect(self.db_fn, timeout=60)
+            self.db.execute('CREATE TABLE IF NOT EXISTS parsed (module TEXT, sp_key TEXT, root TEXT, fn TEXT, size INTEGER, mtime REAL, version TEXT, data BLOB, PRIMARY KEY (module, sp_key, root, fn))')
+            logger.debug("Using parsed data cache: {}".format(self.db_fn))
+        except (IOError, OSError, sqlite3.Error) as e:
+            logger.warning("Could not use the parsed data cache: {}".format(e))
+            self.close()
+
+    @staticmethod
+    def file_stat(f):
+        try:
+            st = os.stat(os.path.join(f['root'], f['fn']))
+            return st.st_size, st.st_mtime
+        except (IOError, OSError):
+            return None, None
+
+    def get(self, module, sp_key, f, version):
+        """ Return the cached parsed result for a file, or None """
+        if self.db is None:
+            return None
+        size, mtime = self.file_stat(f)
+        if size is None:
+            return None
+        try:
+            row = self.db.execute('SELECT size, mtime, version, data FROM parsed WHERE module = ? AND sp_key = ? AND root = ? AND fn = ?',
+                (module, sp_key, f['root'], f['fn'])).fetchone()
+            if row is None or row[0] != size or row[1] != mtime or row[2] != version:
+                return None
+            return pickle.loads(bytes(row[3]))
+        except (sqlite3.Error, pickle.UnpicklingError, AttributeError, EOFError, ImportError, TypeError) as e:
+            logger.debug("Could not load cached data for '{}': {}".format(f['fn'], e))
+            return None
+
+    def add(self, module, sp_key, f, version, parsed):
+        """ Save the parsed result for a file """
+        if self.db is None:
+            return
+        size, mtime = self.file_stat(f)
+        if size is None:
+            return
+        try:
+            data = pickle.dumps(parsed, protocol=2)
+            self.db.execute('INSERT OR REPLACE INTO parsed (module, sp_key, root, fn, size, mtime, version, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (module, sp_key, f['root'], f['fn'], size, mtime, version, sqlite3.Binary(data)))
+        except (sqlite3.Error, pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.debug("Could not cache parsed data for '{}': {}".format(f['fn'], e))
+
+    def commit(self):
+        if self.db is not None:
+            try:
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.warning("Could not save the parsed data cache: {}".format(e))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+parse_cache = None
+def get_parse_cache():
+    """ Return the shared ParseCache, opening it on first use """
+    global parse_cache
+    if parse_cache is None:
+        parse_cache = ParseCache()
+    return parse_cache
+
+
+class PlotCache(object):
+    """
+    Stores the images drawn for flat plots, so that plots with the same data
+    and config as a previous run don't need to be drawn again. Entries are
+    keyed on a hash of the plot data, config, image format and the MultiQC and
+    MatPlotLib versions. The least recently used images are removed when the
+    cache is bigger than config.plot_cache_size (in megabytes).
+    """
+
+    def __init__(self):
+        self.db = None
+        self.pid = os.getpid()
+        try:
+            self.db_fn = os.path.join(get_cache_dir(), 'plot_cache.sqlite')
+            self.db = sqlite3.connect(self.db_fn, timeout=60)
+            self.db.execute('CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, size INTEGER, atime REAL, data BLOB)')
+            logger.debug("Using flat plot cache: {}".format(self.db_fn))
+        except (IOError, OSError, sqlite3.Error) as e:
+            logger.warning("Could not use the flat plot cache: {}".format(e))
+            self.close()
+
+    @staticmethod
+    def plot_key(*parts):
+        """ Hash everything that can change how a plot is drawn. The plot ID
+        is left out of the config, as random IDs are made for some plots. """
+        try:
+            import matplotlib
+            mpl_version = matplotlib.__version__
+        except ImportError:
+            mpl_version = None
+        parts = [dict((k, v) for k, v in p.items() if k != 'id') if isinstance(p, dict) else p for p in parts]
+        h = hashlib.sha1()
+        try:
+            h.update(json.dumps([parts, config.version, mpl_version], sort_keys=True, default=repr).encode('utf-8'))
+        except (TypeError, ValueError) as e:
+            logger.debug("Could not make a key for the flat plot cache: {}".format(e))
+            return None
+        return h.hexdigest()
+
+    def get(self, key, fformats):
+        """ Return a dict with the cached image for each format, or None if any are missing """
+        if self.db is None or key is None:
+            return None
+        images = dict()
+        try:
+            for fformat in fformats:
+                row = self.db.execute('SELECT data FROM images WHERE key = ?', ('{}.{}'.format(key, fformat),)).fetchone()
+                if row is None:
+                    return None
+                images[fformat] = bytes(row[0])
+            self.db.executemany('UPDATE images SET atime = ? WHERE key = ?', [(time.time(), '{}.{}'.format(key, f)) for f in fformats])
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.debug("Could not load cached plot images: {}".format(e))
+            return None
+        return images
+
+    def add(self, key, images):
+        """ Save the images for a plot, one per format """
+        if self.db is None or key is None:
+            return
+        try:
+            now = time.time()
+            self.db.executemany('INSERT OR REPLACE INTO images (key, size, atime, data) VALUES (?, ?, ?, ?)',
+                [('{}.{}'.format(key, f), len(data), now, sqlite3.Binary(data)) for f, data in images.items()])
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.debug("Could not cache plot images: {}".format(e))
+
+    def trim(self):
+        """ Remove the least recently used images until the cache is under its size limit """
+        if self.db is None:
+            return
+        max_size = config.plot_cache_size * 1024 * 1024
+        try:
+            total = 0
+            old_keys = list()
+            for key, size in self.db.execute('SELECT key, size FROM images ORDER BY atime DESC'):
+                total += size
+                if total > max_size:
+                    old_keys.append((key,))
+            if len(old_keys) > 0:
+                self.db.executemany('DELETE FROM images WHERE key = ?', old_keys)
+                self.db.commit()
+                logger.debug("Removed {} images from the flat plot cache".format(len(old_keys)))
+        except sqlite3.Error as e:
+            logger.warning("Could not trim the flat plot cache: {}".format(e))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+plot_cache = None
+def get_plot_cache():
+    """ Return the PlotCache for this process, opening it on first use.
+    Worker processes drawing plots open their own connection. """
+    global plot_cache
+    if plot_cache is None or plot_cache.pid != os.getpid():
+        plot_cache = PlotCache()
+    return plot_cache
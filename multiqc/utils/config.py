@@ -8,47 +8,39 @@ from datetime import datetime
 import inspect
 import collections
 import os
-import pkg_resources
-import subprocess
 import sys
 import yaml
 
 import multiqc
+from multiqc.utils import config_cache
 
 # Default logger will be replaced by caller
 import logging
 logger = logging.getLogger(__name__)
 
+# The default config, search patterns, version and entry points are
+# loaded from a cached bundle, as parsing and finding them is slow
+startup_bundle = config_cache.get_bundle()
+
 # Get the MultiQC version
-version = pkg_resources.get_distribution("multiqc").version
-short_version = pkg_resources.get_distribution("multiqc").version
+version = startup_bundle['version']
+short_version = startup_bundle['version']
 script_path = os.path.dirname(os.path.realpath(__file__))
-git_hash = None
+git_hash = config_cache.git_hash(script_path)
 git_hash_short = None
-try:
-    git_hash = subprocess.check_output( ['git', 'rev-parse', 'HEAD'],
-                                        cwd=script_path,
-                                        stderr=subprocess.STDOUT,
-                                        universal_newlines=True ).strip()
+if git_hash is not None:
     git_hash_short = git_hash[:7]
     version = '{} ({})'.format(version, git_hash_short)
-except:
-    pass
 
 # Constants
 MULTIQC_DIR = os.path.dirname(os.path.realpath(inspect.getfile(multiqc)))
 
 ##### MultiQC Defaults
 # Default MultiQC config
-searchp_fn = os.path.join( MULTIQC_DIR, 'utils', 'config_defaults.yaml')
-with open(searchp_fn) as f:
-    configs = yaml.safe_load(f)
-    for c, v in configs.items():
-        globals()[c] = v
+for c, v in startup_bundle['config_defaults'].items():
+    globals()[c] = v
 # Module filename search patterns
-searchp_fn = os.path.join( MULTIQC_DIR, 'utils', 'search_patterns.yaml')
-with open(searchp_fn) as f:
-    sp = yaml.safe_load(f)
+sp = startup_bundle['sp']
 
 # Other defaults that can't be set in YAML
 data_tmp_dir = '/tmp' # will be overwritten by core script
@@ -63,7 +55,7 @@ megaqc_access_token = os.environ.get('MEGAQC_ACCESS_TOKEN')
 # Modules must be listed in setup.py under entry_points['multiqc.modules.v1']
 # Get all modules, including those from other extension packages
 avail_modules = dict()
-for entry_point in pkg_resources.iter_entry_points('multiqc.modules.v1'):
+for entry_point in config_cache.iter_entry_points('multiqc.modules.v1'):
     nicename = str(entry_point).split('=')[0].strip()
     avail_modules[nicename] = entry_point
 
@@ -71,7 +63,7 @@ for entry_point in pkg_resources.iter_entry_points('multiqc.modules.v1'):
 # Templates must be listed in setup.py under entry_points['multiqc.templates.v1']
 # Get all templates, including those from other extension packages
 avail_templates = {}
-for entry_point in pkg_resources.iter_entry_points('multiqc.templates.v1'):
+for entry_point in config_cache.iter_entry_points('multiqc.templates.v1'):
     nicename = str(entry_point).split('=')[0].strip()
     avail_templates[nicename] = entry_point
 
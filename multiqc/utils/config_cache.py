@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+""" MultiQC startup cache. Parsing the default config and search pattern
+YAML files and scanning the installed packages for plugin entry points
+is slow, and happens every time MultiQC starts. The results are saved
+to a bundle in the cache directory, which is used until any of the files
+that it was made from change. Importing MultiQC only reads the bundle,
+it is written by the multiqc command once the user config is loaded. """
+
+from __future__ import print_function
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import sys
+
+MULTIQC_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+yaml_fns = [
+    os.path.join(MULTIQC_DIR, 'utils', 'config_defaults.yaml'),
+    os.path.join(MULTIQC_DIR, 'utils', 'search_patterns.yaml')
+]
+entry_point_groups = [
+    'multiqc.modules.v1',
+    'multiqc.templates.v1',
+    'multiqc.hooks.v1',
+    'multiqc.cli_options.v1'
+]
+# Bump this if the contents of the bundle change
+bundle_format = 1
+
+
+class EntryPoint(object):
+    """ Stand-in for a pkg_resources entry point, so that entry points
+    can be loaded without importing pkg_resources """
+
+    def __init__(self, name, module_name, attrs):
+        self.name = name
+        self.module_name = module_name
+        self.attrs = tuple(attrs)
+
+    def load(self):
+        obj = importlib.import_module(self.module_name)
+        for attr in self.attrs:
+            obj = getattr(obj, attr)
+        return obj
+
+    def __str__(self):
+        s = '{} = {}'.format(self.name, self.module_name)
+        if self.attrs:
+            s += ':' + '.'.join(self.attrs)
+        return s
+
+
+def default_cache_dir():
+    """ The directory used for caches when cache_dir isn't set in the config.
+    The MULTIQC_CACHE_DIR environment variable sets it for the startup bundle
+    as well, which is read before any config files. """
+    cache_dir = os.environ.get('MULTIQC_CACHE_DIR')
+    if cache_dir is None:
+        xdg_cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        cache_dir = os.path.join(xdg_cache, 'multiqc')
+    return cache_dir
+
+
+def bundle_fn():
+    """ Path to the bundle file, with one bundle for each Python and
+    search path that MultiQC is run with """
+    h = hashlib.sha1()
+    h.update(json.dumps([sys.executable, sys.path]).encode('utf-8'))
+    return os.path.join(default_cache_dir(), 'config_bundle_{}.pickle'.format(h.hexdigest()[:12]))
+
+
+def bundle_key():
+    """ Hash the sizes and modification times of the YAML files and of
+    the package metadata for everything on the Python path. Installing,
+    updating or removing any package changes the key. """
+    stats = [sys.version, bundle_format]
+    def add_stat(fn):
+        try:
+            st = os.stat(fn)
+            stats.append((fn, st.st_size, st.st_mtime))
+        except OSError:
+            pass
+    for fn in yaml_fns:
+        add_stat(fn)
+    for path in sys.path:
+        if not os.path.isdir(path):
+            add_stat(path)
+            continue
+        add_stat(path)
+        try:
+            dist_names = sorted(os.listdir(path))
+        except OSError:
+            continue
+        for name in dist_names:
+            if name.endswith(('.egg-info', '.dist-info', '.egg-link', '.egg', '.pth')):
+                dist_path = os.path.join(path, name)
+                add_stat(dist_path)
+                for meta_fn in ['entry_points.txt', 'PKG-INFO', 'METADATA']:
+                    add_stat(os.path.join(dist_path, meta_fn))
+    h = hashlib.sha1()
+    h.update(json.dumps(stats).encode('utf-8'))
+    return h.hexdigest()
+
+
+def build_bundle():
+    """ Parse the YAML files and find the version and entry points """
+    import pkg_resources
+    import yaml
+    bundle = dict()
+    with open(yaml_fns[0]) as f:
+        bundle['config_defaults'] = yaml.safe_load(f)
+    with open(yaml_fns[1]) as f:
+        bundle['sp'] = yaml.safe_load(f)
+    bundle['version'] = pkg_resources.get_distribution('multiqc').version
+    bundle['entry_points'] = dict()
+    for group in entry_point_groups:
+        bundle['entry_points'][group] = [(ep.name, ep.module_name, ep.attrs) for ep in pkg_resources.iter_entry_points(group)]
+    return bundle
+
+
+bundle = None
+bundle_cached = False
+def get_bundle():
+    """ Return the bundle, loading it from the cache or building it on first use.
+    A new bundle is only kept in memory, see save_bundle(). """
+    global bundle, bundle_cached
+    if bundle is not None:
+        return bundle
+    key = bundle_key()
+    try:
+        with open(bundle_fn(), 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('key') == key:
+            bundle = cached
+            bundle_cached = True
+            return bundle
+    except Exception:
+        pass # Missing or unreadable, build a new one
+    bundle = build_bundle()
+    bundle['key'] = key
+    return bundle
+
+
+def save_bundle(cache_dir=None):
+    """ Write the bundle to the cache if it was built by this process.
+    Called by the multiqc command once the user config is loaded. Nothing
+    is written if cache_dir is set to another directory than the one the
+    bundle is read from, as it would never be found there. """
+    global bundle_cached
+    if bundle is None or bundle_cached:
+        return
+    if cache_dir is not None and os.path.realpath(cache_dir) != os.path.realpath(default_cache_dir()):
+        return
+    fn = bundle_fn()
+    try:
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        tmp_fn = '{}.{}'.format(fn, os.getpid())
+        with open(tmp_fn, 'wb') as f:
+            pickle.dump(bundle, f, protocol=2)
+        os.rename(tmp_fn, fn)
+        bundle_cached = True
+    except (IOError, OSError):
+        pass # Can't write to the cache directory, rebuild next time
+
+
+def iter_entry_points(group):
+    """ Entry points for a group, in the same order as pkg_resources gives them """
+    for name, module_name, attrs in get_bundle()['entry_points'].get(group, []):
+        yield EntryPoint(name, module_name, attrs)
+
+
+def git_hash(path):
+    """ Return the commit checked out in the git repository containing path,
+    or None. Reads the files in the .git directory instead of running git. """
+    git_dir = None
+    path = os.path.realpath(path)
+    while True:
+        if os.path.exists(os.path.join(path, '.git')):
+            git_dir = os.path.join(path, '.git')
+            break
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    commit = None
+    try:
+        # Worktrees and submodules have a .git file pointing to the real directory
+        if os.path.isfile(git_dir):
+            with open(git_dir) as f:
+                git_dir = os.path.join(path, f.read().strip().split('gitdir:', 1)[1].strip())
+        common_dir = git_dir
+        if os.path.isfile(os.path.join(git_dir, 'commondir')):
+            with open(os.path.join(git_dir, 'commondir')) as f:
+                common_dir = os.path.join(git_dir, f.read().strip())
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            commit = f.read().strip()
+        if commit.startswith('ref:'):
+            ref = commit[4:].strip()
+            commit = None
+            for d in [git_dir, common_dir]:
+                if os.path.isfile(os.path.join(d, ref)):
+                    with open(os.path.join(d, ref)) as f:
+                        commit = f.read().strip()
+                    break
+            else:
+                with open(os.path.join(common_dir, 'packed-refs')) as f:
+                    for l in f:
+                        s = l.strip().split(' ')
+                        if len(s) == 2 and s[1] == ref:
+                            commit = s[0]
+                            break
+    except (IOError, OSError, IndexError):
+        return None
+    if commit is None or len(commit) != 40 or commit.strip('0123456789abcdef') != '':
+        return None
+    return commit
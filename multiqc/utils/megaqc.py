@@ -3,11 +3,11 @@
 """ MultiQC code to export data to MegaQC / flat JSON files """
 
 from __future__ import print_function
-import gzip
 import io
 import json
 import os
-import requests
+import tempfile
+import zlib
 
 from multiqc import config
 log = config.logger
@@ -54,9 +54,8 @@ def multiqc_dump_json(report):
                     d = {'{}_{}'.format(s, k): getattr(config, k)}
                 elif s == 'report':
                     d = {'{}_{}'.format(s, k): getattr(report, k)}
-                json.dumps(d, cls=MQCJSONEncoder, ensure_ascii=False) # Test that exporting to JSON works
                 exported_data.update(d)
-            except (TypeError, KeyError, AttributeError):
+            except (KeyError, AttributeError):
                 log.warn("Couldn't export data key '{}.{}'".format(s, k))
         # Get the absolute paths of analysis directories
         exported_data['config_analysis_dir_abs'] = list()
@@ -68,24 +67,155 @@ def multiqc_dump_json(report):
     return exported_data
 
 
+def multiqc_dump_merge_json(report):
+    """ Report sections and modified General Statistics values, added to
+    the data file with --export-for-merge so that exports can be merged into
+    a new report (multiqc --merge). Not sent to MegaQC. """
+    return {
+        'report_modules': export_modules(report),
+        'report_general_stats_modified': export_general_stats_modified(report)
+    }
+
+
+def export_modules(report):
+    """ The module report sections, with any flat plots swapped in """
+    from multiqc.utils.plot_jobs import runner as plot_runner
+    modules = list()
+    for m in report.modules_output:
+        sections = list()
+        for s in getattr(m, 'sections', []):
+            section = dict((k, s.get(k)) for k in ['name', 'anchor', 'description', 'comment', 'helptext', 'print_section'])
+            for k in ['plot', 'content']:
+                section[k] = plot_runner.substitute(s[k]) if s.get(k) else s.get(k)
+            sections.append(section)
+        modules.append({
+            'name': getattr(m, 'name', None),
+            'anchor': getattr(m, 'anchor', None),
+            'intro': getattr(m, 'intro', None),
+            'comment': getattr(m, 'comment', None),
+            'sections': sections
+        })
+    return modules
+
+
+def export_general_stats_modified(report):
+    """ General Statistics values with each column's modify function applied """
+    modified = list()
+    for idx, data in enumerate(report.general_stats_data):
+        headers = report.general_stats_headers[idx]
+        mdata = dict()
+        for s_name, row in data.items():
+            mdata[s_name] = dict()
+            for k, val in row.items():
+                modify = headers.get(k, {}).get('modify')
+                if callable(modify):
+                    try:
+                        val = modify(val)
+                    except (TypeError, ValueError, ZeroDivisionError):
+                        pass
+                mdata[s_name][k] = val
+        modified.append(mdata)
+    return modified
+
+
+def json_chunks(data, depth=3, path=()):
+    """ Encode data as JSON a piece at a time. Dicts and lists are split up
+    to depth levels deep and everything below that is encoded in one go, so
+    only one piece of the export is held as a string at once. Pieces that
+    can't be encoded are written as null. """
+    if isinstance(data, dict) and depth > 0:
+        yield u'{'
+        sep = u''
+        for k, v in data.items():
+            try:
+                # Use the json module to turn numbers, None etc. into key strings
+                key = json.dumps({k: None}, ensure_ascii=False)[1:-7]
+            except TypeError:
+                log.warn("Couldn't export data key '{}'".format('.'.join(str(p) for p in path + (k,))))
+                continue
+            yield u'{}{}: '.format(sep, key)
+            sep = u', '
+            for c in json_chunks(v, depth - 1, path + (k,)):
+                yield c
+        yield u'}'
+    elif isinstance(data, (list, tuple)) and depth > 0:
+        yield u'['
+        for i, v in enumerate(data):
+            if i > 0:
+                yield u', '
+            for c in json_chunks(v, depth - 1, path + (i,)):
+                yield c
+        yield u']'
+    else:
+        try:
+            yield json.dumps(data, cls=MQCJSONEncoder, ensure_ascii=False)
+        except (TypeError, ValueError):
+            log.warn("Couldn't export data key '{}'".format('.'.join(str(p) for p in path)))
+            yield u'null'
+
+
+def json_blocks(data, compress=False, block_size=2**16):
+    """ Encode data as UTF-8 JSON in blocks of about block_size bytes,
+    optionally as a gzip stream """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buf = list()
+    buf_size = 0
+    for c in json_chunks(data):
+        buf.append(c.encode('utf-8', 'ignore'))
+        buf_size += len(buf[-1])
+        if buf_size >= block_size:
+            block = b''.join(buf)
+            buf = list()
+            buf_size = 0
+            if compressor is not None:
+                block = compressor.compress(block)
+            if block:
+                yield block
+    block = b''.join(buf) + (b'' if compress else b'\n')
+    if compressor is not None:
+        block = compressor.compress(block) + compressor.flush()
+    yield block
+
+
+def multiqc_dump_file(exported_data):
+    """ Stream the export to multiqc_data.json in the data directory,
+    or multiqc_data.json.gz if config.data_dump_file_gzip is set """
+    if config.data_dir is None:
+        return
+    fn = 'multiqc_data.json.gz' if config.data_dump_file_gzip else 'multiqc_data.json'
+    with io.open(os.path.join(config.data_dir, fn), 'wb') as f:
+        for block in json_blocks(exported_data, compress=config.data_dump_file_gzip):
+            f.write(block)
+
+
+# Status codes from servers that don't support chunked uploads
+# (Length Required, Not Implemented), and the size of upload kept
+# in memory before it is written to a temporary file instead
+chunked_rejected_codes = [411, 501]
+spool_max_size = 32 * 1024 * 1024
+
 def multiqc_api_post(exported_data):
+    """ Send the export to MegaQC as a gzipped JSON stream, with a chunked HTTP upload.
+    If the server doesn't accept chunked uploads, the gzipped JSON is written to a
+    temporary file (kept in memory while small) and sent again with its length. """
+    import requests # Only needed here, and slow to import
     headers = { 'Content-Type': 'application/json', 'content-encoding': 'gzip' }
     if config.megaqc_access_token is not None:
         headers['access_token'] = config.megaqc_access_token
-    post_data = json.dumps({'data': exported_data}, cls=MQCJSONEncoder, ensure_ascii=False, indent=2)
-    post_data = post_data.encode('utf-8', 'ignore')
-
-    # Gzip the JSON for massively decreased filesize
-    sio_obj = io.BytesIO()
-    gzfh = gzip.GzipFile(fileobj=sio_obj, mode='w')
-    gzfh.write(post_data)
-    gzfh.close()
-    request_body = sio_obj.getvalue()
 
     log.info("Sending data to MegaQC")
     log.debug("MegaQC URL: {}".format(config.megaqc_url))
     try:
+        request_body = json_blocks({'data': exported_data}, compress=True)
         r = requests.post(config.megaqc_url, headers=headers, data=request_body, timeout=config.megaqc_timeout)
+        if r.status_code in chunked_rejected_codes:
+            log.debug("MegaQC didn't accept a chunked upload (status code {}), sending the data again with its length".format(r.status_code))
+            with tempfile.SpooledTemporaryFile(max_size=spool_max_size) as request_body:
+                for block in json_blocks({'data': exported_data}, compress=True):
+                    request_body.write(block)
+                headers['Content-Length'] = str(request_body.tell())
+                request_body.seek(0)
+                r = requests.post(config.megaqc_url, headers=headers, data=request_body, timeout=config.megaqc_timeout)
     except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout) as e:
         log.error("Timed out when sending data: {}".format(e))
     except requests.exceptions.ConnectionError:
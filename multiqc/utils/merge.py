@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+""" MultiQC code to merge the data exports (multiqc_data.json) of earlier
+runs into one report, without finding and parsing the logs again (--merge).
+Exports are read one at a time, so the work scales with the size of the
+parsed data rather than the original logs. """
+
+from __future__ import print_function
+from collections import OrderedDict
+import gzip
+import io
+import json
+import os
+import re
+import zipfile
+
+from multiqc.utils import config, report, util_functions
+logger = config.logger
+
+dump_fns = ['multiqc_data.json', 'multiqc_data.json.gz']
+collision_modes = ['rename', 'keep', 'overwrite']
+
+# Plot IDs made up at random when a module doesn't give one
+random_id_re = re.compile(r'(?<![a-zA-Z0-9_])(mqc_hcplot_[a-zA-Z]{10}|table_[a-zA-Z]{4})(?![a-zA-Z0-9])')
+
+
+class MergedModule(object):
+    """ Report module built from the exported sections of earlier runs """
+
+    def __init__(self, name, anchor, intro, comment, sections):
+        self.name = name
+        self.anchor = anchor
+        self.intro = intro
+        self.comment = comment
+        self.sections = sections
+        self.css = dict()
+        self.js = dict()
+
+
+def find_dumps(path):
+    """ Data export files for a path: either an export file itself, a
+    data directory, a report directory or a zipped data directory """
+    if os.path.isfile(path):
+        return [path]
+    found = list()
+    for d in [path] + [os.path.join(path, sub) for sub in sorted(os.listdir(path))]:
+        for fn in dump_fns:
+            if os.path.isfile(os.path.join(d, fn)):
+                found.append(os.path.join(d, fn))
+                break
+        else:
+            if d.endswith('_data.zip') and os.path.isfile(d):
+                found.append(d)
+        if d == path and len(found) > 0:
+            break
+    return found
+
+
+def load_dump(path):
+    """ Read a data export, which may be gzipped or in a zipped data directory """
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as z:
+            names = [n for n in z.namelist() if os.path.basename(n) in dump_fns]
+            if len(names) == 0:
+                raise ValueError("No {} found in {}".format(' or '.join(dump_fns), path))
+            contents = z.read(names[0])
+            if names[0].endswith('.gz'):
+                contents = gzip.GzipFile(fileobj=io.BytesIO(contents)).read()
+    elif path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            contents = f.read()
+    else:
+        with io.open(path, 'rb') as f:
+            contents = f.read()
+    return json.loads(contents.decode('utf-8'))
+
+
+def dump_label(path):
+    """ Name for the run that made an export: the name of its report directory """
+    d = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(d).endswith('_data') or os.path.basename(d) == config.data_dir_name:
+        d = os.path.dirname(d)
+    return os.path.basename(d) or d
+
+
+def sample_names(dump):
+    """ Sample names in the General Statistics, data sources and raw data of an export """
+    names = set()
+    for d in dump.get('report_general_stats_data', []):
+        names.update(d.keys())
+    for mod in dump.get('report_data_sources', {}).values():
+        for sec in mod.values():
+            names.update(sec.keys())
+    for fn, d in dump.get('report_saved_raw_data', {}).items():
+        if isinstance(d, dict) and fn != 'multiqc_general_stats':
+            names.update(d.keys())
+    return names
+
+
+def _change_keys(d, changes):
+    return OrderedDict((changes.get(k, k), v) for k, v in d.items() if changes.get(k, k) is not None)
+
+
+def _change_list(items, changes, name=lambda x: x):
+    """ Indices and new names of the items that are kept """
+    kept = list()
+    for i, item in enumerate(items):
+        new = changes.get(name(item), name(item))
+        if new is not None:
+            kept.append((i, new))
+    return kept
+
+
+def change_samples(dump, changes):
+    """ Rename samples in an export in place. changes is a dict of
+    old name: new name, or old name: None to remove the sample. """
+    if len(changes) == 0:
+        return
+    for key in ['report_general_stats_data', 'report_general_stats_modified']:
+        if key in dump:
+            dump[key] = [_change_keys(d, changes) for d in dump[key]]
+    for mod in dump.get('report_data_sources', {}).values():
+        for sec in list(mod.keys()):
+            mod[sec] = _change_keys(mod[sec], changes)
+    for fn, d in dump.get('report_saved_raw_data', {}).items():
+        if isinstance(d, dict):
+            dump['report_saved_raw_data'][fn] = _change_keys(d, changes)
+    for plot in dump.get('report_plot_data', {}).values():
+        if plot.get('plot_type') in ['xy_line', 'scatter']:
+            for i, ds in enumerate(plot['datasets']):
+                kept = _change_list(ds, changes, lambda s: s.get('name'))
+                plot['datasets'][i] = [ds[j] for j, _ in kept]
+                for s, (_, new) in zip(plot['datasets'][i], kept):
+                    s['name'] = new
+        elif plot.get('plot_type') == 'bar_graph':
+            for i, samples in enumerate(plot['samples']):
+                kept = _change_list(samples, changes)
+                plot['samples'][i] = [new for _, new in kept]
+                for cat in plot['datasets'][i]:
+                    cat['data'] = [cat['data'][j] for j, _ in kept]
+        elif plot.get('plot_type') == 'beeswarm':
+            for i, samples in enumerate(plot['samples']):
+                kept = _change_list(samples, changes)
+                plot['samples'][i] = [new for _, new in kept]
+                plot['datasets'][i] = [plot['datasets'][i][j] for j, _ in kept]
+
+
+def plot_keys(dump):
+    """ Keys to match up the plots of different exports. Plots are matched
+    by ID, unless the ID was made up at random, when the position of the
+    plot in the report sections is used instead. """
+    keys = dict((pid, pid) for pid in dump.get('report_plot_data', {}))
+    for m in dump.get('report_modules', []):
+        for s in m['sections']:
+            html = (s.get('plot') or '') + (s.get('content') or '')
+            n = 0
+            for pid in random_id_re.findall(html):
+                if pid in keys and keys[pid] == pid:
+                    keys[pid] = (m['anchor'], s['anchor'], n)
+                    n += 1
+    return keys
+
+
+def section_html(s):
+    """ HTML of a report section, with any random IDs numbered in order
+    so that sections that only differ by those IDs are the same """
+    html = u'\0'.join(s.get(k) or u'' for k in ['description', 'plot', 'content'])
+    ids = dict()
+    return random_id_re.sub(lambda m: ids.setdefault(m.group(1), u'\0{}'.format(len(ids))), html)
+
+
+def merge_plot(plot, new, pid):
+    """ Add the data from one plot to another with the same key """
+    if plot['plot_type'] != new['plot_type']:
+        logger.warning("Plot '{}' has different types in the exports, only keeping the first".format(pid))
+        return
+    ptype = plot['plot_type']
+    if ptype in ['xy_line', 'scatter']:
+        for i, ds in enumerate(new['datasets']):
+            if i >= len(plot['datasets']):
+                plot['datasets'].append(ds)
+                continue
+            seen = set(s.get('name') for s in plot['datasets'][i])
+            plot['datasets'][i].extend(s for s in ds if s.get('name') not in seen)
+    elif ptype == 'bar_graph':
+        for i, samples in enumerate(new['samples']):
+            if i >= len(plot['samples']):
+                plot['samples'].append(samples)
+                plot['datasets'].append(new['datasets'][i])
+                continue
+            seen = set(plot['samples'][i])
+            kept = [j for j, s in enumerate(samples) if s not in seen]
+            num_old = len(plot['samples'][i])
+            cats = OrderedDict((c['name'], c) for c in plot['datasets'][i])
+            for c in new['datasets'][i]:
+                if c['name'] not in cats:
+                    cats[c['name']] = dict(c, data=[0] * num_old)
+                    plot['datasets'][i].append(cats[c['name']])
+                cats[c['name']]['data'].extend(c['data'][j] for j in kept)
+            for c in plot['datasets'][i]:
+                c['data'].extend([0] * (num_old + len(kept) - len(c['data'])))
+            plot['samples'][i].extend(samples[j] for j in kept)
+    elif ptype == 'beeswarm' and [c.get('title') for c in plot['categories']] == [c.get('title') for c in new['categories']]:
+        for i, samples in enumerate(new['samples']):
+            seen = set(plot['samples'][i])
+            kept = [j for j, s in enumerate(samples) if s not in seen]
+            plot['samples'][i].extend(samples[j] for j in kept)
+            plot['datasets'][i].extend(new['datasets'][i][j] for j in kept)
+    else:
+        logger.warning("Can't merge plot '{}', only keeping the data from the first export".format(pid))
+
+
+def general_stats_sections(dump):
+    """ General Statistics headers and values from an export, with the
+    values that the modify functions gave in the original run """
+    modified = dump.get('report_general_stats_modified')
+    for idx, headers in enumerate(dump.get('report_general_stats_headers', [])):
+        data = dump['report_general_stats_data'][idx]
+        if modified is not None:
+            data = modified[idx]
+        headers = OrderedDict((k, dict(h)) for k, h in headers.items())
+        for k, h in headers.items():
+            # Older exports only have the modify function called with 1
+            mult = h.get('modify')
+            if modified is None and isinstance(mult, (int, float)) and not isinstance(mult, bool):
+                for s_name in data:
+                    try:
+                        data[s_name][k] = float(data[s_name][k]) * mult
+                    except (KeyError, TypeError, ValueError):
+                        pass
+            h['modify'] = False
+            for hk in ['rid', 'dmax', 'dmin']:
+                h.pop(hk, None)
+        key = tuple(sorted((k, h.get('namespace')) for k, h in headers.items()))
+        yield key, headers, data
+
+
+def merge_dumps(paths):
+    """ Merge the data exports found in paths into the report. Returns the
+    report modules, made from the exported report sections. """
+    mode = config.merge_sample_collisions
+    if mode not in collision_modes:
+        logger.warning("Unknown merge_sample_collisions '{}', using 'rename'".format(mode))
+        mode = 'rename'
+    dumps = [fn for p in paths for fn in find_dumps(p)]
+    if len(dumps) == 0:
+        logger.error("No MultiQC data exports found to merge")
+        return list()
+    labels = list()
+    for fn in dumps:
+        label = dump_label(fn)
+        if label in labels:
+            label = '{} {}'.format(label, len(labels) + 1)
+        labels.append(label)
+
+    merged = {
+        'report_general_stats_headers': list(),
+        'report_general_stats_data': list(),
+        'report_data_sources': OrderedDict(),
+        'report_saved_raw_data': OrderedDict(),
+        'report_plot_data': OrderedDict()
+    }
+    gs_keys = dict()
+    plot_ids = dict()
+    modules = OrderedDict()
+    seen = set()
+    for fn, label in zip(dumps, labels):
+        logger.info("Merging '{}'".format(fn))
+        dump = load_dump(fn)
+
+        # Sample name collisions with earlier exports
+        names = sample_names(dump)
+        collisions = names & seen
+        if len(collisions) > 0:
+            logger.info("{} sample names in '{}' were also in earlier exports".format(len(collisions), label))
+            if mode == 'rename':
+                change_samples(dump, dict((s, '{} ({})'.format(s, label)) for s in collisions))
+                names = (names - collisions) | set('{} ({})'.format(s, label) for s in collisions)
+            elif mode == 'keep':
+                change_samples(dump, dict((s, None) for s in collisions))
+            else:
+                change_samples(merged, dict((s, None) for s in collisions))
+        seen.update(names)
+
+        # General Statistics
+        for key, headers, data in general_stats_sections(dump):
+            if key in gs_keys:
+                merged['report_general_stats_data'][gs_keys[key]].update(data)
+            else:
+                gs_keys[key] = len(merged['report_general_stats_headers'])
+                merged['report_general_stats_headers'].append(headers)
+                merged['report_general_stats_data'].append(data)
+
+        # Data sources and raw data
+        for mod, secs in dump.get('report_data_sources', {}).items():
+            for sec, sources in secs.items():
+                merged['report_data_sources'].setdefault(mod, OrderedDict()).setdefault(sec, OrderedDict()).update(sources)
+        for rfn, data in dump.get('report_saved_raw_data', {}).items():
+            if rfn in merged['report_saved_raw_data'] and isinstance(data, dict):
+                merged['report_saved_raw_data'][rfn].update(data)
+            else:
+                merged['report_saved_raw_data'][rfn] = data
+
+        # Plots, using the IDs from the first export that had each one
+        id_changes = dict()
+        for pid, key in plot_keys(dump).items():
+            plot = dump['report_plot_data'][pid]
+            if key in plot_ids:
+                if plot_ids[key] != pid:
+                    id_changes[pid] = plot_ids[key]
+                merge_plot(merged['report_plot_data'][plot_ids[key]], plot, plot_ids[key])
+            else:
+                plot_ids[key] = pid
+                merged['report_plot_data'][pid] = plot
+
+        # Report sections. Sections that are the same as in an earlier export
+        # (eg. only an interactive plot) are shown once, others once per export.
+        def change_ids(html):
+            if not html or len(id_changes) == 0:
+                return html
+            return random_id_re.sub(lambda m: id_changes.get(m.group(1), m.group(1)), html)
+        for m in dump.get('report_modules', []):
+            mod = modules.setdefault(m['anchor'], {'module': m, 'sections': OrderedDict()})
+            for s in m['sections']:
+                s['plot'] = change_ids(s.get('plot'))
+                s['content'] = change_ids(s.get('content'))
+                versions = mod['sections'].setdefault(s['anchor'], list())
+                compare = section_html(s)
+                for v in versions:
+                    if v['compare'] == compare:
+                        v['labels'].append(label)
+                        break
+                else:
+                    versions.append({'section': s, 'labels': [label], 'compare': compare})
+        if 'report_modules' not in dump:
+            logger.warning("'{}' has no report sections. Make it with --export-for-merge to save them.".format(fn))
+        del dump
+
+    # Put the merged data into the report
+    report.general_stats_headers = merged['report_general_stats_headers']
+    report.general_stats_data = merged['report_general_stats_data']
+    for mod, secs in merged['report_data_sources'].items():
+        for sec, sources in secs.items():
+            report.data_sources[mod][sec].update(sources)
+    report.plot_data = merged['report_plot_data']
+    report.num_hc_plots = len(report.plot_data)
+    report.html_ids.extend(report.plot_data.keys())
+    for rfn, data in merged['report_saved_raw_data'].items():
+        if isinstance(data, dict):
+            report.saved_raw_data[rfn] = data
+            util_functions.write_data_file(data, rfn)
+
+    modules_output = list()
+    for anchor, mod in modules.items():
+        sections = list()
+        for s_anchor, versions in mod['sections'].items():
+            for v in versions:
+                s = v['section']
+                if len(versions) > 1:
+                    s['name'] = '{}: {}'.format(s['name'], ', '.join(v['labels'])) if s.get('name') else ', '.join(v['labels'])
+                    s['anchor'] = report.save_htmlid('{}-{}'.format(s_anchor, v['labels'][0]))
+                else:
+                    report.html_ids.append(s_anchor)
+                if 'mqc_mplplot' in (s.get('plot') or '') + (s.get('content') or ''):
+                    report.num_mpl_plots += 1
+                sections.append(s)
+        m = mod['module']
+        report.html_ids.append(anchor)
+        modules_output.append(MergedModule(m['name'], anchor, m.get('intro'), m.get('comment'), sections))
+    logger.info("Merged {} exports: {} samples, {} plots, {} modules".format(len(dumps), len(seen), len(report.plot_data), len(modules_output)))
+    return modules_output
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+""" MultiQC module runner. Runs the analysis modules, optionally
+several at once in forked worker processes (--module-jobs). Results
+from the workers are merged back into the report in run_modules
+order, so that the report is the same as a serial run. """
+
+from __future__ import print_function
+from collections import defaultdict, OrderedDict
+import copy
+import logging
+import multiprocessing
+import pickle
+import traceback
+
+from multiqc.utils import config, report, profiling, shard, watch
+logger = config.logger
+
+# Config values of these types are copied into workers and sent back if changed
+config_types = (dict, list, tuple, str, int, float, bool, type(None))
+try:
+    config_types += (unicode,)
+except NameError:
+    pass # Python 3
+
+
+class ProbedList(list):
+    """ List that remembers every value checked with `in`. Used for
+    report.html_ids so that we know which IDs a module's output depends on. """
+
+    def __init__(self, *args):
+        super(ProbedList, self).__init__(*args)
+        self.probes = set()
+
+    def __contains__(self, item):
+        self.probes.add(item)
+        return super(ProbedList, self).__contains__(item)
+
+
+class ProbedDict(dict):
+    """ Dict that remembers every key looked up, and whether any key was set.
+    Used for report.files so that we know which search results a module's
+    output depends on. """
+
+    def __init__(self, *args):
+        super(ProbedDict, self).__init__(*args)
+        self.probes = set()
+        self.replaced = False
+
+    def __getitem__(self, key):
+        self.probes.add(key)
+        return super(ProbedDict, self).__getitem__(key)
+
+    def __contains__(self, key):
+        self.probes.add(key)
+        return super(ProbedDict, self).__contains__(key)
+
+    def get(self, key, default=None):
+        self.probes.add(key)
+        return super(ProbedDict, self).get(key, default)
+
+    def __setitem__(self, key, value):
+        self.replaced = True
+        super(ProbedDict, self).__setitem__(key, value)
+
+
+class ModifyLookup(object):
+    """ Picklable stand-in for a general statistics `modify` function.
+    Holds the results of the original function for every value that
+    it can be called with when building the report. """
+
+    def __init__(self, modify, values):
+        self.results = dict()
+        for val in list(values) + [1]:
+            for v in [val, self.float_or_none(val)]:
+                if v is None:
+                    continue
+                try:
+                    self.results[self.key(v)] = (True, modify(v))
+                except Exception as e:
+                    self.results[self.key(v)] = (False, e)
+
+    @staticmethod
+    def float_or_none(val):
+        try:
+            return float(val)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def key(val):
+        return (type(val).__name__, repr(val))
+
+    def __call__(self, val):
+        ok, result = self.results[self.key(val)]
+        if not ok:
+            raise result
+        return result
+
+
+class ModuleOutput(object):
+    """ Picklable copy of the attributes of a module object that
+    are used to build the report """
+    attributes = ['name', 'anchor', 'intro', 'comment', 'sections', 'css', 'js']
+
+    def __init__(self, mod):
+        for attr in self.attributes:
+            if hasattr(mod, attr):
+                setattr(self, attr, getattr(mod, attr))
+
+
+class ListHandler(logging.Handler):
+    """ Collects log records so that they can be replayed by the parent process """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = list()
+
+    def emit(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+
+def run_module(this_module, mod_cust_config):
+    """ Load and run a single module, returning its output """
+    mod = config.avail_modules[this_module].load()
+    # With --shard, modules that can't save their parsed data are run by --reduce
+    if config.shard is not None and len(getattr(mod, 'state_attrs', [])) == 0:
+        logger.debug("Module '{}' can't save its parsed data, its files will be parsed by --reduce".format(this_module))
+        raise UserWarning
+    mod.mod_cust_config = mod_cust_config # feels bad doing this, but seems to work
+    return mod()
+
+
+class ModuleRunner(object):
+    """
+    Runs modules in run_modules order. With config.module_jobs > 1, all
+    modules are started in a pool of forked workers when the runner is
+    created, and run() merges the result from each worker into the report.
+    Modules are re-run in the main process if their results can't be
+    sent back, if they crashed or if an earlier module saved an HTML ID
+    that they looked up.
+    With --watch, modules always run in workers so that their results can
+    be kept, and modules whose files haven't changed use their kept results.
+    """
+
+    def __init__(self, run_modules):
+        self.pool = None
+        self.results = None
+        self.num_html_ids = len(report.html_ids)
+        self.kept = dict()
+        if config.watch:
+            self.kept = watch.kept_results(run_modules)
+            run_modules = [m for m in run_modules if watch.module_key(*list(m.items())[0]) not in self.kept]
+        njobs = min(config.module_jobs, len(run_modules))
+        if njobs > 1 or (config.watch and njobs > 0):
+            try:
+                ctx = multiprocessing.get_context('fork')
+            except AttributeError:
+                ctx = multiprocessing # Python 2, always forks
+            except ValueError:
+                logger.warning("Can't fork worker processes on this system, running modules one at a time")
+                return
+            logger.debug("Running {} modules with {} processes".format(len(run_modules), njobs))
+            self.pool = ctx.Pool(njobs, worker_init)
+            self.results = self.pool.imap(worker_run_module, [list(m.items())[0] for m in run_modules])
+
+    def run(self, this_module, mod_cust_config):
+        """ Return the output of the next module. Raises UserWarning if
+        the module found no samples, like the module itself. """
+        key = watch.module_key(this_module, mod_cust_config)
+        if key in self.kept:
+            result = pickle.loads(self.kept[key])
+            if self.ids_ok(result):
+                return self.merge(result)
+            logger.debug("Module '{}' clashes with HTML IDs from an earlier module, re-running".format(this_module))
+            return run_module(this_module, mod_cust_config)
+        if self.pool is None:
+            return run_module(this_module, mod_cust_config)
+        status, result = next(self.results)
+        if status == 'ok':
+            data = result
+            result = pickle.loads(data)
+            if self.ids_ok(result):
+                if config.watch:
+                    watch.keep_result(this_module, mod_cust_config, data, result)
+                return self.merge(result)
+            logger.debug("Module '{}' clashes with HTML IDs from an earlier module, re-running".format(this_module))
+        else:
+            logger.debug("Module '{}' could not be run in parallel, re-running: {}".format(this_module, result))
+        return run_module(this_module, mod_cust_config)
+
+    def ids_ok(self, result):
+        """ Whether the module didn't look up any HTML IDs saved by earlier modules """
+        new_ids = set(report.html_ids[self.num_html_ids:])
+        return len(new_ids & result['html_id_probes']) == 0
+
+    def merge(self, result):
+        """ Add the results from a worker to the report """
+        for record in result['log_records']:
+            logging.getLogger(record.name).handle(record)
+        report.html_ids.extend(result['html_ids'])
+        report.lint_errors.extend(result['lint_errors'])
+        report.general_stats_data.extend(result['general_stats_data'])
+        report.general_stats_headers.extend(result['general_stats_headers'])
+        for k, v in result['plot_data']:
+            report.plot_data[k] = v
+        for k, v in result['saved_raw_data']:
+            report.saved_raw_data[k] = v
+        for mod, sec, s_name, source in result['data_sources']:
+            report.data_sources[mod][sec][s_name] = source
+        report.num_hc_plots += result['num_hc_plots']
+        report.num_mpl_plots += result['num_mpl_plots']
+        profiling.file_times.extend(result['profile_file_times'])
+        for k, v in result['shard_module_states']:
+            shard.module_states[k] = v
+        for k, v in result['config']:
+            setattr(config, k, v)
+        if result['files_dir'] is not None:
+            watch.copy_module_files(result['files_dir'])
+        if result['user_warning']:
+            raise UserWarning
+        return result['output']
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+# Report state when the workers were forked, restored before each module
+initial_state = None
+
+def worker_init():
+    global initial_state
+    initial_state = {
+        'html_ids': list(report.html_ids),
+        'lint_errors': list(report.lint_errors),
+        'general_stats_data': list(report.general_stats_data),
+        'general_stats_headers': list(report.general_stats_headers),
+        'plot_data': dict(report.plot_data),
+        'saved_raw_data': dict(report.saved_raw_data),
+        'data_sources': copy.deepcopy(report.data_sources),
+        'files': copy.deepcopy(report.files),
+        'num_hc_plots': report.num_hc_plots,
+        'num_mpl_plots': report.num_mpl_plots,
+        'profile_file_times': list(profiling.file_times),
+        'shard_module_states': dict(shard.module_states),
+        'config': get_config_values(copy.deepcopy)
+    }
+
+def get_config_values(copy_value=None):
+    """ Return the config values that are copied between processes """
+    values = dict()
+    for k, v in vars(config).items():
+        if k.startswith('_') or not isinstance(v, config_types):
+            continue
+        try:
+            values[k] = copy_value(v) if copy_value else v
+        except Exception:
+            pass # Can't be copied, don't track it
+    return values
+
+def reset_report():
+    """ Put the report and config back to how they were when the worker started """
+    s = initial_state
+    report.html_ids = ProbedList(s['html_ids'])
+    report.lint_errors = list(s['lint_errors'])
+    report.general_stats_data = list(s['general_stats_data'])
+    report.general_stats_headers = list(s['general_stats_headers'])
+    report.plot_data = dict(s['plot_data'])
+    report.saved_raw_data = dict(s['saved_raw_data'])
+    report.data_sources = copy.deepcopy(s['data_sources'])
+    report.files = ProbedDict(copy.deepcopy(s['files']))
+    report.num_hc_plots = s['num_hc_plots']
+    report.num_mpl_plots = s['num_mpl_plots']
+    profiling.file_times = list(s['profile_file_times'])
+    shard.module_states = OrderedDict(s['shard_module_states'])
+    for k in get_config_values():
+        if k not in s['config']:
+            delattr(config, k)
+    for k, v in s['config'].items():
+        setattr(config, k, copy.deepcopy(v))
+
+def worker_run_module(mod_item):
+    """ Run a module in a worker process. Returns a status and either
+    the pickled changes to the report or the reason it failed. """
+    this_module, mod_cust_config = mod_item
+    reset_report()
+    log_handler = ListHandler()
+    root_logger = logging.getLogger()
+    for l in [root_logger, config.logger]:
+        for h in list(l.handlers):
+            l.removeHandler(h)
+    root_logger.addHandler(log_handler)
+
+    user_warning = False
+    try:
+        with watch.module_files_dir() as files_dir:
+            output = run_module(this_module, mod_cust_config)
+        if type(output) != list:
+            output = [output]
+    except UserWarning:
+        output = []
+        user_warning = True
+    except Exception:
+        return 'error', traceback.format_exc().splitlines()[-1]
+    finally:
+        root_logger.removeHandler(log_handler)
+
+    try:
+        result = get_changes()
+        result['user_warning'] = user_warning
+        result['files_dir'] = files_dir
+        result['output'] = [ModuleOutput(m) for m in output]
+        result['log_records'] = log_handler.records
+        return 'ok', pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        return 'error', "{}: {}".format(type(e).__name__, e)
+
+def plain_dicts(data):
+    """ Convert defaultdicts to dicts so that they can be pickled. Only used
+    for data that is just written out, where the two behave the same. """
+    if isinstance(data, defaultdict):
+        return dict((k, plain_dicts(v)) for k, v in data.items())
+    if isinstance(data, dict):
+        for k, v in data.items():
+            if isinstance(v, dict):
+                data[k] = plain_dicts(v)
+    elif isinstance(data, list):
+        for i, v in enumerate(data):
+            if isinstance(v, (dict, list)):
+                data[i] = plain_dicts(v)
+    return data
+
+def get_changes():
+    """ Find everything that the module added to the report """
+    s = initial_state
+    gs_headers = report.general_stats_headers[len(s['general_stats_headers']):]
+    gs_data = report.general_stats_data[len(s['general_stats_data']):]
+    for data, headers in zip(gs_data, gs_headers):
+        for k in headers:
+            if callable(headers[k].get('modify')):
+                values = [d[k] for d in data.values() if k in d]
+                headers[k]['modify'] = ModifyLookup(headers[k]['modify'], values)
+    data_sources = list()
+    for mod in report.data_sources:
+        for sec in report.data_sources[mod]:
+            for s_name, source in report.data_sources[mod][sec].items():
+                if s['data_sources'].get(mod, {}).get(sec, {}).get(s_name) != source:
+                    data_sources.append((mod, sec, s_name, source))
+    config_values = get_config_values()
+    return {
+        'html_ids': list(report.html_ids[len(s['html_ids']):]),
+        'html_id_probes': report.html_ids.probes,
+        'files_probes': report.files.probes,
+        'files_replaced': report.files.replaced,
+        'lint_errors': report.lint_errors[len(s['lint_errors']):],
+        'general_stats_data': gs_data,
+        'general_stats_headers': gs_headers,
+        'plot_data': [(k, plain_dicts(v)) for k, v in report.plot_data.items() if s['plot_data'].get(k) is not v],
+        'saved_raw_data': [(k, plain_dicts(v)) for k, v in report.saved_raw_data.items() if s['saved_raw_data'].get(k) is not v],
+        'data_sources': data_sources,
+        'num_hc_plots': report.num_hc_plots - s['num_hc_plots'],
+        'num_mpl_plots': report.num_mpl_plots - s['num_mpl_plots'],
+        'profile_file_times': profiling.file_times[len(s['profile_file_times']):],
+        'shard_module_states': [(k, v) for k, v in shard.module_states.items() if k not in s['shard_module_states']],
+        'config': [(k, v) for k, v in config_values.items() if k not in s['config'] or s['config'][k] != v]
+    }
@@ -12,6 +12,12 @@ import re
 import logging
 logger = logging.getLogger(__name__)
 
+non_numeric_re = re.compile("[^0-9\.]")
+hex_codes = ['{:02x}'.format(i) for i in range(256)]
+
+# Colour scales that have already been compiled, see mqc_colour_scale.compile_scale()
+compiled_scales = dict()
+
 
 class mqc_colour_scale(object):
 	""" Class to hold a colour scheme. """
@@ -40,28 +46,51 @@ class mqc_colour_scale(object):
 
 	def get_colour(self, val, colformat='hex'):
 		""" Given a value, return a colour within the colour scale """
-		try:
-			# Sanity checks
-			val = re.sub("[^0-9\.]", "", str(val))
-			if val == '':
-				val = self.minval
-			val = float(val)
-			val = max(val, self.minval)
-			val = min(val, self.maxval)
-
-			domain_nums = list( np.linspace(self.minval, self.maxval, len(self.colours)) )
-			my_scale = spectra.scale(self.colours).domain(domain_nums)
-
-			# Weird, I know. I ported this from the original JavaScript for continuity
-			# Seems to work better than adjusting brightness / saturation / luminosity
-			rgb_converter = lambda x: max(0, min(1, 1+((x-1)*0.3)))
-			thecolour = spectra.rgb( *[rgb_converter(v) for v in my_scale(val).rgb] )
-
-			return thecolour.hexcode
-
-		except:
-			# Shouldn't crash all of MultiQC just for colours
-			return ''
+		return self.get_colour_list([val])[0]
+
+	def get_colour_list(self, vals):
+		"""
+		Given a list or array of values, return a list of colours within
+		the colour scale. Gives the same colours as building a spectra
+		scale and lightening each colour, but works on all values at once.
+		"""
+		domain, stops = self.compile_scale()
+		nums = np.zeros(len(vals), dtype=np.float64)
+		valid = np.ones(len(vals), dtype=bool)
+		for i, val in enumerate(vals):
+			try:
+				# Sanity checks
+				val = non_numeric_re.sub("", str(val))
+				nums[i] = self.minval if val == '' else float(val)
+			except:
+				# Shouldn't crash all of MultiQC just for colours
+				valid[i] = False
+		nums = np.minimum(np.maximum(nums, self.minval), self.maxval)
+
+		# Blend the two colours either side of each value
+		seg = np.clip(np.searchsorted(domain, nums, side='left') - 1, 0, len(domain) - 2)
+		x0 = domain[seg]
+		prop = (nums - x0) / (domain[seg + 1] - x0)
+		keep = 1.0 - prop
+		rgb = (stops[seg] * keep[:, None]) + (stops[seg + 1] * prop[:, None])
+
+		# Weird, I know. I ported this from the original JavaScript for continuity
+		# Seems to work better than adjusting brightness / saturation / luminosity
+		rgb = np.maximum(0, np.minimum(1, 1+((rgb-1)*0.3)))
+		rgb = np.floor(0.5 + rgb * 255).astype(int)
+		return ['#{}{}{}'.format(*[hex_codes[c] for c in rgb[i]]) if valid[i] else '' for i in range(len(vals))]
+
+	def compile_scale(self):
+		"""
+		Return the domain and RGB colour stops of this scale as NumPy arrays.
+		Computed once for each colour scheme, minimum and maximum.
+		"""
+		key = (tuple(self.colours), self.minval, self.maxval)
+		if key not in compiled_scales:
+			domain = np.linspace(self.minval, self.maxval, len(self.colours))
+			stops = np.array([spectra.html(c).rgb for c in self.colours], dtype=np.float64)
+			compiled_scales[key] = (domain, stops)
+		return compiled_scales[key]
 
 
 	def get_colours(self, name='GnBu'):
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+""" MultiQC flat plot runner. Draws MatPlotLib plots in a pool of forked
+worker processes (--plot-jobs), so that modules keep running while the
+images are rendered. Plot functions get a placeholder back instead of
+the plot HTML, which is swapped in when the report is written. """
+
+from __future__ import print_function
+import multiprocessing
+import pickle
+import re
+import traceback
+
+from multiqc.utils import config
+logger = config.logger
+
+# Placeholder returned for plots drawn in a worker
+placeholder = u'\0mqc_flat_plot:{}\0'
+placeholder_re = re.compile(u'\0mqc_flat_plot:(\\d+)\0')
+
+
+class PlotRunner(object):
+    """
+    Draws flat plots. With config.plot_jobs > 1, plots are sent to a pool
+    of forked workers that is started with the first plot. Plots are drawn
+    in the main process if they can't be sent to a worker, if the worker
+    failed, or if we are already running in a worker process.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.jobs = list()
+
+    def draw(self, func, *args):
+        """ Call func(*args), which draws a plot and returns its HTML.
+        Returns the HTML, or a placeholder if the plot is drawn in a worker. """
+        if config.plot_jobs <= 1 or multiprocessing.current_process().name != 'MainProcess':
+            return func(*args)
+        try:
+            job = pickle.dumps((func, args), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug("Could not send plot to a worker, drawing it now: {}".format(e))
+            return func(*args)
+        if self.pool is None:
+            try:
+                ctx = multiprocessing.get_context('fork')
+            except AttributeError:
+                ctx = multiprocessing # Python 2, always forks
+            except ValueError:
+                logger.warning("Can't fork worker processes on this system, drawing plots one at a time")
+                config.plot_jobs = 1
+                return func(*args)
+            logger.debug("Drawing flat plots with {} processes".format(config.plot_jobs))
+            self.pool = ctx.Pool(config.plot_jobs)
+        self.jobs.append([job, self.pool.apply_async(worker_draw, (job,)), None])
+        return placeholder.format(len(self.jobs) - 1)
+
+    def html(self, idx):
+        """ Return the HTML for a placeholder, waiting for the plot if needed """
+        job = self.jobs[idx]
+        if job[2] is None:
+            status, result = job[1].get()
+            if status != 'ok':
+                logger.debug("Plot could not be drawn in a worker, drawing it now: {}".format(result))
+                func, args = pickle.loads(job[0])
+                result = func(*args)
+            job[0] = job[1] = None
+            job[2] = result
+        return job[2]
+
+    def wait(self):
+        """ Wait for all queued plots to be drawn """
+        for idx in range(len(self.jobs)):
+            self.html(idx)
+
+    def substitute(self, html):
+        """ Replace any placeholders in a string with the plot HTML """
+        return placeholder_re.sub(lambda m: self.html(int(m.group(1))), html)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+runner = PlotRunner()
+
+
+def worker_draw(job):
+    """ Draw a plot in a worker process. Returns a status and
+    either the plot HTML or the reason that it failed. """
+    try:
+        func, args = pickle.loads(job)
+        return 'ok', func(*args)
+    except Exception:
+        return 'error', traceback.format_exc().splitlines()[-1]
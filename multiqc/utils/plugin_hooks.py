@@ -4,18 +4,24 @@
 to run their own custom subroutines at predefined
 trigger points during MultiQC execution. """
 
-import pkg_resources
+from multiqc.utils import config_cache
 
-# Load the hooks
-hook_functions = {}
-for entry_point in pkg_resources.iter_entry_points('multiqc.hooks.v1'):
-  nicename = str(entry_point).split('=')[0].strip()
-  try:
-    hook_functions[nicename].append(entry_point.load())
-  except KeyError:
-    hook_functions[nicename] = [entry_point.load()]
+# The hooks are loaded when the first one is triggered
+hook_functions = None
+
+def load_hooks ():
+  global hook_functions
+  hook_functions = {}
+  for entry_point in config_cache.iter_entry_points('multiqc.hooks.v1'):
+    nicename = str(entry_point).split('=')[0].strip()
+    try:
+      hook_functions[nicename].append(entry_point.load())
+    except KeyError:
+      hook_functions[nicename] = [entry_point.load()]
 
 # Function to run the hooks
 def mqc_trigger (trigger):
+  if hook_functions is None:
+    load_hooks()
   for hook in hook_functions.get(trigger, []):
     hook()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+""" MultiQC run profiling (--profile). Records the wall time, CPU time
+and peak memory of each phase of a run and the time taken to parse each
+log file, then writes them to the data directory. """
+
+from __future__ import print_function
+from collections import OrderedDict
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None # Windows
+
+from multiqc.utils import config
+logger = config.logger
+
+phases = list()
+file_times = list()
+
+
+def usage():
+    """ Return the CPU time used by this process and its finished child
+    processes, and the peak memory of this process in megabytes """
+    if resource is None:
+        try:
+            return time.process_time(), None
+        except AttributeError:
+            return time.clock(), None # Python 2
+    s = resource.getrusage(resource.RUSAGE_SELF)
+    c = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = s.ru_utime + s.ru_stime + c.ru_utime + c.ru_stime
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    peak_mem = s.ru_maxrss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+    return cpu, peak_mem
+
+
+@contextlib.contextmanager
+def phase(name):
+    """ Context manager to profile a phase of the run, if config.profile is set """
+    if not config.profile:
+        yield
+        return
+    start_wall = time.time()
+    start_cpu, _ = usage()
+    try:
+        yield
+    finally:
+        cpu, peak_mem = usage()
+        phases.append(OrderedDict([
+            ('phase', name),
+            ('wall_time', time.time() - start_wall),
+            ('cpu_time', cpu - start_cpu),
+            ('peak_memory_mb', peak_mem)
+        ]))
+
+
+def add_file(module, sp_key, f, start):
+    """ Record the time taken to read and parse a log file since start """
+    if config.profile:
+        file_times.append(OrderedDict([
+            ('module', module),
+            ('sp_key', sp_key),
+            ('path', os.path.join(f['root'], f['fn'])),
+            ('time', time.time() - start)
+        ]))
+
+
+def write_files(data_dir):
+    """ Write multiqc_profile.json, multiqc_profile.tsv (the phases)
+    and multiqc_profile_files.tsv (the parsed files) """
+    if data_dir is None or not os.path.isdir(data_dir):
+        logger.warning("No data directory, not saving the profile")
+        return
+    profile = OrderedDict([
+        ('multiqc_version', config.version),
+        ('multiqc_command', ' '.join(sys.argv)),
+        ('creation_date', config.creation_date),
+        ('phases', phases),
+        ('files', file_times)
+    ])
+    with io.open(os.path.join(data_dir, 'multiqc_profile.json'), 'w', encoding='utf-8') as f:
+        jsonstr = json.dumps(profile, indent=4, ensure_ascii=False)
+        print( jsonstr.encode('utf-8', 'ignore').decode('utf-8'), file=f)
+    with io.open(os.path.join(data_dir, 'multiqc_profile.tsv'), 'w', encoding='utf-8') as f:
+        print(u'Phase\tWall time (s)\tCPU time (s)\tPeak memory (MB)', file=f)
+        for p in phases:
+            mem = '' if p['peak_memory_mb'] is None else '{:.1f}'.format(p['peak_memory_mb'])
+            print(u'{}\t{:.3f}\t{:.3f}\t{}'.format(p['phase'], p['wall_time'], p['cpu_time'], mem), file=f)
+    with io.open(os.path.join(data_dir, 'multiqc_profile_files.tsv'), 'w', encoding='utf-8') as f:
+        print(u'Module\tSearch pattern\tPath\tTime (s)', file=f)
+        for t in file_times:
+            print(u'{}\t{}\t{}\t{:.4f}'.format(t['module'], t['sp_key'], t['path'], t['time']), file=f)
+    logger.info("Profile     : {}".format(os.path.relpath(os.path.join(data_dir, 'multiqc_profile.json'))))
+
+
+def report_section():
+    """ Make a report section showing the phases so far and the slowest files """
+    from multiqc.modules.base_module import BaseMultiqcModule
+    mod = BaseMultiqcModule(name='MultiQC Profile', anchor='multiqc_profile',
+        info='shows where this MultiQC run spent its time, up until the report was written. '
+             'The full profile is saved as <code>multiqc_profile.json</code> in the data directory.')
+    rows = list()
+    for p in phases:
+        mem = '' if p['peak_memory_mb'] is None else '{:.1f}'.format(p['peak_memory_mb'])
+        rows.append('<tr><td>{}</td><td class="text-right">{:.3f}</td><td class="text-right">{:.3f}</td><td class="text-right">{}</td></tr>'.format(
+            p['phase'], p['wall_time'], p['cpu_time'], mem))
+    mod.add_section(name='Phases', anchor='multiqc_profile_phases', content='''<table class="table table-condensed table-hover">
+        <thead><tr><th>Phase</th><th class="text-right">Wall time (s)</th><th class="text-right">CPU time (s)</th><th class="text-right">Peak memory (MB)</th></tr></thead>
+        <tbody>{}</tbody></table>'''.format(''.join(rows)))
+    rows = list()
+    for t in sorted(file_times, key=lambda t: t['time'], reverse=True)[:20]:
+        rows.append('<tr><td>{}</td><td>{}</td><td><code>{}</code></td><td class="text-right">{:.4f}</td></tr>'.format(
+            t['module'], t['sp_key'], t['path'], t['time']))
+    if len(rows) > 0:
+        mod.add_section(name='Slowest files', anchor='multiqc_profile_files',
+            description='The {} log files that took longest to read and parse, out of {}.'.format(len(rows), len(file_times)),
+            content='''<table class="table table-condensed table-hover">
+            <thead><tr><th>Module</th><th>Search pattern</th><th>Path</th><th class="text-right">Time (s)</th></tr></thead>
+            <tbody>{}</tbody></table>'''.format(''.join(rows)))
+    return mod
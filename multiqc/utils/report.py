@@ -5,6 +5,7 @@ module. Is available to subsequent modules. Contains
 helper functions to generate markup for report. """
 
 from __future__ import print_function
+import base64
 from collections import defaultdict, OrderedDict
 import click
 import fnmatch
@@ -13,11 +14,15 @@ import json
 import inspect
 import lzstring
 import mimetypes
+import multiprocessing
 import os
 import re
+import stat
 import yaml
+import zlib
 
 from multiqc import config
+from multiqc.utils import cache, util_functions
 logger = config.logger
 
 # Treat defaultdict and OrderedDict as normal dicts for YAML output
@@ -102,156 +107,413 @@ def get_filelist(run_module_names):
     if len(ignored_patterns) > 0:
         logger.debug("Ignored search patterns as didn't match running modules: {}".format(', '.join(ignored_patterns)))
 
-    def add_file(fn, root):
-        """
-        Function applied to each file found when walking the analysis
-        directories. Runs through all search patterns and returns True
-        if a match is found.
-        """
-        f = {'fn': fn, 'root': root}
-
-        # Check that this is a file and not a pipe or anything weird
-        if not os.path.isfile(os.path.join(root, fn)):
-            return None
+    # Load previous search results for unchanged files if requested
+    search_cache = None
+    cache_entries = dict()
+    # With --watch, the results are kept in memory between runs instead
+    if config.watch:
+        search_cache = cache.get_memory_search_cache()
+        cache_entries = search_cache.entries
+    elif config.search_cache:
+        search_cache = cache.SearchCache()
+        cache_entries = search_cache.entries
+
+    # Set up a pool of worker processes if requested
+    pool = None
+    if config.search_threads is not None and config.search_threads > 1:
+        logger.debug("Searching for files using {} worker processes".format(config.search_threads))
+        search_config = { k: getattr(config, k) for k in search_config_keys }
+        pool = multiprocessing.Pool(config.search_threads, search_worker_init, (spatterns, search_config, cache_entries))
+
+    try:
+        # Go through the analysis directories and get file list
+        for path in config.analysis_dir:
+            if os.path.islink(path) and config.ignore_symlinks:
+                continue
+            elif os.path.isfile(path):
+                searchfiles.append([os.path.basename(path), os.path.dirname(path)])
+            elif os.path.isdir(path):
+                if pool is None:
+                    searchfiles.extend(walk_dir(path))
+                else:
+                    # Walk the top level here, then each sub-directory in a worker.
+                    # Results are joined in the same order that os.walk would give.
+                    subdirs = list()
+                    for root, dirnames, filenames in os.walk(path, followlinks=(not config.ignore_symlinks), topdown=True):
+                        searchfiles.extend(search_dir_filenames(root, dirnames, filenames))
+                        for d in dirnames:
+                            if config.ignore_symlinks and os.path.islink(os.path.join(root, d)):
+                                continue
+                            subdirs.append(os.path.join(root, d))
+                        break
+                    for sfiles in pool.imap(walk_dir, subdirs):
+                        searchfiles.extend(sfiles)
+
+        # Only search this shard's part of the files with --shard
+        if config.shard is not None:
+            from multiqc.utils import shard
+            searchfiles[:] = shard.select_files(searchfiles)
+
+        # Search through collected files
+        with click.progressbar(length=len(searchfiles), label="Searching {} files..".format(len(searchfiles))) as pbar:
+            if pool is None:
+                matches = (cached_match_file(sf[0], sf[1], spatterns, cache_entries) for sf in searchfiles)
+            else:
+                chunksize = max(1, min(1000, len(searchfiles) // (config.search_threads * 4)))
+                matches = pool.imap(search_worker, searchfiles, chunksize)
+            # Results come back in order, so the file lists are the same whichever way we searched
+            for f, keys, mtime, results in matches:
+                for key in keys:
+                    files[key].append(f)
+                if search_cache is not None:
+                    search_cache.add(f, mtime, results)
+                pbar.update(1)
+        if search_cache is not None:
+            search_cache.save()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if search_cache is not None:
+            search_cache.close()
+
+def walk_dir(path):
+    """
+    Walk a directory, skipping anything matching the ignore config,
+    and return a list of [filename, root] for every file found.
+    """
+    sfiles = list()
+    for root, dirnames, filenames in os.walk(path, followlinks=(not config.ignore_symlinks), topdown=True):
+        sfiles.extend(search_dir_filenames(root, dirnames, filenames))
+    return sfiles
 
-        # Check that we don't want to ignore this file
-        i_matches = [n for n in config.fn_ignore_files if fnmatch.fnmatch(fn, n)]
-        if len(i_matches) > 0:
-            logger.debug("Ignoring file as matched an ignore pattern: {}".format(fn))
-            return None
+def search_dir_filenames(root, dirnames, filenames):
+    """
+    Apply the directory ignore config to one step of os.walk().
+    Removes ignored sub-directories from dirnames (in place) and returns
+    a list of [filename, root] for the files that should be searched.
+    """
+    bname = os.path.basename(root)
+
+    # Skip any sub-directories matching ignore params
+    orig_dirnames = dirnames[:]
+    for n in config.fn_ignore_dirs:
+        dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(d, n.rstrip(os.sep))]
+        if len(orig_dirnames) != len(dirnames):
+            removed_dirs = [os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))]
+            logger.debug("Ignoring directory as matched fn_ignore_dirs: {}".format(", ".join(removed_dirs)))
+            orig_dirnames = dirnames[:]
+    for n in config.fn_ignore_paths:
+        dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(os.path.join(root, d), n.rstrip(os.sep))]
+        if len(orig_dirnames) != len(dirnames):
+            removed_dirs = [os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))]
+            logger.debug("Ignoring directory as matched fn_ignore_paths: {}".format(", ".join(removed_dirs)))
+
+    # Skip *this* directory if matches ignore params
+    d_matches = [n for n in config.fn_ignore_dirs if fnmatch.fnmatch(bname, n.rstrip(os.sep))]
+    if len(d_matches) > 0:
+        logger.debug("Ignoring directory as matched fn_ignore_dirs: {}".format(bname))
+        return []
+    p_matches = [n for n in config.fn_ignore_paths if fnmatch.fnmatch(root, n.rstrip(os.sep))]
+    if len(p_matches) > 0:
+        logger.debug("Ignoring directory as matched fn_ignore_paths: {}".format(root))
+        return []
+
+    # Search filenames in this directory
+    return [[fn, root] for fn in filenames]
+
+def match_file(fn, root, spatterns, results=None):
+    """
+    Function applied to each file found when walking the analysis
+    directories. Runs through all search patterns and returns a tuple
+    of the file dict and a list of the search pattern keys it matched.
+    :param results: Optional dict of the result for each search pattern key,
+                    for the search cache. Keys already in it aren't checked
+                    again, and the result of each key checked is added.
+    """
+    f = {'fn': fn, 'root': root}
+    keys = list()
+
+    # Check that this is a file and not a pipe or anything weird
+    if not os.path.isfile(os.path.join(root, fn)):
+        return f, keys
+
+    # Check that we don't want to ignore this file
+    i_matches = [n for n in config.fn_ignore_files if fnmatch.fnmatch(fn, n)]
+    if len(i_matches) > 0:
+        logger.debug("Ignoring file as matched an ignore pattern: {}".format(fn))
+        return f, keys
+
+    # Limit search to small files, to avoid 30GB FastQ files etc.
+    try:
+        f['filesize'] = os.path.getsize(os.path.join(root,fn))
+    except (IOError, OSError, ValueError, UnicodeDecodeError):
+        logger.debug("Couldn't read file when checking filesize: {}".format(fn))
+    else:
+        if f['filesize'] > config.log_filesize_limit:
+            return f, keys
 
-        # Limit search to small files, to avoid 30GB FastQ files etc.
-        try:
-            f['filesize'] = os.path.getsize(os.path.join(root,fn))
-        except (IOError, OSError, ValueError, UnicodeDecodeError):
-            logger.debug("Couldn't read file when checking filesize: {}".format(fn))
-        else:
-            if f['filesize'] > config.log_filesize_limit:
-                return False
-
-        # Test file for each search pattern
-        for patterns in spatterns:
-            for key, sps in patterns.items():
-                for sp in sps:
-                    if search_file (sp, f):
+    # Use mimetypes to exclude binary files where possible
+    if not search_file_type(f):
+        return f, keys
+
+    # Check the file name and size parts of each search pattern first.
+    # The file is then read at most once, a chunk at a time, with each chunk
+    # tested against every content pattern that could still match.
+    if results is None:
+        results = dict()
+    tests = list()
+    for patterns in spatterns:
+        for key, sps in patterns.items():
+            tests.append((key, sps, None if key in results else [search_file_name(sp, f) for sp in sps]))
+    contents = SearchFileContents(f, [sp for key, sps, names in tests if names is not None
+                                      for sp, fn_matched in zip(sps, names)
+                                      if fn_matched is not None and has_contents_pattern(sp)])
+    try:
+        for key, sps, names in tests:
+            # The result for a key is the index of the first pattern that
+            # matched and whether the file was excluded, or None
+            if names is not None:
+                results[key] = None
+                for i, (sp, fn_matched) in enumerate(zip(sps, names)):
+                    if fn_matched is None:
+                        continue
+                    if contents.matched(sp) if has_contents_pattern(sp) else fn_matched:
                         # Check that we shouldn't exclude this file
-                        if not exclude_file(sp, f):
-                            # Looks good! Remember this file
-                            files[key].append(f)
-                        # Don't keep searching this file for other modules
-                        if not sp.get('shared', False):
-                            return
+                        results[key] = [i, exclude_file(sp, f)]
                         # Don't look at other patterns for this module
-                        else:
-                            break
-
-    # Go through the analysis directories and get file list
-    for path in config.analysis_dir:
-        if os.path.islink(path) and config.ignore_symlinks:
-            continue
-        elif os.path.isfile(path):
-            searchfiles.append([os.path.basename(path), os.path.dirname(path)])
-        elif os.path.isdir(path):
-            for root, dirnames, filenames in os.walk(path, followlinks=(not config.ignore_symlinks), topdown=True):
-                bname = os.path.basename(root)
-
-                # Skip any sub-directories matching ignore params
-                orig_dirnames = dirnames[:]
-                for n in config.fn_ignore_dirs:
-                    dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(d, n.rstrip(os.sep))]
-                    if len(orig_dirnames) != len(dirnames):
-                        removed_dirs = [os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))]
-                        logger.debug("Ignoring directory as matched fn_ignore_dirs: {}".format(", ".join(removed_dirs)))
-                        orig_dirnames = dirnames[:]
-                for n in config.fn_ignore_paths:
-                    dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(os.path.join(root, d), n.rstrip(os.sep))]
-                    if len(orig_dirnames) != len(dirnames):
-                        removed_dirs = [os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))]
-                        logger.debug("Ignoring directory as matched fn_ignore_paths: {}".format(", ".join(removed_dirs)))
-
-                # Skip *this* directory if matches ignore params
-                d_matches = [n for n in config.fn_ignore_dirs if fnmatch.fnmatch(bname, n.rstrip(os.sep))]
-                if len(d_matches) > 0:
-                    logger.debug("Ignoring directory as matched fn_ignore_dirs: {}".format(bname))
-                    continue
-                p_matches = [n for n in config.fn_ignore_paths if fnmatch.fnmatch(root, n.rstrip(os.sep))]
-                if len(p_matches) > 0:
-                    logger.debug("Ignoring directory as matched fn_ignore_paths: {}".format(root))
-                    continue
-                # Search filenames in this directory
-                for fn in filenames:
-                    searchfiles.append([fn, root])
-    # Search through collected files
-    with click.progressbar(searchfiles, label="Searching {} files..".format(len(searchfiles))) as sfiles:
-        for sf in sfiles:
-            add_file(sf[0], sf[1])
-
-def search_file (pattern, f):
+                        break
+            if results[key] is not None:
+                i, excluded = results[key]
+                if not excluded:
+                    # Looks good! Remember this file
+                    keys.append(key)
+                # Don't keep searching this file for other modules
+                if not sps[i].get('shared', False):
+                    return f, keys
+    finally:
+        contents.close()
+    return f, keys
+
+def cached_keys(spatterns, results):
     """
-    Function to searach a single file for a single search pattern.
+    The search pattern keys that a file matches, worked out from the cached
+    result for each key. Returns None if a key that's needed wasn't checked
+    when the file was searched before, eg. as its module wasn't running.
+    """
+    keys = list()
+    for patterns in spatterns:
+        for key, sps in patterns.items():
+            if key not in results:
+                return None
+            if results[key] is not None:
+                i, excluded = results[key]
+                if not excluded:
+                    keys.append(key)
+                if not sps[i].get('shared', False):
+                    return keys
+    return keys
+
+def cached_match_file(fn, root, spatterns, cache_entries):
+    """
+    Wrapper around match_file() that skips searching files which have
+    the same size and modification time as in the search cache.
+    Returns a tuple of the file dict, matched keys, file mtime and
+    the result for each search pattern key, for the cache.
+    """
+    try:
+        st = os.stat(os.path.join(root, fn))
+    except (IOError, OSError):
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        f, keys = match_file(fn, root, spatterns)
+        return f, keys, None, None
+    results = dict()
+    cached = cache_entries.get((root, fn))
+    if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime:
+        keys = cached_keys(spatterns, cached[2])
+        if keys is not None:
+            return {'fn': fn, 'root': root, 'filesize': st.st_size}, keys, st.st_mtime, cached[2]
+        # Only check the keys that weren't checked before
+        results = dict(cached[2])
+    f, keys = match_file(fn, root, spatterns, results)
+    return f, keys, st.st_mtime, results
+
+# Config needed by the file search worker processes. Passed explicitly
+# so that user config is respected even if workers are not forked.
+search_config_keys = [
+    'fn_ignore_dirs',
+    'fn_ignore_files',
+    'fn_ignore_paths',
+    'ignore_symlinks',
+    'log_filesize_limit',
+    'report_readerrors'
+]
+search_worker_spatterns = None
+search_worker_cache = None
+def search_worker_init(spatterns, search_config, cache_entries):
+    """ Set up a file search worker process """
+    global search_worker_spatterns, search_worker_cache
+    search_worker_spatterns = spatterns
+    search_worker_cache = cache_entries
+    for k, v in search_config.items():
+        setattr(config, k, v)
+
+def search_worker(sf):
+    """ Search a single [filename, root] in a worker process """
+    return cached_match_file(sf[0], sf[1], search_worker_spatterns, search_worker_cache)
+
+class SearchFileContents(object):
+    """
+    Read a file being searched a chunk of lines at a time, testing each chunk
+    against all of the content search patterns given for the file. The file is
+    read at most once and lines are not kept once they have been tested.
+    Reading stops as soon as the pattern being asked about is settled, either
+    matched or searched as far as its num_lines, and the file is closed once
+    every pattern is settled.
     """
 
-    fn_matched = False
-    contents_matched = False
+    chunk_lines = 100
+
+    def __init__(self, f, patterns):
+        self.path = os.path.join(f['root'], f['fn'])
+        self.fn = f['fn']
+        self.fh = None
+        self.num_lines = 0
+        self.results = dict()
+        self.pending = OrderedDict()
+        for pattern in patterns:
+            if id(pattern) in self.results or id(pattern) in self.pending:
+                continue
+            string = pattern.get('contents')
+            if string is not None and '\n' in string[:-1]:
+                # Can never be found within a single line
+                self.results[id(pattern)] = False
+                continue
+            self.pending[id(pattern)] = {
+                'contents': string,
+                'contents_re': re.compile(pattern['contents_re']) if string is None else None,
+                'num_lines': pattern.get('num_lines') or None
+            }
+        if len(self.pending) == 0:
+            self.close()
+
+    def matched(self, pattern):
+        """ Whether the file contents match a pattern given when this was made """
+        while id(pattern) not in self.results:
+            num_lines = self.pending[id(pattern)]['num_lines']
+            if num_lines is None:
+                self.read_chunk(self.chunk_lines)
+            else:
+                self.read_chunk(min(self.chunk_lines, num_lines - self.num_lines))
+        return self.results[id(pattern)]
 
-    # Use mimetypes to exclude binary files where possible
+    def read_chunk(self, max_lines):
+        """ Read up to max_lines more lines and test them against the unsettled patterns """
+        lines = list()
+        eof = False
+        try:
+            if self.fh is None:
+                self.fh = io.open(self.path, "r", encoding='utf-8')
+            while len(lines) < max_lines:
+                line = next(self.fh, None)
+                if line is None:
+                    eof = True
+                    break
+                lines.append(line)
+        except (IOError, OSError, ValueError, UnicodeDecodeError):
+            # Lines read before the error are still searched
+            eof = True
+            if config.report_readerrors:
+                logger.debug("Couldn't read file when looking for output: {}".format(self.fn))
+        start = self.num_lines
+        self.num_lines += len(lines)
+        text = None
+        pending = OrderedDict()
+        for pid, p in self.pending.items():
+            n = len(lines)
+            if p['num_lines'] is not None:
+                n = max(0, min(n, p['num_lines'] - start))
+            if p['contents'] is not None:
+                if n == len(lines):
+                    if text is None:
+                        text = ''.join(lines)
+                    found = p['contents'] in text
+                else:
+                    found = p['contents'] in ''.join(lines[:n])
+            else:
+                found = any(p['contents_re'].search(l) for l in lines[:n])
+            if found or eof or (p['num_lines'] is not None and self.num_lines >= p['num_lines']):
+                self.results[pid] = found
+            else:
+                pending[pid] = p
+        self.pending = pending
+        if eof or len(self.pending) == 0:
+            self.close()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+def has_contents_pattern(pattern):
+    return pattern.get('contents') is not None or pattern.get('contents_re') is not None
+
+def search_file_type(f):
+    """ Use mimetypes to exclude binary files where possible """
     (ftype, encoding) = mimetypes.guess_type(os.path.join(f['root'], f['fn']))
     if encoding is not None:
         return False
     if ftype is not None and ftype.startswith('image'):
         return False
+    return True
 
+def search_file_name(pattern, f):
+    """
+    Check the file name and size parts of a search pattern.
+    Returns None if the file can't match the pattern, otherwise
+    whether the file name matched.
+    """
     # Search pattern specific filesize limit
     if pattern.get('max_filesize') is not None and 'filesize' in f:
         if f['filesize'] > pattern.get('max_filesize'):
-            return False
+            return None
+
+    fn_matched = False
 
     # Search by file name (glob)
     if pattern.get('fn') is not None:
         if fnmatch.fnmatch(f['fn'], pattern['fn']):
             fn_matched = True
-            if pattern.get('contents') is None and pattern.get('contents_re') is None:
-                return True
 
     # Search by file name (regex)
     if pattern.get('fn_re') is not None:
         if re.match( pattern['fn_re'], f['fn']):
             fn_matched = True
-            if pattern.get('contents') is None and pattern.get('contents_re') is None:
-                return True
 
-    # Search by file contents
-    if pattern.get('contents') is not None or pattern.get('contents_re') is not None:
-        if pattern.get('contents_re') is not None:
-            repattern = re.compile(pattern['contents_re'])
-        try:
-            with io.open (os.path.join(f['root'],f['fn']), "r", encoding='utf-8') as f:
-                l = 1
-                for line in f:
-                    # Search by file contents (string)
-                    if pattern.get('contents') is not None:
-                        if pattern['contents'] in line:
-                            contents_matched = True
-                            if pattern.get('fn') is None and pattern.get('fn_re') is None:
-                                return True
-                            break
-                    # Search by file contents (regex)
-                    elif pattern.get('contents_re') is not None:
-                        if re.search(repattern, line):
-                            contents_matched = True
-                            if pattern.get('fn') is None and pattern.get('fn_re') is None:
-                                return True
-                            break
-                    # Break if we've searched enough lines for this pattern
-                    if pattern.get('num_lines') and l >= pattern.get('num_lines'):
-                        break
-                    l += 1
-        except (IOError, OSError, ValueError, UnicodeDecodeError):
-            if config.report_readerrors:
-                logger.debug("Couldn't read file when looking for output: {}".format(f['fn']))
-                return False
+    # No point reading the file if a filename was needed and didn't match
+    if not fn_matched and (pattern.get('fn') is not None or pattern.get('fn_re') is not None):
+        return None
+    return fn_matched
+
+def search_file (pattern, f):
+    """
+    Function to searach a single file for a single search pattern.
+    """
+    if not search_file_type(f):
+        return False
+    fn_matched = search_file_name(pattern, f)
+    if fn_matched is None:
+        return False
+    if not has_contents_pattern(pattern):
+        return fn_matched
 
-    return fn_matched and contents_matched
+    # Search by file contents
+    contents = SearchFileContents(f, [pattern])
+    try:
+        return contents.matched(pattern)
+    finally:
+        contents.close()
 
 def exclude_file(sp, f):
     """
@@ -295,6 +557,15 @@ def exclude_file(sp, f):
 
 def data_sources_tofile ():
     fn = 'multiqc_sources.{}'.format(config.data_format_extensions[config.data_format])
+    if config.data_format in util_functions.columnar_formats:
+        columns = OrderedDict([('Module', []), ('Section', []), ('Sample Name', []), ('Source', [])])
+        for mod in data_sources:
+            for sec in data_sources[mod]:
+                for s_name, source in data_sources[mod][sec].items():
+                    for c, v in zip(columns.values(), [mod, sec, s_name, source]):
+                        c.append(v)
+        util_functions.write_columns(columns, os.path.join(config.data_dir, fn), config.data_format)
+        return
     with io.open (os.path.join(config.data_dir, fn), 'w', encoding='utf-8') as f:
         if config.data_format == 'json':
             jsonstr = json.dumps(data_sources, indent=4, ensure_ascii=False)
@@ -361,10 +632,24 @@ def save_htmlid(html_id, skiplint=False):
     return html_id_clean
 
 
+plot_data_codecs = ['lzstring', 'zlib']
+
 def compress_json(data):
-    """ Take a Python data object. Convert to JSON and compress using lzstring """
+    """ Take a Python data object. Convert to JSON and compress using
+    config.plot_data_codec - either lzstring (the default) or zlib.
+    Both are returned as a base64 string, decompressed by the report JavaScript. """
     json_string = json.dumps(data).encode('utf-8', 'ignore').decode('utf-8')
     # JSON.parse() doesn't handle `NaN`, but it does handle `null`.
     json_string = json_string.replace('NaN', 'null');
+    if config.plot_data_codec not in plot_data_codecs:
+        logger.warning("Unknown plot_data_codec '{}', using lzstring".format(config.plot_data_codec))
+        config.plot_data_codec = 'lzstring'
+    if config.plot_data_codec == 'zlib':
+        return base64.b64encode(zlib.compress(json_string.encode('utf-8'))).decode('ascii')
     x = lzstring.LZString()
     return x.compressToBase64(json_string)
+
+def compress_plot_data(data):
+    """ Compress the data for each plot separately with compress_json,
+    so that the report only has to decompress the plots that are shown """
+    return OrderedDict((pid, compress_json(pdata)) for pid, pdata in data.items())
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+""" MultiQC code for building a report in two stages, so that the work
+can be split across many machines. `multiqc --shard i/N` searches and
+parses one part of the files and saves the parsed data to a state file.
+`multiqc --reduce` loads the state files of all N shards and makes the
+report. Modules that set state_attrs save their parsed data in the shards.
+The files found are saved too, and the other modules parse them when the
+shards are reduced. """
+
+from __future__ import print_function
+from collections import OrderedDict
+import gzip
+import os
+import pickle
+import re
+import zlib
+
+from multiqc.utils import config, report
+logger = config.logger
+
+# Parsed data of each module in this shard, by module anchor
+module_states = OrderedDict()
+
+# With --shard, the position of each file in this shard in the full list of
+# files searched. Used by --reduce to put the files back in the same order.
+search_order = dict()
+
+# With --reduce, the parsed data and data sources of each shard
+shard_states = list()
+source_ranks = None
+
+state_fn_re = re.compile(r'^multiqc_shard_(\d+)_of_(\d+)\.pkl\.gz$')
+
+
+class ShardSaved(UserWarning):
+    """ Raised to stop a module once its parsed data has been saved """
+    pass
+
+
+def parse_shard(value):
+    """ Turn 'i/N' into a tuple (i, N) """
+    m = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', value)
+    if m is None or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise ValueError("--shard should be 'i/N', with i between 1 and N: '{}'".format(value))
+    return int(m.group(1)), int(m.group(2))
+
+
+def select_files(searchfiles):
+    """ The files to search in this shard. Files are split up by a checksum
+    of their path, so each file always goes to the same shard. """
+    i, n = config.shard
+    selected = list()
+    for idx, sf in enumerate(searchfiles):
+        if zlib.crc32(os.path.join(sf[1], sf[0]).encode('utf-8', 'replace')) % n == i - 1:
+            search_order[(sf[1], sf[0])] = idx
+            selected.append(sf)
+    return selected
+
+
+def has_state(this_module):
+    """ Whether a module saves its parsed data, so can be parsed in the shards """
+    mod = config.avail_modules[this_module].load()
+    return len(getattr(mod, 'state_attrs', [])) > 0 and hasattr(mod, 'parse_log_files')
+
+
+def save_module_state(mod):
+    module_states[mod.anchor] = dict((attr, getattr(mod, attr)) for attr in mod.state_attrs if hasattr(mod, attr))
+
+
+def load_module_state(mod):
+    """ Combine the parsed data and data sources of a module from each shard.
+    Dicts are combined key by key, usually one key per sample. Samples are put
+    in the order that their files would be found in a single run, and where
+    more than one shard has the same sample, the first one found is kept.
+    Other values are taken from the first shard that found any files. """
+    parts = list()
+    for state in shard_states:
+        if mod.anchor in state['module_states']:
+            parts.append((state['module_states'][mod.anchor], state['data_sources'].get(mod.name, {})))
+    for attr in mod.state_attrs:
+        values = [(attrs[attr], sources) for attrs, sources in parts if attr in attrs]
+        if len(values) == 0:
+            continue
+        if all(isinstance(v, dict) for v, sources in values):
+            setattr(mod, attr, merge_samples(values))
+        else:
+            found = [v for v, sources in values if any(len(s) > 0 for s in sources.values())]
+            setattr(mod, attr, (found or [values[0][0]])[0])
+    secs = OrderedDict()
+    for attrs, sources in parts:
+        for sec, s_sources in sources.items():
+            secs.setdefault(sec, list()).append((s_sources, {sec: s_sources}))
+    for sec, values in secs.items():
+        report.data_sources[mod.name][sec].update(merge_samples(values))
+
+
+def merge_samples(values):
+    """ Combine dicts from each shard, given as (dict, data sources) pairs """
+    best = dict()
+    for i, (d, sources) in enumerate(values):
+        for j, (k, v) in enumerate(d.items()):
+            rank = sample_rank(sources, k) + (i, j)
+            if k not in best or rank < best[k][0]:
+                best[k] = (rank, v)
+    merged = OrderedDict() if isinstance(values[0][0], OrderedDict) else dict()
+    for k in sorted(best, key=lambda k: best[k][0]):
+        merged[k] = best[k][1]
+    return merged
+
+
+def sample_rank(sources, s_name):
+    """ Where the data source for a sample comes in a single run: by
+    search pattern and then by the order that the files were found """
+    global source_ranks
+    if source_ranks is None:
+        source_ranks = dict()
+        for key_idx, key in enumerate(config.sp):
+            for file_idx, f in enumerate(report.files.get(key, [])):
+                source_ranks.setdefault(os.path.abspath(os.path.join(f['root'], f['fn'])), (key_idx, file_idx))
+    unknown = (len(config.sp), 0)
+    ranks = [source_ranks.get(s[s_name], unknown) for s in sources.values() if s_name in s]
+    return min(ranks) if len(ranks) > 0 else unknown
+
+
+def state_fn():
+    return 'multiqc_shard_{}_of_{}.pkl.gz'.format(*config.shard)
+
+
+def write_state(run_module_names, output_dir):
+    """ Save the parsed data of this shard and the files found, which are
+    parsed when reducing by the modules that can't save their parsed data """
+    files = OrderedDict()
+    order = dict()
+    for key, fs in report.files.items():
+        files[key] = [dict((k, f[k]) for k in ['fn', 'root', 'filesize'] if k in f) for f in fs]
+        for f in fs:
+            order[(f['root'], f['fn'])] = search_order.get((f['root'], f['fn']), len(search_order))
+    data_sources = OrderedDict()
+    for mod in report.data_sources:
+        for sec in report.data_sources[mod]:
+            data_sources.setdefault(mod, OrderedDict())[sec] = dict(report.data_sources[mod][sec])
+    state = {
+        'version': config.version,
+        'shard': config.shard,
+        'analysis_dir': list(config.analysis_dir),
+        'files': files,
+        'search_order': order,
+        'data_sources': data_sources,
+        'module_states': module_states
+    }
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    fn = os.path.join(output_dir, state_fn())
+    with gzip.open(fn, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    logger.info("Shard {} of {}: parsed data for {} modules, {} files found".format(
+        config.shard[0], config.shard[1], len(module_states), len(order)))
+    logger.info("Shard state : {}".format(os.path.relpath(fn)))
+
+
+def find_states(paths):
+    """ Shard state files in paths, which can be the files or directories containing them """
+    found = list()
+    for p in paths:
+        if os.path.isdir(p):
+            found.extend(os.path.join(p, fn) for fn in sorted(os.listdir(p)) if state_fn_re.match(fn))
+        else:
+            found.append(p)
+    return found
+
+
+def load_states(paths):
+    """ Combine the state files of all shards: the parsed module data and
+    data sources are kept for the modules, and the found files are added to
+    the report in the order of a single run. Returns False if no state files
+    were found. """
+    fns = find_states(paths)
+    if len(fns) == 0:
+        logger.error("No shard state files found to reduce")
+        return False
+    analysis_dir = list()
+    shards = set()
+    num_shards = set()
+    seen_files = set()
+    file_order = dict()
+    for fn in fns:
+        logger.info("Reducing '{}'".format(fn))
+        with gzip.open(fn, 'rb') as f:
+            state = pickle.load(f)
+        if state['version'] != config.version:
+            logger.warning("'{}' was made by MultiQC v{}, not v{}".format(fn, state['version'], config.version))
+        if state['shard'] in shards:
+            logger.warning("Shard {} of {} was found more than once".format(*state['shard']))
+        shards.add(state['shard'])
+        num_shards.add(state['shard'][1])
+        analysis_dir.extend(d for d in state['analysis_dir'] if d not in analysis_dir)
+        file_order.update(state['search_order'])
+        for key, fs in state['files'].items():
+            report.files.setdefault(key, list())
+            for f in fs:
+                if (key, f['root'], f['fn']) not in seen_files:
+                    seen_files.add((key, f['root'], f['fn']))
+                    report.files[key].append(f)
+        shard_states.append({'module_states': state['module_states'], 'data_sources': state['data_sources']})
+        del state
+
+    # Check that we have every shard
+    if len(num_shards) > 1:
+        logger.warning("The shard states were made with different numbers of shards: {}".format(', '.join(str(n) for n in sorted(num_shards))))
+    missing = [i for i in range(1, max(num_shards) + 1) if not any(s[0] == i for s in shards)]
+    if len(missing) > 0:
+        logger.warning("Missing shards: {} of {}. Their data won't be in the report.".format(', '.join(str(i) for i in missing), max(num_shards)))
+
+    # Put the files in the order that a single run would find them
+    for key, fs in report.files.items():
+        fs.sort(key=lambda f: file_order.get((f['root'], f['fn']), len(file_order)))
+
+    # Modules look up their search keys even if no files were found
+    for key in config.sp:
+        report.files.setdefault(key, list())
+    config.analysis_dir = analysis_dir
+    return True
@@ -3,6 +3,7 @@
 """ MultiQC Utility functions, used in a variety of places. """
 
 from __future__ import print_function
+from collections import OrderedDict
 import io
 import json
 import os
@@ -13,6 +14,9 @@ import sys
 
 from multiqc import config
 
+# Data formats that are written column by column with pyarrow
+columnar_formats = ['parquet', 'arrow']
+
 def robust_rmtree(path, logger=None, max_retries=10):
     """Robustly tries to delete paths.
     Retries several times (with increasing delays) if an OSError
@@ -54,6 +58,17 @@ def write_data_file(data, fn, sort_cols=False, data_format=None):
             data_format = config.data_format
         fn = '{}.{}'.format(fn, config.data_format_extensions[data_format])
 
+        # Columnar binary formats, written with pyarrow
+        if data_format in columnar_formats:
+            h = data_columns(data, sort_cols)
+            samples = sorted(data.keys())
+            rows = [data[sn] for sn in samples]
+            columns = OrderedDict([('Sample', [str(sn) for sn in samples])])
+            for k in h[1:]:
+                columns[str(k)] = [r.get(k) for r in rows]
+            write_columns(columns, os.path.join(config.data_dir, fn), data_format)
+            return
+
         # JSON encoder class to handle lambda functions
         class MQCJSONEncoder(json.JSONEncoder):
             def default(self, obj):
@@ -75,23 +90,57 @@ def write_data_file(data, fn, sort_cols=False, data_format=None):
                 # Default - tab separated output
                 # Get all headers
                 h = ['Sample']
+                h_set = set(h)
                 for sn in sorted(data.keys()):
                     for k in data[sn].keys():
-                        if type(data[sn][k]) is not dict and k not in h:
+                        if type(data[sn][k]) is not dict and str(k) not in h_set:
                             h.append(str(k))
+                            h_set.add(str(k))
                 if sort_cols:
                     h = sorted(h)
 
-                # Get the rows
-                rows = [ "\t".join(h) ]
+                # Write the rows one at a time
+                print( "\t".join(h).encode('utf-8', 'ignore').decode('utf-8'), file=f)
                 for sn in sorted(data.keys()):
                     # Make a list starting with the sample name, then each field in order of the header cols
                     l = [str(sn)] + [ str(data[sn].get(k, '')) for k in h[1:] ]
-                    rows.append( "\t".join(l) )
-
-                body = '\n'.join(rows)
-
-                print( body.encode('utf-8', 'ignore').decode('utf-8'), file=f)
+                    print( "\t".join(l).encode('utf-8', 'ignore').decode('utf-8'), file=f)
+
+def data_columns(data, sort_cols=False):
+    """ Column keys for a columnar data file: 'Sample', then every field
+    that isn't a dict, in the order they are first found """
+    h = ['Sample']
+    seen = set(h)
+    for sn in sorted(data.keys()):
+        for k, v in data[sn].items():
+            if k not in seen and type(v) is not dict:
+                if str(k) not in seen:
+                    h.append(k)
+                seen.update([k, str(k)])
+    if sort_cols:
+        h = ['Sample'] + sorted(h[1:], key=str)
+    return h
+
+def write_columns(columns, path, data_format):
+    """ Write an OrderedDict of column name: list of values as a Parquet
+    or Arrow IPC file. Arrow IPC files are not compressed, so they can be
+    memory-mapped and read without copying. Columns with values that
+    pyarrow can't give a single type are saved as strings. """
+    import pyarrow as pa # Optional, only needed for these formats
+    arrays = list()
+    for name, values in columns.items():
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowException, TypeError, ValueError, OverflowError):
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    table = pa.Table.from_arrays(arrays, names=list(columns.keys()))
+    if data_format == 'parquet':
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
 
 def view_all_tags(ctx, param, value):
     """ List available tags and associated modules
@@ -114,3 +163,30 @@ def view_all_tags(ctx, param, value):
         for ttgs in avail_tags[t]:
             print ("   - {}".format(ttgs))
     ctx.exit()
+
+pyplot = None
+pyplot_error = None
+def get_pyplot():
+    """ Import and return matplotlib.pyplot. This is done the first time a
+    flat plot is made instead of at startup, as MatPlotLib is slow to load.
+    Raises the import error if it can't be loaded, so that plots can fall
+    back to being interactive. """
+    global pyplot, pyplot_error
+    if pyplot is None:
+        if pyplot_error is not None:
+            raise pyplot_error
+        try:
+            # Import matplot lib but avoid default X environment
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot
+            pyplot = matplotlib.pyplot
+        except Exception as e:
+            # MatPlotLib can break in a variety of ways. Print an error message
+            # once and fall back to interactive plots each time if so.
+            print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
+            print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
+            print(e)
+            pyplot_error = e
+            raise
+    return pyplot
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+""" MultiQC watch mode (--watch). Makes the report, then keeps checking
+the analysis directories and makes it again whenever files are added,
+changed or removed. The search results and the output of each module are
+kept in memory between runs, so only new and changed files are searched
+and only the modules whose files have changed are run again. """
+
+from __future__ import print_function
+from collections import OrderedDict
+import click
+import contextlib
+import copy
+import fnmatch
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from multiqc.utils import cache, config, log, profiling, report, shard, util_functions
+logger = config.logger
+
+# Whether we are in the watch loop, and the number of runs so far
+running = False
+num_runs = 0
+
+# Kept output of each module, by module_key(). Data files written by
+# each module are kept in their own directory under files_tmp_dir.
+module_results = dict()
+files_tmp_dir = None
+
+# Report variables that are set up again for each run
+report_attrs = [
+    'general_stats_data',
+    'general_stats_headers',
+    'general_stats_html',
+    'data_sources',
+    'plot_data',
+    'html_ids',
+    'lint_errors',
+    'num_hc_plots',
+    'num_mpl_plots',
+    'saved_raw_data',
+    'last_found_file',
+    'searchfiles',
+    'files',
+    'modules_output',
+    'plot_compressed_json',
+    'multiqc_command'
+]
+
+
+def run(command, args):
+    """ Run the MultiQC command with args, then run it again each
+    time the analysis files change. Stops with Ctrl-C. """
+    global running, num_runs, files_tmp_dir
+    running = True
+    files_tmp_dir = tempfile.mkdtemp()
+    state = save_state()
+    try:
+        while True:
+            try:
+                command.main(args=args, standalone_mode=False)
+            except SystemExit:
+                pass # Carry on watching whatever the exit code
+            num_runs += 1
+            # The log file has been moved into the data directory
+            for h in list(logger.handlers):
+                if isinstance(h, logging.FileHandler):
+                    logger.removeHandler(h)
+            logger.info("Watching for changes every {} seconds. Press Ctrl-C to stop.".format(config.watch_interval))
+            search_cache = cache.memory_search_cache
+            while True:
+                time.sleep(config.watch_interval)
+                if search_cache is None or files_changed(search_cache):
+                    break
+            logger.info("Files have changed, updating the report")
+            restore_state(state)
+    except (KeyboardInterrupt, click.exceptions.Abort):
+        logger.info("Stopped watching")
+    finally:
+        running = False
+        util_functions.robust_rmtree(files_tmp_dir)
+
+
+def save_state():
+    """ Copy the report and config as they are before the first run """
+    from multiqc.utils.module_jobs import get_config_values
+    return {
+        'report': dict((k, copy.deepcopy(getattr(report, k))) for k in report_attrs if hasattr(report, k)),
+        'config': get_config_values(copy.deepcopy),
+        'log_handlers': list(logger.handlers)
+    }
+
+
+def restore_state(state):
+    """ Put everything back to how it was before the first run,
+    apart from the search results and module output that we keep """
+    from multiqc.utils.module_jobs import get_config_values
+    from multiqc.utils.plot_jobs import runner as plot_runner
+    for k in report_attrs:
+        if k in state['report']:
+            setattr(report, k, copy.deepcopy(state['report'][k]))
+        elif hasattr(report, k):
+            delattr(report, k)
+    for k in get_config_values():
+        if k not in state['config']:
+            delattr(config, k)
+    for k, v in state['config'].items():
+        setattr(config, k, copy.deepcopy(v))
+    for h in list(logger.handlers):
+        if h not in state['log_handlers']:
+            logger.removeHandler(h)
+            h.close()
+    if log.log_tmp_dir is not None and os.path.isdir(log.log_tmp_dir):
+        util_functions.robust_rmtree(log.log_tmp_dir)
+    profiling.phases = list()
+    profiling.file_times = list()
+    shard.module_states = OrderedDict()
+    plot_runner.close()
+    plot_runner.jobs = list()
+
+
+def files_changed(search_cache):
+    """ Whether any file has been added, changed or removed since the last search """
+    seen = set()
+    for path in search_cache.paths:
+        if os.path.islink(path) and config.ignore_symlinks:
+            continue
+        elif os.path.isfile(path):
+            sfiles = [[os.path.basename(path), os.path.dirname(path)]]
+        elif os.path.isdir(path):
+            sfiles = report.walk_dir(path)
+        else:
+            continue
+        for fn, root in sfiles:
+            if any(fnmatch.fnmatch(fn, n) for n in config.fn_ignore_files):
+                continue
+            try:
+                st = os.stat(os.path.join(root, fn))
+            except (IOError, OSError):
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            cached = search_cache.entries.get((root, fn))
+            if cached is None or cached[0] != st.st_size or cached[1] != st.st_mtime:
+                logger.debug("Changed file: {}".format(os.path.join(root, fn)))
+                return True
+            seen.add((root, fn))
+    return len(seen) != len(search_cache.entries)
+
+
+def module_key(this_module, mod_cust_config):
+    return (this_module, repr(mod_cust_config))
+
+
+def files_signature(keys):
+    """ The files found for these search keys, with the size and modification
+    time of each. A module is run again if this changes. """
+    entries = cache.memory_search_cache.entries if cache.memory_search_cache is not None else dict()
+    sig = list()
+    for key in sorted(keys):
+        if key not in report.files:
+            sig.append((key, None))
+            continue
+        sig.append((key, tuple((f['root'], f['fn'], entries.get((f['root'], f['fn']), (None, None))[:2]) for f in report.files[key])))
+    return sig
+
+
+def kept_results(run_modules):
+    """ The kept output of each module whose files haven't changed, by module_key() """
+    kept = dict()
+    for m in run_modules:
+        key = module_key(*list(m.items())[0])
+        k = module_results.get(key)
+        if k is not None and files_signature(k['files_probes']) == k['signature']:
+            kept[key] = k['result']
+    if len(kept) > 0:
+        logger.debug("Using the output from the last run for {} modules".format(len(kept)))
+    return kept
+
+
+def keep_result(this_module, mod_cust_config, data, result):
+    """ Keep the pickled output of a module for the next run. Not kept if the
+    module changed the search results, as we can't tell what it depends on. """
+    key = module_key(this_module, mod_cust_config)
+    old = module_results.pop(key, None)
+    if old is not None and old['files_dir'] is not None and old['files_dir'] != result['files_dir']:
+        util_functions.robust_rmtree(old['files_dir'])
+    if result['files_replaced']:
+        return
+    module_results[key] = {
+        'result': data,
+        'files_probes': result['files_probes'],
+        'signature': files_signature(result['files_probes']),
+        'files_dir': result['files_dir']
+    }
+
+
+@contextlib.contextmanager
+def module_files_dir():
+    """ With --watch, point the data and plots directories at a new directory
+    while a module runs, so that its files can be copied into later reports.
+    Yields the directory, or None if not watching. """
+    if not config.watch or files_tmp_dir is None:
+        yield None
+        return
+    files_dir = tempfile.mkdtemp(dir=files_tmp_dir)
+    saved = dict()
+    for attr, sub in [('data_dir', 'data'), ('plots_dir', 'plots')]:
+        if getattr(config, attr, None) is not None:
+            saved[attr] = getattr(config, attr)
+            setattr(config, attr, os.path.join(files_dir, sub))
+            os.makedirs(getattr(config, attr))
+    try:
+        yield files_dir
+    finally:
+        for attr, value in saved.items():
+            setattr(config, attr, value)
+
+
+def copy_module_files(files_dir):
+    """ Copy the files written by a module into the data and plots directories """
+    for attr, sub in [('data_dir', 'data'), ('plots_dir', 'plots')]:
+        src_dir = os.path.join(files_dir, sub)
+        dest_dir = getattr(config, attr, None)
+        if dest_dir is None or not os.path.isdir(src_dir):
+            continue
+        for root, dirnames, filenames in os.walk(src_dir):
+            dest = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+            if not os.path.isdir(dest):
+                os.makedirs(dest)
+            for fn in filenames:
+                shutil.copyfile(os.path.join(root, fn), os.path.join(dest, fn))
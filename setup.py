@@ -58,11 +58,14 @@ setup(
     url = 'http://multiqc.info',
     download_url = 'https://github.com/ewels/MultiQC/tarball/{}'.format(dl_version),
     license = 'GPLv3',
-    packages = find_packages(),
+    packages = find_packages(exclude=['tests', 'tests.*']),
     include_package_data = True,
     zip_safe = False,
     scripts = ['scripts/multiqc'],
     install_requires = install_requires,
+    extras_require = {
+        'arrow': ['pyarrow']
+    },
     entry_points = {
         'multiqc.modules.v1': [
             'adapterRemoval = multiqc.modules.adapterRemoval:MultiqcModule',
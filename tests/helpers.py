@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+""" Helpers shared by the MultiQC tests. Logs are made with the benchmark
+log generator and MultiQC is run in a separate process, with its caches
+in a temporary directory. """
+
+from __future__ import print_function
+from collections import OrderedDict
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+multiqc_script = os.path.join(repo_dir, 'scripts', 'multiqc')
+sys.path.insert(0, os.path.join(repo_dir, 'benchmarks'))
+import generate
+
+# Parts of the data export that are different for every run
+run_keys = [
+    'report_multiqc_command',
+    'config_analysis_dir',
+    'config_analysis_dir_abs',
+    'config_creation_date',
+    'config_git_hash',
+    'config_script_path',
+    'config_version'
+]
+
+
+class MultiqcTestCase(unittest.TestCase):
+    """ Test case with a temporary directory, removed afterwards """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='multiqc_test_')
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def set_config(self, **kwargs):
+        """ Change config values until the end of the test """
+        from multiqc.utils import config
+        for k, v in kwargs.items():
+            if hasattr(config, k):
+                self.addCleanup(setattr, config, k, getattr(config, k))
+            else:
+                self.addCleanup(delattr, config, k)
+            setattr(config, k, v)
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir, *parts)
+
+    def make_logs(self, name='logs', samples=3, formats=None, seed=1):
+        """ Write synthetic logs to a new directory and return its path """
+        out_dir = self.path(name)
+        generate.generate(out_dir, samples, 20, 0, formats, seed)
+        return out_dir
+
+    def start_multiqc(self, args, stdout=subprocess.PIPE):
+        """ Start MultiQC with these arguments in a new process """
+        env = dict(os.environ)
+        env['XDG_CACHE_HOME'] = self.cache_dir
+        env['PYTHONPATH'] = os.pathsep.join([repo_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+        cmd = [sys.executable, multiqc_script, '-f', '--cl-config', 'no_version_check: true'] + list(args)
+        return subprocess.Popen(cmd, cwd=self.tmp_dir, env=env, stdout=stdout, stderr=subprocess.STDOUT)
+
+    def run_multiqc(self, *args):
+        """ Run MultiQC with these arguments, failing the test if it fails.
+        Returns everything printed to stdout and stderr. """
+        proc = self.start_multiqc(args)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        if proc.returncode != 0:
+            self.fail("MultiQC exited with code {}: {}\n{}".format(proc.returncode, ' '.join(args), output))
+        return output
+
+    def assertSameData(self, dir_a, dir_b):
+        """ Check that two MultiQC runs gave the same data export and data files """
+        self.assertEqual(load_data(dir_a), load_data(dir_b))
+        self.assertEqual(data_files(dir_a), data_files(dir_b))
+
+
+def load_data(out_dir):
+    """ Load multiqc_data.json(.gz) from a report directory, leaving out the parts
+    that change with every run. Random plot IDs are numbered in order. """
+    fn = os.path.join(out_dir, 'multiqc_data', 'multiqc_data.json')
+    if os.path.isfile(fn):
+        with io.open(fn, encoding='utf-8') as f:
+            data = f.read()
+    else:
+        with gzip.open(fn + '.gz', 'rb') as f:
+            data = f.read().decode('utf-8')
+    plot_ids = OrderedDict()
+    for plot_id in re.findall(r'mqc_(?:hc|mpl)plot_[a-z]{10}', data):
+        plot_ids.setdefault(plot_id, 'plot_{}'.format(len(plot_ids)))
+    data = re.sub(r'mqc_(?:hc|mpl)plot_[a-z]{10}', lambda m: plot_ids[m.group(0)], data)
+    data = json.loads(data, object_pairs_hook=OrderedDict)
+    for k in run_keys:
+        data.pop(k, None)
+    return data
+
+
+def data_files(out_dir):
+    """ The contents of each tab-separated data file in a report directory """
+    data_dir = os.path.join(out_dir, 'multiqc_data')
+    contents = dict()
+    for fn in os.listdir(data_dir):
+        if fn.endswith('.txt') and fn != 'multiqc.log':
+            with io.open(os.path.join(data_dir, fn), encoding='utf-8') as f:
+                contents[fn] = f.read()
+    return contents
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+""" Tests for the startup cache of the default config and entry points """
+
+from __future__ import print_function
+import glob
+import os
+import subprocess
+import sys
+
+from tests.helpers import MultiqcTestCase, repo_dir
+
+
+class StartupBundleTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(StartupBundleTest, self).setUp()
+        self.logs = self.make_logs(formats=['samtools'])
+
+    def bundles(self, cache_dir):
+        return glob.glob(os.path.join(cache_dir, 'multiqc', 'config_bundle_*.pickle')) + \
+            glob.glob(os.path.join(cache_dir, 'config_bundle_*.pickle'))
+
+    def test_import_writes_nothing(self):
+        env = dict(os.environ)
+        env['XDG_CACHE_HOME'] = self.cache_dir
+        env['PYTHONPATH'] = repo_dir
+        env.pop('MULTIQC_CACHE_DIR', None)
+        subprocess.check_call([sys.executable, '-c', 'import multiqc.utils.config'], cwd=self.tmp_dir, env=env)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_written_by_command(self):
+        self.run_multiqc(self.logs, '-o', self.path('report'))
+        self.assertEqual(len(self.bundles(self.cache_dir)), 1)
+
+    def test_env_cache_dir(self):
+        env_cache_dir = self.path('env_cache')
+        os.environ['MULTIQC_CACHE_DIR'] = env_cache_dir
+        self.addCleanup(os.environ.pop, 'MULTIQC_CACHE_DIR')
+        self.run_multiqc(self.logs, '-o', self.path('report'))
+        self.assertEqual(len(self.bundles(env_cache_dir)), 1)
+        self.assertEqual(self.bundles(self.cache_dir), [])
+
+    def test_config_cache_dir(self):
+        # The bundle is read before config files, so it isn't written to another cache_dir
+        other_cache_dir = self.path('other_cache')
+        self.run_multiqc(self.logs, '-o', self.path('report'), '--cl-config', 'cache_dir: {}'.format(other_cache_dir))
+        self.assertEqual(self.bundles(self.cache_dir), [])
+        self.assertEqual(self.bundles(other_cache_dir), [])
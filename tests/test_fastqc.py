@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+""" Tests for the FastQC module """
+
+from __future__ import print_function
+import io
+import os
+import re
+import zipfile
+
+from multiqc.utils import report
+from tests.helpers import MultiqcTestCase, load_data
+
+
+class FastqcZipTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(FastqcZipTest, self).setUp()
+        self.logs = self.make_logs(formats=['fastqc'])
+        with io.open(os.path.join(self.logs, 'fastqc', 'sample00000_R1_fastqc', 'fastqc_data.txt'), encoding='utf-8') as f:
+            self.fastqc_data = f.read()
+
+    def write_zip(self, path, filename, total):
+        """ Write a FastQC zip file with this input filename and number of reads """
+        contents = re.sub(r'Filename\t.*', u'Filename\t{}'.format(filename), self.fastqc_data)
+        contents = re.sub(r'Total Sequences\t\d+', u'Total Sequences\t{}'.format(total), contents)
+        d_name = os.path.basename(path)[:-4]
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('{}/'.format(d_name), b'')
+            z.writestr('{}/fastqc_data.txt'.format(d_name), contents.encode('utf-8'))
+
+    def total_sequences(self, out_dir):
+        raw = load_data(out_dir)['report_saved_raw_data']['multiqc_fastqc']
+        return dict((s_name, d['Total Sequences']) for s_name, d in raw.items())
+
+    def test_duplicate_zip_names(self):
+        # Zips with the same name in different directories give the same result
+        # with and without a pool. Each zip is only skipped if a sample with its
+        # name has already been found, otherwise later reports overwrite earlier
+        # ones for the same sample.
+        self.write_zip(os.path.join(self.logs, 'dup_a', 'x_fastqc.zip'), 'y.fastq.gz', 111)
+        self.write_zip(os.path.join(self.logs, 'dup_b', 'x_fastqc.zip'), 'y.fastq.gz', 222)
+        self.write_zip(os.path.join(self.logs, 'dup_a', 'z_fastqc.zip'), 'z1.fastq.gz', 333)
+        self.write_zip(os.path.join(self.logs, 'dup_b', 'z_fastqc.zip'), 'z2.fastq.gz', 444)
+        self.write_zip(os.path.join(self.logs, 'dup_a', 'w_fastqc.zip'), 'w.fastq.gz', 555)
+        self.write_zip(os.path.join(self.logs, 'dup_b', 'w_fastqc.zip'), 'w.fastq.gz', 666)
+        search_order = [os.path.basename(root) for fn, root in report.walk_dir(self.logs) if fn == 'x_fastqc.zip']
+        expected = {
+            'y': 111 if search_order[-1] == 'dup_a' else 222,
+            'z1': 333,
+            'z2': 444,
+            'w': 555 if search_order[0] == 'dup_a' else 666
+        }
+        for zip_jobs in [1, 2, 0]:
+            out_dir = self.path('zip_jobs_{}'.format(zip_jobs))
+            self.run_multiqc(self.logs, '-m', 'fastqc', '-o', out_dir, '--cl-config', 'fastqc_config: {{zip_jobs: {}}}'.format(zip_jobs))
+            totals = self.total_sequences(out_dir)
+            for s_name, total in expected.items():
+                self.assertEqual(totals[s_name], total, s_name)
+            self.assertEqual(len(totals), 3 + len(expected))
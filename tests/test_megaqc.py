@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+""" Tests for the JSON data export and the upload to MegaQC """
+
+from __future__ import print_function
+from collections import OrderedDict
+import gzip
+import io
+import json
+import os
+import threading
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer # Python 2
+
+from multiqc.utils import config, megaqc
+from tests.helpers import MultiqcTestCase, load_data
+
+
+def example_export():
+    """ Export data with the kinds of values found in a report """
+    samples = OrderedDict()
+    for i in range(2000):
+        samples['sample_{}'.format(i)] = {'reads': i * 1000.5, 'gc': i % 100, 'status': None, 'name': u'\u00e9chantillon {}'.format(i)}
+    return OrderedDict([
+        ('report_general_stats_data', [samples]),
+        ('report_general_stats_headers', [{'reads': {'title': 'Reads', 'modify': lambda x: x * 0.000001, 'shared_key': 'read_count'}}]),
+        ('report_plot_data', {'plot_a': {'plot_type': 'xy_line', 'datasets': [[{'name': 's1', 'data': [[1, 2.5], [2, 3.5]]}]], 'config': {'ymin': 0}}}),
+        ('report_saved_raw_data', {'multiqc_test': {1: 'numeric key', 2.5: [True, False, None]}}),
+        ('config_analysis_dir', ['/data/run1']),
+        ('config_title', None)
+    ])
+
+
+def old_export(data):
+    """ The export as it was made before it was streamed """
+    return json.loads(json.dumps(data, cls=megaqc.MQCJSONEncoder, ensure_ascii=False))
+
+
+class MegaqcHandler(BaseHTTPRequestHandler):
+    """ Stand-in for the MegaQC upload API. Saves each request on the server. """
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = list()
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body.append(self.rfile.read(size))
+                self.rfile.readline()
+                if size == 0:
+                    break
+            body = b''.join(body)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.uploads.append({'headers': dict(self.headers.items()), 'body': body})
+        if self.headers.get('Transfer-Encoding') == 'chunked' and not self.server.accept_chunked:
+            self.send_reply(411, {'success': False, 'message': 'Length required'})
+        else:
+            self.send_reply(200, {'success': True, 'message': 'Data upload successful'})
+
+    def send_reply(self, code, reply):
+        body = json.dumps(reply).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MegaqcTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(MegaqcTest, self).setUp()
+        self.server = HTTPServer(('127.0.0.1', 0), MegaqcHandler)
+        self.server.uploads = list()
+        self.server.accept_chunked = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/api/upload_data'.format(self.server.server_address[1])
+        self.set_config(megaqc_url=self.url, megaqc_access_token='token', megaqc_timeout=30)
+
+    def uploaded_data(self, upload):
+        self.assertEqual(upload['headers'].get('content-encoding', upload['headers'].get('Content-Encoding')), 'gzip')
+        return json.loads(zlib.decompress(upload['body'], 16 + zlib.MAX_WBITS).decode('utf-8'))
+
+    def test_chunked_upload(self):
+        data = example_export()
+        megaqc.multiqc_api_post(data)
+        self.assertEqual(len(self.server.uploads), 1)
+        upload = self.server.uploads[0]
+        self.assertEqual(upload['headers'].get('Transfer-Encoding'), 'chunked')
+        self.assertEqual(upload['headers'].get('access_token'), 'token')
+        self.assertEqual(self.uploaded_data(upload), {'data': old_export(data)})
+
+    def test_chunked_upload_rejected(self):
+        self.server.accept_chunked = False
+        data = example_export()
+        megaqc.multiqc_api_post(data)
+        self.assertEqual(len(self.server.uploads), 2)
+        self.assertEqual(self.server.uploads[0]['headers'].get('Transfer-Encoding'), 'chunked')
+        upload = self.server.uploads[1]
+        self.assertNotIn('Transfer-Encoding', upload['headers'])
+        self.assertEqual(int(upload['headers']['Content-Length']), len(upload['body']))
+        self.assertEqual(self.uploaded_data(upload), {'data': old_export(data)})
+
+    def test_multiqc_run(self):
+        logs = self.make_logs(formats=['samtools', 'custom_content'])
+        out_dir = self.path('report')
+        output = self.run_multiqc(logs, '-o', out_dir, '--cl-config', 'megaqc_url: {}'.format(self.url))
+        self.assertIn('Data upload successful', output)
+        self.assertEqual(len(self.server.uploads), 1)
+        with io.open(os.path.join(out_dir, 'multiqc_data', 'multiqc_data.json'), encoding='utf-8') as f:
+            self.assertEqual(self.uploaded_data(self.server.uploads[0]), {'data': json.load(f)})
+
+
+class DumpFileTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(DumpFileTest, self).setUp()
+        self.set_config(data_dir=self.tmp_dir)
+
+    def test_json_blocks(self):
+        data = example_export()
+        blocks = list(megaqc.json_blocks(data, block_size=1000))
+        self.assertTrue(len(blocks) > 10)
+        self.assertEqual(json.loads(b''.join(blocks).decode('utf-8')), old_export(data))
+        compressed = b''.join(megaqc.json_blocks(data, compress=True, block_size=1000))
+        self.assertEqual(json.loads(zlib.decompress(compressed, 16 + zlib.MAX_WBITS).decode('utf-8')), old_export(data))
+
+    def test_dump_file(self):
+        self.set_config(data_dump_file_gzip=False)
+        data = example_export()
+        megaqc.multiqc_dump_file(data)
+        with io.open(self.path('multiqc_data.json'), encoding='utf-8') as f:
+            self.assertEqual(json.load(f), old_export(data))
+
+    def test_dump_file_gzip(self):
+        self.set_config(data_dump_file_gzip=True)
+        data = example_export()
+        megaqc.multiqc_dump_file(data)
+        with gzip.open(self.path('multiqc_data.json.gz'), 'rb') as f:
+            self.assertEqual(json.loads(f.read().decode('utf-8')), old_export(data))
+
+    def test_dump_file_gzip_multiqc_run(self):
+        logs = self.make_logs(formats=['samtools'])
+        self.run_multiqc(logs, '-o', self.path('plain'))
+        self.run_multiqc(logs, '-o', self.path('gzip'), '--cl-config', 'data_dump_file_gzip: true')
+        self.assertTrue(os.path.isfile(self.path('gzip', 'multiqc_data', 'multiqc_data.json.gz')))
+        self.assertEqual(load_data(self.path('gzip')), load_data(self.path('plain')))
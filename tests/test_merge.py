@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+""" Tests for merging the data exports of earlier runs (--merge) """
+
+from __future__ import print_function
+import io
+import os
+
+from tests.helpers import MultiqcTestCase, load_data
+
+raw_fn = 'multiqc_samtools_stats'
+
+
+class MergeTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(MergeTest, self).setUp()
+        # Two runs with different data for sample00000 and sample00001
+        self.make_logs('logs_a', samples=2, formats=['samtools'], seed=1)
+        self.make_logs('logs_b', samples=3, formats=['samtools'], seed=2)
+        self.run_a = self.path('run_a')
+        self.run_b = self.path('run_b')
+        self.run_multiqc(self.path('logs_a'), '-o', self.run_a, '--export-for-merge')
+        self.run_multiqc(self.path('logs_b'), '-o', self.run_b, '--export-for-merge')
+        self.raw_a = load_data(self.run_a)['report_saved_raw_data'][raw_fn]
+        self.raw_b = load_data(self.run_b)['report_saved_raw_data'][raw_fn]
+
+    def merge(self, *args):
+        out_dir = self.path('merged')
+        output = self.run_multiqc('--merge', self.run_a, self.run_b, '-o', out_dir, *args)
+        return load_data(out_dir), output
+
+    def assertSamples(self, data, s_names):
+        """ Check that every part of the export has these samples """
+        s_names = sorted(s_names)
+        for gs_data in data['report_general_stats_data']:
+            self.assertEqual(sorted(gs_data.keys()), s_names)
+        for fn, raw in data['report_saved_raw_data'].items():
+            self.assertEqual(sorted(raw.keys()), s_names, fn)
+        for sources in data['report_data_sources']['Samtools'].values():
+            self.assertEqual(sorted(sources.keys()), s_names)
+        for pid, plot in data['report_plot_data'].items():
+            if plot['plot_type'] == 'xy_line':
+                samples = [[s['name'] for s in ds] for ds in plot['datasets']]
+            else:
+                samples = plot['samples']
+            for ds_samples in samples:
+                self.assertEqual(sorted(ds_samples), s_names, pid)
+            if plot['plot_type'] == 'bar_graph':
+                for ds_samples, ds in zip(plot['samples'], plot['datasets']):
+                    for cat in ds:
+                        self.assertEqual(len(cat['data']), len(ds_samples))
+
+    def test_rename(self):
+        data, output = self.merge()
+        self.assertSamples(data, ['sample00000', 'sample00001', 'sample00000 (run_b)', 'sample00001 (run_b)', 'sample00002'])
+        raw = data['report_saved_raw_data'][raw_fn]
+        self.assertEqual(raw['sample00000'], self.raw_a['sample00000'])
+        self.assertEqual(raw['sample00000 (run_b)'], self.raw_b['sample00000'])
+        self.assertEqual(raw['sample00002'], self.raw_b['sample00002'])
+        sources = data['report_data_sources']['Samtools']['stats']
+        self.assertEqual(sources['sample00000 (run_b)'], self.path('logs_b', 'samtools', 'sample00000.stats'))
+
+    def test_keep(self):
+        data, output = self.merge('--cl-config', 'merge_sample_collisions: keep')
+        self.assertSamples(data, ['sample00000', 'sample00001', 'sample00002'])
+        raw = data['report_saved_raw_data'][raw_fn]
+        self.assertEqual(raw['sample00000'], self.raw_a['sample00000'])
+        self.assertEqual(raw['sample00002'], self.raw_b['sample00002'])
+        sources = data['report_data_sources']['Samtools']['stats']
+        self.assertEqual(sources['sample00000'], self.path('logs_a', 'samtools', 'sample00000.stats'))
+
+    def test_overwrite(self):
+        data, output = self.merge('--cl-config', 'merge_sample_collisions: overwrite')
+        self.assertSamples(data, ['sample00000', 'sample00001', 'sample00002'])
+        raw = data['report_saved_raw_data'][raw_fn]
+        self.assertEqual(raw['sample00000'], self.raw_b['sample00000'])
+        self.assertEqual(raw['sample00002'], self.raw_b['sample00002'])
+        sources = data['report_data_sources']['Samtools']['stats']
+        self.assertEqual(sources['sample00000'], self.path('logs_b', 'samtools', 'sample00000.stats'))
+
+    def test_single_export(self):
+        out_dir = self.path('merged')
+        self.run_multiqc('--merge', self.run_a, '-o', out_dir)
+        merged = load_data(out_dir)
+        original = load_data(self.run_a)
+        for k in ['report_saved_raw_data', 'report_data_sources', 'report_plot_data']:
+            self.assertEqual(merged[k], original[k], k)
+        # The General Statistics values are saved after they were modified for the original report
+        self.assertEqual(merged['report_general_stats_data'], original['report_general_stats_modified'])
+        with io.open(os.path.join(out_dir, 'multiqc_report.html'), encoding='utf-8') as f:
+            self.assertIn('id="samtools-stats"', f.read())
+
+    def test_export_without_sections(self):
+        # The data is still merged, but only the report sections of run_a are shown
+        run_c = self.path('run_c')
+        self.make_logs('logs_c', samples=4, formats=['samtools'], seed=3)
+        self.run_multiqc(self.path('logs_c'), '-o', run_c)
+        output = self.run_multiqc('--merge', self.run_a, run_c, '-o', self.path('merged'), '--cl-config', 'merge_sample_collisions: overwrite')
+        self.assertIn('has no report sections', output)
+        raw = load_data(self.path('merged'))['report_saved_raw_data'][raw_fn]
+        self.assertEqual(raw, load_data(run_c)['report_saved_raw_data'][raw_fn])
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+""" Tests for the parsed data cache (--parse-cache) """
+
+from __future__ import print_function
+import io
+import os
+import re
+import sqlite3
+
+from multiqc.utils import cache
+from tests.helpers import MultiqcTestCase, load_data
+
+
+class ParseCacheTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(ParseCacheTest, self).setUp()
+        self.logs = self.make_logs(formats=['fastqc'])
+        self.data_fn = os.path.join(self.logs, 'fastqc', 'sample00000_R1_fastqc', 'fastqc_data.txt')
+        self.set_mtime(self.data_fn)
+
+    def set_mtime(self, path, mtime=1500000000):
+        os.utime(path, (mtime, mtime))
+
+    def run_fastqc(self, name, *args):
+        out_dir = self.path(name)
+        self.run_multiqc(self.logs, '-m', 'fastqc', '-o', out_dir, *args)
+        return out_dir
+
+    def total_sequences(self, out_dir):
+        return load_data(out_dir)['report_saved_raw_data']['multiqc_fastqc']['sample00000_R1']['Total Sequences']
+
+    def edit_total_sequences(self):
+        """ Change the number of reads without changing the file size """
+        with io.open(self.data_fn, encoding='utf-8') as f:
+            contents = f.read()
+        total = re.search(r'Total Sequences\t(\d+)', contents).group(1)
+        with io.open(self.data_fn, 'w', encoding='utf-8') as f:
+            f.write(contents.replace(u'Total Sequences\t' + total, u'Total Sequences\t' + u'1' * len(total)))
+        return int(total), int('1' * len(total))
+
+    def test_cached_results_used(self):
+        first = self.run_fastqc('first', '--parse-cache')
+        db = sqlite3.connect(os.path.join(self.cache_dir, 'multiqc', 'parse_cache.sqlite'))
+        try:
+            cached = set(fn for fn, in db.execute('SELECT fn FROM parsed'))
+        finally:
+            db.close()
+        self.assertEqual(cached, set(['fastqc_data.txt', 'sample00001_R1_fastqc.zip']))
+        self.assertSameData(first, self.run_fastqc('uncached'))
+        self.assertSameData(first, self.run_fastqc('cached', '--parse-cache'))
+        # A file with the same size and modification time isn't read again
+        old_total, new_total = self.edit_total_sequences()
+        self.set_mtime(self.data_fn)
+        self.assertEqual(self.total_sequences(self.run_fastqc('stale', '--parse-cache')), old_total)
+
+    def test_changed_file_parsed_again(self):
+        self.run_fastqc('first', '--parse-cache')
+        old_total, new_total = self.edit_total_sequences()
+        self.set_mtime(self.data_fn, 1500000010)
+        cached = self.run_fastqc('cached', '--parse-cache')
+        self.assertEqual(self.total_sequences(cached), new_total)
+        self.assertSameData(cached, self.run_fastqc('uncached'))
+
+
+class ParseCacheDbTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(ParseCacheDbTest, self).setUp()
+        self.set_config(cache_dir=self.cache_dir)
+        self.f = {'fn': 'log.txt', 'root': self.tmp_dir}
+        with io.open(self.path('log.txt'), 'w', encoding='utf-8') as f:
+            f.write(u'Total Sequences\t100\n')
+        self.parse_cache = cache.ParseCache()
+        self.addCleanup(self.parse_cache.close)
+
+    def test_get(self):
+        self.assertIsNone(self.parse_cache.get('mod', 'mod/key', self.f, '1'))
+        self.parse_cache.add('mod', 'mod/key', self.f, '1', {'total': 100})
+        self.parse_cache.commit()
+        self.assertEqual(self.parse_cache.get('mod', 'mod/key', self.f, '1'), {'total': 100})
+        self.assertIsNone(self.parse_cache.get('other_mod', 'mod/key', self.f, '1'))
+        self.assertIsNone(self.parse_cache.get('mod', 'mod/other_key', self.f, '1'))
+
+    def test_version_change(self):
+        self.parse_cache.add('mod', 'mod/key', self.f, '1', {'total': 100})
+        self.assertIsNone(self.parse_cache.get('mod', 'mod/key', self.f, '2'))
+
+    def test_changed_file(self):
+        self.parse_cache.add('mod', 'mod/key', self.f, '1', {'total': 100})
+        with io.open(self.path('log.txt'), 'a', encoding='utf-8') as f:
+            f.write(u'Total Sequences\t200\n')
+        self.assertIsNone(self.parse_cache.get('mod', 'mod/key', self.f, '1'))
+
+    def test_deleted_file(self):
+        self.parse_cache.add('mod', 'mod/key', self.f, '1', {'total': 100})
+        os.remove(self.path('log.txt'))
+        self.assertIsNone(self.parse_cache.get('mod', 'mod/key', self.f, '1'))
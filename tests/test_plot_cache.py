@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+""" Tests for the flat plot image cache (--plot-cache) """
+
+from __future__ import print_function
+import io
+import os
+import sqlite3
+
+from multiqc.utils import cache
+from tests.helpers import MultiqcTestCase
+
+
+class PlotCacheTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(PlotCacheTest, self).setUp()
+        self.logs = self.make_logs(formats=['samtools'])
+        self.db_fn = os.path.join(self.cache_dir, 'multiqc', 'plot_cache.sqlite')
+
+    def run_samtools(self, name, *args):
+        out_dir = self.path(name)
+        self.run_multiqc(self.logs, '-m', 'samtools', '--flat', '--export', '-o', out_dir, *args)
+        return out_dir
+
+    def plot_images(self, out_dir):
+        """ The contents of each exported plot image """
+        images = dict()
+        plots_dir = os.path.join(out_dir, 'multiqc_plots')
+        for root, dirnames, filenames in os.walk(plots_dir):
+            for fn in filenames:
+                with io.open(os.path.join(root, fn), 'rb') as f:
+                    images[os.path.relpath(os.path.join(root, fn), plots_dir)] = f.read()
+        return images
+
+    def cached_keys(self):
+        db = sqlite3.connect(self.db_fn)
+        try:
+            return set(key for key, in db.execute('SELECT key FROM images'))
+        finally:
+            db.close()
+
+    def replace_cached_images(self):
+        """ Swap the cached images for a placeholder, so we can tell when they are used """
+        db = sqlite3.connect(self.db_fn)
+        try:
+            db.execute('UPDATE images SET data = ?', (sqlite3.Binary(b'cached image'),))
+            db.commit()
+        finally:
+            db.close()
+
+    def test_cached_images_used(self):
+        first = self.plot_images(self.run_samtools('first', '--plot-cache'))
+        self.assertTrue(len(first) > 0)
+        # An image for each of the three export formats and one for the report
+        keys = self.cached_keys()
+        self.assertEqual(len(keys), len(first) + len(first) // 3)
+        self.replace_cached_images()
+        cached = self.plot_images(self.run_samtools('cached', '--plot-cache'))
+        self.assertEqual(sorted(cached.keys()), sorted(first.keys()))
+        self.assertEqual(set(cached.values()), set([b'cached image']))
+        self.assertEqual(self.cached_keys(), keys)
+        # Not used without --plot-cache
+        uncached = self.plot_images(self.run_samtools('uncached'))
+        self.assertNotIn(b'cached image', uncached.values())
+
+    def test_changed_data_drawn_again(self):
+        self.run_samtools('first', '--plot-cache')
+        keys = self.cached_keys()
+        self.replace_cached_images()
+        self.make_logs(formats=['samtools'], seed=2)
+        changed = self.plot_images(self.run_samtools('changed', '--plot-cache'))
+        self.assertNotIn(b'cached image', changed.values())
+        self.assertTrue(self.cached_keys() > keys)
+
+
+class PlotCacheDbTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(PlotCacheDbTest, self).setUp()
+        self.set_config(cache_dir=self.cache_dir)
+        self.plot_cache = cache.PlotCache()
+        self.addCleanup(self.plot_cache.close)
+
+    def test_plot_key(self):
+        pdata = [{'sample1': {1: 2.0, 2: 3.0}}]
+        pconfig = {'id': 'plot_a', 'title': 'Plot'}
+        key = cache.PlotCache.plot_key('linegraph', pdata, 0, pconfig)
+        self.assertEqual(key, cache.PlotCache.plot_key('linegraph', pdata, 0, dict(pconfig, id='plot_b')))
+        self.assertNotEqual(key, cache.PlotCache.plot_key('linegraph', pdata, 1, pconfig))
+        self.assertNotEqual(key, cache.PlotCache.plot_key('linegraph', pdata, 0, dict(pconfig, title='Other plot')))
+        self.assertNotEqual(key, cache.PlotCache.plot_key('linegraph', [{'sample1': {1: 2.0, 2: 4.0}}], 0, pconfig))
+
+    def test_get(self):
+        self.assertIsNone(self.plot_cache.get('key', ['png']))
+        self.plot_cache.add('key', {'png': b'png image', 'svg': b'svg image'})
+        self.assertEqual(self.plot_cache.get('key', ['png', 'svg']), {'png': b'png image', 'svg': b'svg image'})
+        self.assertEqual(self.plot_cache.get('key', ['png']), {'png': b'png image'})
+        self.assertIsNone(self.plot_cache.get('key', ['png', 'pdf']))
+        self.assertIsNone(self.plot_cache.get(None, ['png']))
+
+    def test_trim(self):
+        self.set_config(plot_cache_size=1.5 / 1024)
+        self.plot_cache.add('old', {'png': b'x' * 1000})
+        self.plot_cache.add('new', {'png': b'x' * 1000})
+        self.plot_cache.add('used', {'png': b'x' * 100})
+        self.plot_cache.db.execute("UPDATE images SET atime = 1 WHERE key = 'old.png'")
+        self.plot_cache.db.execute("UPDATE images SET atime = 2 WHERE key = 'new.png'")
+        self.plot_cache.db.execute("UPDATE images SET atime = 3 WHERE key = 'used.png'")
+        self.plot_cache.trim()
+        self.assertIsNone(self.plot_cache.get('old', ['png']))
+        self.assertIsNotNone(self.plot_cache.get('new', ['png']))
+        self.assertIsNotNone(self.plot_cache.get('used', ['png']))
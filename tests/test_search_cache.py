@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+""" Tests for the persistent search cache (--search-cache) """
+
+from __future__ import print_function
+import io
+import os
+import shutil
+import sqlite3
+
+from multiqc.utils import config, report
+from tests.helpers import MultiqcTestCase
+
+all_modules = sorted(set(k.split('/', 1)[0] for k in config.sp))
+
+
+class SearchCacheTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(SearchCacheTest, self).setUp()
+        self.logs = self.make_logs()
+        self.set_config(
+            analysis_dir=[self.logs],
+            cache_dir=self.cache_dir,
+            search_cache=True,
+            search_threads=None,
+            watch=False,
+            shard=None
+        )
+        self.addCleanup(setattr, report, 'files', report.files)
+        self.addCleanup(setattr, report, 'searchfiles', report.searchfiles)
+        # Count the files that are searched instead of loaded from the cache
+        self.searched = list()
+        match_file = report.match_file
+        def counting_match_file(fn, root, spatterns, results=None):
+            self.searched.append(os.path.join(root, fn))
+            return match_file(fn, root, spatterns, results)
+        report.match_file = counting_match_file
+        self.addCleanup(setattr, report, 'match_file', match_file)
+
+    def search(self, modules=all_modules, use_cache=True):
+        """ Run the file search, returning the paths found for each search pattern key """
+        config.search_cache = use_cache
+        report.files = dict()
+        report.searchfiles = list()
+        del self.searched[:]
+        report.get_filelist(modules)
+        return dict((k, [os.path.join(f['root'], f['fn']) for f in fs]) for k, fs in report.files.items())
+
+    def log_path(self, *parts):
+        return os.path.join(self.logs, *parts)
+
+    def change_file(self, path):
+        with io.open(path, 'a', encoding='utf-8') as f:
+            f.write(u'\n')
+        st = os.stat(path)
+        os.utime(path, (st.st_atime + 10, st.st_mtime + 10))
+
+    def cached_files(self):
+        db = sqlite3.connect(os.path.join(self.cache_dir, 'search_cache.sqlite'))
+        try:
+            return set(os.path.join(root, fn) for root, fn in db.execute('SELECT root, fn FROM files'))
+        finally:
+            db.close()
+
+    def test_unchanged_files_not_searched(self):
+        uncached = self.search(use_cache=False)
+        self.assertEqual(self.search(), uncached)
+        self.assertTrue(len(self.searched) > 0)
+        self.assertEqual(self.search(), uncached)
+        self.assertEqual(self.searched, [])
+
+    def test_changed_file_searched_again(self):
+        self.search()
+        changed = self.log_path('samtools', 'sample00001.stats')
+        self.change_file(changed)
+        found = self.search()
+        self.assertEqual(self.searched, [changed])
+        self.assertEqual(found, self.search(use_cache=False))
+
+    def test_new_file_searched(self):
+        self.search()
+        new = self.log_path('samtools', 'new_sample.stats')
+        shutil.copyfile(self.log_path('samtools', 'sample00001.stats'), new)
+        found = self.search()
+        self.assertEqual(self.searched, [new])
+        self.assertIn(new, found['samtools/stats'])
+        self.assertEqual(found, self.search(use_cache=False))
+
+    def test_module_subsets(self):
+        # Files are only searched again for the search pattern keys that weren't checked before
+        self.assertEqual(self.search(['samtools']), self.search(['samtools'], use_cache=False))
+        self.search(['samtools'])
+        self.assertEqual(self.searched, [])
+        found = self.search()
+        self.assertTrue(len(self.searched) > 0)
+        self.assertEqual(found, self.search(use_cache=False))
+        self.assertEqual(self.search(['fastqc', 'qualimap']), self.search(['fastqc', 'qualimap'], use_cache=False))
+        self.search(['fastqc', 'qualimap'])
+        self.assertEqual(self.searched, [])
+
+    def test_search_pattern_change_clears_cache(self):
+        self.search()
+        sp = dict(config.sp)
+        sp['samtools/stats'] = {'fn': '*.idxstats'}
+        self.set_config(sp=sp)
+        found = self.search()
+        self.assertEqual(len(self.searched), len(report.searchfiles))
+        self.assertEqual(found, self.search(use_cache=False))
+        self.assertIn(self.log_path('samtools', 'sample00001.idxstats'), found['samtools/stats'])
+
+    def test_config_change_clears_cache(self):
+        self.search()
+        self.set_config(log_filesize_limit=1000)
+        found = self.search()
+        self.assertEqual(len(self.searched), len(report.searchfiles))
+        self.assertEqual(found, self.search(use_cache=False))
+
+    def test_deleted_files_removed(self):
+        self.search()
+        deleted = self.log_path('samtools', 'sample00001.stats')
+        self.assertIn(deleted, self.cached_files())
+        os.remove(deleted)
+        found = self.search()
+        self.assertNotIn(deleted, found['samtools/stats'])
+        self.assertNotIn(deleted, self.cached_files())
+        self.assertIn(self.log_path('samtools', 'sample00002.stats'), self.cached_files())
+
+    def test_files_outside_search_kept(self):
+        self.search()
+        self.set_config(analysis_dir=[self.log_path('samtools')])
+        self.search()
+        self.assertIn(self.log_path('fastqc', 'sample00000_R1_fastqc', 'fastqc_data.txt'), self.cached_files())
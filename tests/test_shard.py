@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+""" Tests for building a report in two stages (--shard and --reduce) """
+
+from __future__ import print_function
+import io
+import os
+import zipfile
+
+from multiqc.utils import report, shard
+from tests.helpers import MultiqcTestCase, load_data
+
+
+class ShardReduceTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(ShardReduceTest, self).setUp()
+        self.logs = self.make_logs(samples=5)
+        self.single = self.path('single')
+
+    def run_shards(self, num_shards, shards=None):
+        """ Run each shard, then reduce them. Returns the report directory. """
+        shards_dir = self.path('shards_{}'.format(num_shards))
+        for i in shards or range(1, num_shards + 1):
+            self.run_multiqc(self.logs, '--shard', '{}/{}'.format(i, num_shards), '-o', shards_dir)
+            self.assertTrue(os.path.isfile(os.path.join(shards_dir, 'multiqc_shard_{}_of_{}.pkl.gz'.format(i, num_shards))))
+        out_dir = self.path('reduced_{}'.format(num_shards))
+        self.output = self.run_multiqc('--reduce', shards_dir, '-o', out_dir)
+        return out_dir
+
+    def test_same_as_single_run(self):
+        self.run_multiqc(self.logs, '-o', self.single)
+        for num_shards in [1, 3]:
+            self.assertSameData(self.run_shards(num_shards), self.single)
+
+    def test_sample_in_more_than_one_file(self):
+        # A zipped FastQC report with different data for a sample that
+        # is also unzipped. The unzipped report is used in a single run.
+        fastqc_dir = os.path.join(self.logs, 'fastqc')
+        with io.open(os.path.join(fastqc_dir, 'sample00000_R1_fastqc', 'fastqc_data.txt'), encoding='utf-8') as f:
+            contents = f.read().replace(u'Total Sequences\t', u'Total Sequences\t1')
+        with zipfile.ZipFile(os.path.join(fastqc_dir, 'sample00000_R1_fastqc.zip'), 'w') as z:
+            z.writestr('sample00000_R1_fastqc/fastqc_data.txt', contents.encode('utf-8'))
+        self.run_multiqc(self.logs, '-o', self.single)
+        self.assertSameData(self.run_shards(self.split_num_shards([
+            ['sample00000_R1_fastqc.zip', fastqc_dir],
+            ['fastqc_data.txt', os.path.join(fastqc_dir, 'sample00000_R1_fastqc')]
+        ])), self.single)
+
+    def split_num_shards(self, searchfiles):
+        """ A number of shards that puts these two files in different shards """
+        self.addCleanup(shard.search_order.clear)
+        for num_shards in range(2, 20):
+            self.set_config(shard=(1, num_shards))
+            if len(shard.select_files(searchfiles)) == 1:
+                return num_shards
+        self.fail("Couldn't split the files into different shards")
+
+    def test_missing_shard(self):
+        reduced = self.run_shards(3, shards=[1, 3])
+        self.assertIn('Missing shards: 2 of 3', self.output)
+        self.assertTrue(os.path.isfile(os.path.join(reduced, 'multiqc_report.html')))
+        self.assertTrue(len(load_data(reduced)['report_data_sources']) > 0)
+
+    def test_parse_shard(self):
+        self.assertEqual(shard.parse_shard('2/3'), (2, 3))
+        self.assertEqual(shard.parse_shard(' 1 / 1 '), (1, 1))
+        for value in ['0/3', '4/3', '3', 'a/b', '1/0']:
+            self.assertRaises(ValueError, shard.parse_shard, value)
+
+    def test_shard_without_files(self):
+        # Values that aren't dicts of samples come from a shard that found files
+        class Module(object):
+            anchor = 'test_module'
+            name = 'Test module'
+            state_attrs = ['samples', 'keys']
+        self.addCleanup(setattr, shard, 'shard_states', shard.shard_states)
+        self.addCleanup(report.data_sources.pop, Module.name, None)
+        shard.shard_states = [
+            {'module_states': {'test_module': {'samples': {}, 'keys': []}}, 'data_sources': {}},
+            {'module_states': {'test_module': {'samples': {'s1': 1}, 'keys': [1, 2]}},
+             'data_sources': {'Test module': {'all_sections': {'s1': '/logs/s1.txt'}}}}
+        ]
+        mod = Module()
+        shard.load_module_state(mod)
+        self.assertEqual(mod.samples, {'s1': 1})
+        self.assertEqual(mod.keys, [1, 2])
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+""" Tests for updating the report when files change (--watch) """
+
+from __future__ import print_function
+import copy
+import io
+import logging
+import os
+import shutil
+import signal
+import time
+import unittest
+
+from multiqc.utils import cache, config, report, watch
+from tests.helpers import MultiqcTestCase
+
+
+class FakeCommand(object):
+    """ Stands in for the multiqc command. Checks that each run starts with the
+    report and config as they were before the first run, then changes them. """
+
+    def __init__(self, test, num_runs):
+        self.test = test
+        self.num_runs = num_runs
+        self.runs = 0
+        self.handlers = list()
+
+    def main(self, args, standalone_mode):
+        self.runs += 1
+        self.test.assertEqual(args, ['--watch'])
+        self.test.assertEqual(report.general_stats_data, self.test.general_stats_data)
+        self.test.assertEqual(report.plot_data, self.test.plot_data)
+        self.test.assertEqual(config.fn_ignore_files, self.test.fn_ignore_files)
+        self.test.assertEqual(config.title, self.test.title)
+        self.test.assertFalse(hasattr(config, 'watch_test_value'))
+        self.test.assertEqual(config.logger.handlers, self.test.handlers)
+        report.general_stats_data.append({'sample_{}'.format(self.runs): {'reads': self.runs}})
+        report.plot_data['plot_{}'.format(self.runs)] = {'plot_type': 'bar_graph'}
+        config.fn_ignore_files.append('run_{}'.format(self.runs))
+        config.title = 'Run {}'.format(self.runs)
+        config.watch_test_value = self.runs
+        handler = logging.NullHandler()
+        config.logger.addHandler(handler)
+        self.handlers.append(handler)
+        if self.runs == self.num_runs:
+            raise KeyboardInterrupt
+        if self.runs == 2:
+            raise SystemExit(1)
+
+
+class WatchStateTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(WatchStateTest, self).setUp()
+        self.set_config(watch_interval=0)
+        for attr in ['general_stats_data', 'plot_data']:
+            self.addCleanup(setattr, report, attr, getattr(report, attr))
+        self.addCleanup(setattr, cache, 'memory_search_cache', cache.memory_search_cache)
+        self.addCleanup(setattr, watch, 'num_runs', watch.num_runs)
+        cache.memory_search_cache = None
+        self.general_stats_data = copy.deepcopy(report.general_stats_data)
+        self.plot_data = copy.deepcopy(report.plot_data)
+        self.fn_ignore_files = list(config.fn_ignore_files)
+        self.set_config(fn_ignore_files=list(config.fn_ignore_files))
+        self.title = config.title
+        self.set_config(title=config.title)
+        self.handlers = list(config.logger.handlers)
+
+    def test_state_restored_between_runs(self):
+        command = FakeCommand(self, 3)
+        watch.run(command, ['--watch'])
+        self.assertEqual(command.runs, 3)
+        self.assertFalse(watch.running)
+        self.assertFalse(os.path.exists(watch.files_tmp_dir))
+        # Stopping leaves the last run as it was
+        self.assertEqual(config.title, 'Run 3')
+        config.logger.removeHandler(command.handlers[-1])
+        del config.watch_test_value
+
+    def test_restore_state(self):
+        state = watch.save_state()
+        report.general_stats_data.append({'sample': {'reads': 1}})
+        config.fn_ignore_files.append('*.new')
+        config.watch_test_value = 1
+        handler = logging.NullHandler()
+        config.logger.addHandler(handler)
+        watch.restore_state(state)
+        self.assertEqual(report.general_stats_data, self.general_stats_data)
+        self.assertEqual(config.fn_ignore_files, self.fn_ignore_files)
+        self.assertFalse(hasattr(config, 'watch_test_value'))
+        self.assertNotIn(handler, config.logger.handlers)
+
+
+class FilesChangedTest(MultiqcTestCase):
+
+    def setUp(self):
+        super(FilesChangedTest, self).setUp()
+        self.logs = self.make_logs(formats=['samtools'])
+        self.set_config(
+            analysis_dir=[self.logs],
+            fn_ignore_files=config.fn_ignore_files + ['*.ignored'],
+            search_cache=False,
+            search_threads=None,
+            watch=True,
+            shard=None
+        )
+        for attr in ['files', 'searchfiles']:
+            self.addCleanup(setattr, report, attr, getattr(report, attr))
+        self.addCleanup(setattr, cache, 'memory_search_cache', cache.memory_search_cache)
+        cache.memory_search_cache = None
+        report.files = dict()
+        report.searchfiles = list()
+        report.get_filelist(['samtools'])
+        self.search_cache = cache.memory_search_cache
+
+    def log_path(self, *parts):
+        return os.path.join(self.logs, *parts)
+
+    def test_unchanged(self):
+        self.assertFalse(watch.files_changed(self.search_cache))
+
+    def test_changed_file(self):
+        path = self.log_path('samtools', 'sample00001.stats')
+        st = os.stat(path)
+        os.utime(path, (st.st_atime + 10, st.st_mtime + 10))
+        self.assertTrue(watch.files_changed(self.search_cache))
+
+    def test_new_file(self):
+        shutil.copyfile(self.log_path('samtools', 'sample00001.stats'), self.log_path('samtools', 'new_sample.stats'))
+        self.assertTrue(watch.files_changed(self.search_cache))
+
+    def test_deleted_file(self):
+        os.remove(self.log_path('samtools', 'sample00001.stats'))
+        self.assertTrue(watch.files_changed(self.search_cache))
+
+    def test_ignored_file(self):
+        with io.open(self.log_path('samtools', 'notes.ignored'), 'w', encoding='utf-8') as f:
+            f.write(u'Not a log\n')
+        self.assertFalse(watch.files_changed(self.search_cache))
+
+
+@unittest.skipUnless(os.name == 'posix', "Stopped with SIGINT")
+class WatchRunTest(MultiqcTestCase):
+
+    def wait_for_runs(self, proc, log_fn, num_runs, timeout=120):
+        """ Wait until MultiQC has finished making the report num_runs times """
+        start = time.time()
+        while time.time() - start < timeout:
+            with io.open(log_fn, encoding='utf-8', errors='replace') as f:
+                output = f.read()
+            if output.count('MultiQC complete') >= num_runs:
+                return
+            if proc.poll() is not None:
+                self.fail("MultiQC stopped watching:\n{}".format(output))
+            time.sleep(0.2)
+        self.fail("MultiQC didn't make the report {} times in {} seconds:\n{}".format(num_runs, timeout, output))
+
+    def test_report_updated(self):
+        logs = self.make_logs()
+        watched = self.path('watched')
+        log_fn = self.path('watch.log')
+        with io.open(log_fn, 'wb') as log_fh:
+            proc = self.start_multiqc([logs, '--watch', '-o', watched, '--cl-config', 'watch_interval: 0.2'], stdout=log_fh)
+        try:
+            self.wait_for_runs(proc, log_fn, 1)
+            # Only Samtools has to run again
+            shutil.copyfile(os.path.join(logs, 'samtools', 'sample00001.stats'), os.path.join(logs, 'samtools', 'new_sample.stats'))
+            self.wait_for_runs(proc, log_fn, 2)
+        finally:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGINT)
+            proc.wait()
+        with io.open(log_fn, encoding='utf-8', errors='replace') as f:
+            self.assertIn('Stopped watching', f.read())
+        single = self.path('single')
+        self.run_multiqc(logs, '-o', single)
+        self.assertSameData(watched, single)